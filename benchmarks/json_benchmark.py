@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+.. module:: benchmarks.json_benchmark
+   :synopsis: Compare the installed JSON codecs on vmpooler payloads.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+
+Decodes and encodes the payloads the client handles most through "vmpooler_client.jsoncodec"
+with every installed codec: token information with many running VMs, VM information, the list
+of templates, the configuration file and journal lines. Install ujson or simplejson to compare
+them with the json module.
+
+Usage:
+  python benchmarks/json_benchmark.py [--vms COUNT] [--repeat COUNT]
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+import sys
+from argparse import ArgumentParser
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vmpooler_client import jsoncodec
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+AUTH_TOKEN = 'bdct6vxix5yfxndry32kmark0pyhriq9'
+
+#===================================================================================================
+# Functions
+#===================================================================================================
+def build_payloads(vm_count):
+  """Build the values of each payload, keyed by a description."""
+
+  hostnames = ['{:015x}'.format(i * 7919) for i in range(vm_count)]
+
+  return [('token info ({} VMs)'.format(vm_count),
+           {'ok': True,
+            AUTH_TOKEN: {'user': 'ryan.gard',
+                         'created': '2016-01-01 00:00:00 -0700',
+                         'last': '2016-01-02 00:00:00 -0700',
+                         'vms': {'running': hostnames}}}),
+          ('vm info',
+           {'ok': True,
+            hostnames[0]: {'template': 'centos-7-x86_64',
+                           'lifetime': 12,
+                           'running': 4.27,
+                           'state': 'running',
+                           'tags': {'user': 'ryan.gard', 'jenkins_build_url': 'https://ci/1/'},
+                           'domain': 'delivery.puppetlabs.net'}}),
+          ('template list',
+           ['{}-{}-x86_64'.format(os_name, version)
+            for os_name in ('centos', 'debian', 'redhat', 'sles', 'ubuntu', 'win')
+            for version in range(20)]),
+          ('config',
+           {'auth_token': AUTH_TOKEN,
+            'vmpooler_hostname': 'vmpooler.delivery.puppetlabs.net',
+            'max_workers': '16',
+            'hedge_requests': 'true'}),
+          ('journal line', {'d': hostnames[0]})]
+
+
+def measure(func, repeat):
+  """Return the best seconds per call of a function over several rounds."""
+
+  calls = 1
+  elapsed = 0
+
+  # Call the function often enough per round to measure it accurately.
+  while True:
+    start = time()
+
+    for _ in range(calls):
+      func()
+
+    elapsed = time() - start
+
+    if elapsed >= 0.05:
+      break
+
+    calls *= 4
+
+  best = elapsed
+
+  for _ in range(repeat - 1):
+    start = time()
+
+    for _ in range(calls):
+      func()
+
+    best = min(best, time() - start)
+
+  return best / calls
+
+
+def main(argv):
+  """Run the benchmark and print a table of the results."""
+
+  parser = ArgumentParser(description='Compare the installed JSON codecs on vmpooler payloads.')
+  parser.add_argument('--vms', type=int, default=5000, help='Running VMs in the token info.')
+  parser.add_argument('--repeat', type=int, default=5, help='The number of rounds per payload.')
+  args = parser.parse_args(argv)
+
+  codecs = jsoncodec.available()
+  selected = jsoncodec.codec()
+
+  print('Installed codecs: {} (default: {})'.format(', '.join(codecs), selected))
+  print('{:<26} {:<7}'.format('payload', 'op') +
+        ''.join('{:>17}'.format(name + ' (us)') for name in codecs))
+
+  try:
+    for description, value in build_payloads(args.vms):
+      text = jsoncodec.dumps(value)
+
+      for op, func in (('decode', lambda: jsoncodec.loads(text)),
+                       ('encode', lambda: jsoncodec.dumps(value))):
+        results = []
+
+        for name in codecs:
+          jsoncodec.use(name)
+          results.append(measure(func, args.repeat))
+
+        print('{:<26} {:<7}'.format(description, op) +
+              ''.join('{:>17.1f}'.format(result * 1e6) for result in results))
+  finally:
+    jsoncodec.use(selected)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+.. module:: benchmarks.startup_benchmark
+   :synopsis: Measure the time from CLI startup to the first response byte with and without
+     connection pre-warming.
+   :platform: Unix, Linux
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+
+Runs "vmpooler_client_app.main" for "vm list" against a local HTTP server in a forked process per
+run. A loopback connection is set up far faster than one to a real vmpooler, so the DNS lookup
+of every run is delayed by "--latency" milliseconds to stand in for the lookup and TCP
+handshake. The time to the first byte is measured from the call to "main" with a request hook.
+
+Usage:
+  python benchmarks/startup_benchmark.py [--latency MS] [--repeat COUNT]
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+import socket
+import sys
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from json import dumps, loads
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import vmpooler_client_app
+from vmpooler_client import hooks
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+AUTH_TOKEN = 'bdct6vxix5yfxndry32kmark0pyhriq9'
+
+#===================================================================================================
+# Functions
+#===================================================================================================
+def serve(body):
+  """Serve the body from a forked process and return its pid and address."""
+
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+
+  if pid:
+    os.close(write_fd)
+    port = int(os.read(read_fd, 16))
+    os.close(read_fd)
+
+    return pid, '127.0.0.1:{}'.format(port)
+
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = HTTPServer(('127.0.0.1', 0), Handler)
+  os.write(write_fd, str(server.server_address[1]))
+  os.close(write_fd)
+
+  try:
+    server.serve_forever()
+  finally:
+    os._exit(0)
+
+
+def measure(home, latency):
+  """Run "vm list" in a forked process and return the seconds from the call to "main" until the
+  first byte of the response arrived."""
+
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+
+  if pid:
+    os.close(write_fd)
+    result = os.read(read_fd, 4096)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    return loads(result)
+
+  try:
+    os.environ['HOME'] = home
+    getaddrinfo = socket.getaddrinfo
+
+    def _slow_getaddrinfo(*args, **kwargs):
+      sleep(latency)
+      return getaddrinfo(*args, **kwargs)
+
+    socket.getaddrinfo = _slow_getaddrinfo
+
+    first_byte = []
+    request_start = []
+
+    hooks.register(before_request=lambda event: request_start.append(time()),
+                   after_response=lambda event: first_byte.append(request_start[0] +
+                                                                  event.timings['first_byte']))
+
+    devnull = open(os.devnull, 'w')
+    os.dup2(devnull.fileno(), 1)
+
+    start = time()
+    vmpooler_client_app.main(['vmpooler_client', 'vm', 'list'])
+
+    os.write(write_fd, dumps(first_byte[0] - start))
+  finally:
+    os._exit(0)
+
+
+def main(argv):
+  """Run the benchmark and print a table of the results."""
+
+  parser = ArgumentParser(description='Measure startup-to-first-byte with connection pre-warming.')
+  parser.add_argument('--latency', type=float, default=30, help='Connection setup delay in ms.')
+  parser.add_argument('--repeat', type=int, default=10, help='The number of runs per approach.')
+  args = parser.parse_args(argv)
+
+  pid, host = serve(dumps(['centos-7-x86_64', 'win-2012r2-x86_64']))
+  home = mkdtemp()
+
+  try:
+    print('Emulated connection setup: {:.0f} ms'.format(args.latency))
+    print('{:<10} {:>22} {:>22}'.format('approach', 'first byte best (ms)', 'first byte mean (ms)'))
+
+    for name, prewarm in (('cold', False), ('prewarmed', True)):
+      with open(os.path.join(home, '.vmpooler.conf'), 'w') as f:
+        f.write(dumps({'vmpooler_hostname': host,
+                       'auth_token': AUTH_TOKEN,
+                       'prewarm_connection': prewarm}))
+
+      results = [measure(home, args.latency / 1000.0) for _ in range(args.repeat)]
+
+      print('{:<10} {:>22.1f} {:>22.1f}'.format(name,
+                                                min(results) * 1000,
+                                                sum(results) / len(results) * 1000))
+  finally:
+    rmtree(home)
+    os.kill(pid, 15)
+    os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+.. module:: benchmarks.vm_record_benchmark
+   :synopsis: Compare VM information dictionaries with compact VM records.
+   :platform: Unix, Linux
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+
+Parses generated "/vm/<hostname>" responses and holds them either as the dictionaries returned by
+"info_vm" or as "VmRecord" objects, then sorts them on how long they have been running. Every
+approach runs in a forked process so that its peak memory can be read from "getrusage".
+
+Usage:
+  python benchmarks/vm_record_benchmark.py [--vms COUNT] [--repeat COUNT]
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+import sys
+from argparse import ArgumentParser
+from json import dumps, loads
+from operator import attrgetter
+from resource import getrusage, RUSAGE_SELF
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vmpooler_client.records import VmRecord
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+TEMPLATES = ['centos-7-x86_64', 'debian-8-x86_64', 'ubuntu-1604-x86_64', 'win-2012r2-x86_64',
+             'redhat-7-x86_64', 'sles-12-x86_64', 'osx-1011-x86_64', 'solaris-11-x86_64']
+
+#===================================================================================================
+# Functions
+#===================================================================================================
+def build_responses(vm_count):
+  """Build a "/vm/<hostname>" response for each VM."""
+
+  responses = []
+
+  for i in range(vm_count):
+    hostname = '{:015x}'.format(i * 7919)
+    info = {'template': TEMPLATES[i % len(TEMPLATES)],
+            'lifetime': 24,
+            'running': '{:.2f}'.format((i * 37 % 2400) / 100.0),
+            'state': 'running',
+            'tags': {},
+            'domain': 'delivery.puppetlabs.net'}
+
+    responses.append((hostname, dumps({'ok': True, hostname: info})))
+
+  return responses
+
+
+def as_dicts(responses):
+  """Hold the VMs as "info_vm" dictionaries and sort them the way "vm running" used to."""
+
+  vm_info_dict = dict((hostname, loads(text)[hostname]) for hostname, text in responses)
+
+  start = time()
+  sorted(vm_info_dict.items(), key=lambda (k, v): float(v["running"]), reverse=True)
+
+  return vm_info_dict, time() - start
+
+
+def as_records(responses):
+  """Hold the VMs as records and sort them the way "vm running" does now."""
+
+  records = [VmRecord.from_info(hostname, loads(text)[hostname]) for hostname, text in responses]
+
+  start = time()
+  records.sort(key=attrgetter('running'), reverse=True)
+
+  return records, time() - start
+
+
+def measure(func, responses, repeat):
+  """Run the function in a forked process and return its best sort time and peak memory growth."""
+
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+
+  if pid:
+    os.close(write_fd)
+    result = b''
+
+    while True:
+      data = os.read(read_fd, 4096)
+
+      if not data:
+        break
+
+      result += data
+
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    return loads(result)
+
+  try:
+    baseline = getrusage(RUSAGE_SELF).ru_maxrss
+    held, sort_time = func(responses)
+    peak_kb = getrusage(RUSAGE_SELF).ru_maxrss - baseline
+    sort_times = [sort_time] + [func(responses)[1] for _ in range(repeat - 1)]
+
+    os.write(write_fd, dumps({'sort': min(sort_times), 'peak_kb': peak_kb}))
+  finally:
+    os._exit(0)
+
+
+def main(argv):
+  """Run the benchmark and print a table of the results."""
+
+  parser = ArgumentParser(description='Compare VM information dictionaries with VM records.')
+  parser.add_argument('--vms', type=int, default=10000, help='The number of VMs.')
+  parser.add_argument('--repeat', type=int, default=5, help='The number of sorts per approach.')
+  args = parser.parse_args(argv)
+
+  responses = build_responses(args.vms)
+
+  print('{} VMs'.format(args.vms))
+  print('{:<10} {:>14} {:>18}'.format('approach', 'sort (ms)', 'peak growth (KiB)'))
+
+  for name, func in (('dicts', as_dicts), ('records', as_records)):
+    result = measure(func, responses, args.repeat)
+
+    print('{:<10} {:>14.2f} {:>18}'.format(name, result['sort'] * 1000, result['peak_kb']))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,72 @@
+"""
+.. module:: vmpooler_client.tests.unit.app_tests
+   :synopsis: Unit tests for the start-up steps of the command-line application.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import vmpooler_client_app
+from vmpooler_client import metrics, service
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class AppTests(TestCase):
+  """Tests for the vmpooler_client_app module."""
+
+  def setUp(self):
+    self.config = {'vmpooler_hostname': 'vmpooler.delivery.puppetlabs.net',
+                   'metrics_port': '9465'}
+
+  def _parse(self, *argv):
+    """Parse a command-line with the parser of the application."""
+
+    return vmpooler_client_app.configure_command_parser(['vmpooler_client_app.py'] +
+                                                        list(argv)).parse()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_serve_metrics(self):
+    """Verify metrics are served only for the commands which keep running, whatever global
+    options come before them."""
+
+    with patch.object(metrics, 'serve') as mock_serve:
+      vmpooler_client_app.serve_metrics(self._parse('--profile', 'cpu', 'shell'), self.config)
+      vmpooler_client_app.serve_metrics(self._parse('--hook', 'mod:fn', 'proxy'), self.config)
+
+      self.assertEqual(mock_serve.call_count, 2)
+      mock_serve.assert_called_with(9465)
+
+      mock_serve.reset_mock()
+      vmpooler_client_app.serve_metrics(self._parse('--hook', 'shell:fn', 'vm', 'list'),
+                                        self.config)
+
+    self.assertFalse(mock_serve.called)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_prewarm_connection(self):
+    """Verify the connection is pre-warmed only for commands which contact the vmpooler."""
+
+    with patch.object(service, 'prewarm') as mock_prewarm:
+      vmpooler_client_app.prewarm_connection(self._parse('--profile', 'cpu', 'config', 'list'),
+                                             self.config)
+      vmpooler_client_app.prewarm_connection(
+        self._parse('--replay-cassette', 'vm.cassette', 'vm', 'list'), self.config)
+
+      self.assertFalse(mock_prewarm.called)
+
+      vmpooler_client_app.prewarm_connection(self._parse('--hook', 'config:fn', 'vm', 'list'),
+                                             self.config)
+
+    mock_prewarm.assert_called_once_with('vmpooler.delivery.puppetlabs.net')
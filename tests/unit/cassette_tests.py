@@ -0,0 +1,196 @@
+"""
+.. module:: vmpooler_client.tests.unit.cassette_tests
+   :synopsis: Unit tests for recording and replaying exchanges with the vmpooler.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+from json import dumps, load
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from vmpooler_client import cassette, service
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+HOST = 'vmpooler.example.com'
+TOKEN = 'bdct6vxix5yfxndry32kmark0pyhriq9'
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+_RESPONSES = {
+  ('GET', '/vm'): '["centos-7-x86_64", "debian-8-x86_64"]',
+  ('POST', '/vm/centos-7-x86_64'): '{"ok": true, "centos-7-x86_64": {"hostname": "a1"}}',
+  ('GET', '/token/' + TOKEN): dumps({'ok': True, TOKEN: {'vms': {'running': ['a1', 'b2']}}}),
+  ('POST', '/token'): dumps({'ok': True, 'token': TOKEN}),
+  ('DELETE', '/token/' + TOKEN): '{"ok": true}'
+}
+
+
+def _fake_send_request(method, host, path, body, headers, timings, pool=None, cancellation=None):
+  """Answer a request like the vmpooler would, after a made up latency."""
+
+  timings.update(connect=0.01, first_byte=0.04, total=0.05)
+
+  return service._Response(200, 'OK', [('Content-Type', 'application/json')],
+                           _RESPONSES[(method, path)])
+
+
+def _info_exchange(vm_name, total):
+  """Build a recorded exchange for the information of a VM."""
+
+  return {'method': 'GET',
+          'path': '/vm/{}'.format(vm_name),
+          'body': '',
+          'status': 200,
+          'reason': 'OK',
+          'headers': [['Content-Type', 'application/json']],
+          'response': dumps({'ok': True, vm_name: {'template': 'centos-7-x86_64'}}),
+          'sent': 0.0,
+          'connect': 0.0,
+          'first_byte': total,
+          'total': total}
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class CassetteTests(TestCase):
+  """Tests for recording and replaying cassettes."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'cassette.json')
+
+  def tearDown(self):
+    rmtree(self.tmp_dir)
+
+  def write_cassette(self, exchanges):
+    with open(self.path, 'w') as cassette_file:
+      cassette_file.write(dumps({'version': cassette.FORMAT_VERSION, 'exchanges': exchanges}))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_record_and_replay(self):
+    """Verify recorded commands replay with the same results and round trips."""
+
+    def commands():
+      return (service.list_vm(HOST, TOKEN),
+              service.get_vm(HOST, 'centos-7-x86_64', TOKEN),
+              service.get_running_vms(HOST, TOKEN))
+
+    with patch.object(service, '_send_request', side_effect=_fake_send_request):
+      with cassette.recording(self.path) as recorder:
+        recorded = commands()
+
+    self.assertEqual(len(recorder.exchanges), 3)
+
+    # Credentials are never written to the cassette.
+    with open(self.path) as cassette_file:
+      self.assertNotIn('X-AUTH-TOKEN', cassette_file.read())
+
+    with open(self.path) as cassette_file:
+      self.assertEqual(load(cassette_file)['exchanges'][1]['first_byte'], 0.04)
+
+    with patch.object(service, '_send_request', side_effect=AssertionError('network')):
+      with cassette.replaying(self.path, speed=0) as player:
+        self.assertEqual(commands(), recorded)
+
+    self.assertEqual(player.requests,
+                     ['GET /vm', 'POST /vm/centos-7-x86_64', 'GET /token/' + TOKEN])
+    self.assertEqual(player.unplayed(), 0)
+    self.assertIsNone(service._transport)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_repeated_requests_in_order(self):
+    """Verify repeated requests are answered in the order they were recorded."""
+
+    first = _info_exchange('a1', 0)
+    second = _info_exchange('a1', 0)
+    second['status'] = 404
+
+    self.write_cassette([first, second])
+
+    with cassette.replaying(self.path, speed=0) as player:
+      self.assertEqual(service.info_vm(HOST, 'a1', TOKEN), {'template': 'centos-7-x86_64'})
+
+      with self.assertRaises(service.VmNotFoundError):
+        service.info_vm(HOST, 'a1', TOKEN)
+
+    self.assertEqual(player.requests, ['GET /vm/a1', 'GET /vm/a1'])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_unrecorded_request_neg(self):
+    """Negative test case for a request missing from the cassette."""
+
+    self.write_cassette([_info_exchange('a1', 0)])
+
+    with cassette.replaying(self.path, speed=0) as player:
+      with self.assertRaises(RuntimeError):
+        service.info_vm(HOST, 'b2', TOKEN)
+
+    self.assertEqual(player.unplayed(), 1)
+
+    with self.assertRaises(RuntimeError):
+      cassette.Player(os.path.join(self.tmp_dir, 'missing.json'))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_replay_latency(self):
+    """Verify replayed exchanges take their recorded latency scaled by the speed."""
+
+    vm_names = ['a1', 'b2', 'c3', 'd4']
+
+    self.write_cassette([_info_exchange(vm_name, 0.2) for vm_name in vm_names])
+
+    with cassette.replaying(self.path, speed=0.5) as player:
+      start = time()
+      service.info_vm(HOST, 'a1', TOKEN)
+      self.assertGreaterEqual(time() - start, 0.1)
+
+    # The information of several VMs is retrieved concurrently.
+    with cassette.replaying(self.path) as player:
+      start = time()
+      service.info_vms(HOST, vm_names, TOKEN, workers=4)
+      elapsed = time() - start
+
+    self.assertGreaterEqual(elapsed, 0.2)
+    self.assertLess(elapsed, 0.6)
+    self.assertEqual(sorted(player.requests), ['GET /vm/' + vm_name for vm_name in vm_names])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_tokens_redacted(self):
+    """Verify auth tokens are left out of the cassette and put back when replayed."""
+
+    def commands():
+      return (service.create_auth_token(HOST, 'user', 'secret'),
+              service.get_token_info(HOST, TOKEN),
+              service.revoke_auth_token(HOST, 'user', 'secret', TOKEN))
+
+    with patch.object(service, '_send_request', side_effect=_fake_send_request):
+      with cassette.recording(self.path):
+        self.assertEqual(commands()[:2], (TOKEN, {'vms': {'running': ['a1', 'b2']}}))
+
+    with open(self.path) as cassette_file:
+      saved = cassette_file.read()
+
+    self.assertNotIn(TOKEN, saved)
+    self.assertNotIn('secret', saved)
+
+    with cassette.replaying(self.path, speed=0) as player:
+      self.assertEqual(commands()[1:2], ({'vms': {'running': ['a1', 'b2']}},))
+
+    self.assertEqual(player.unplayed(), 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,145 @@
+"""
+.. module:: vmpooler_client.tests.unit.completion_tests
+   :synopsis: Unit tests for shell completion.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import completion
+from vmpooler_client.command_parser import CommandParser
+from vmpooler_client.records import VmRecord
+from vmpooler_client.vmcache import VmCache
+from distutils.spawn import find_executable
+from os.path import join
+from shutil import rmtree
+from subprocess import check_output
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class CompletionTests(TestCase):
+  """Tests for the completion module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.cache_path = join(self.tmp_dir, '.vmpooler.cache')
+    self.index_path = join(self.tmp_dir, '.vmpooler.completion')
+    self.config = {'vmpooler_hostname': 'vmpooler.delivery.puppetlabs.net',
+                   'auth_token': 'bdct6vxix5yfxndry32kmark0pyhriq9'}
+
+  def tearDown(self):
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_render_script(self):
+    """Verify the command tree is written into the script and values come from the index."""
+
+    cmd_parser = CommandParser([])
+    cmd_parser.add_command('version', desc='Print the version', func=None)
+    cmd_parser.add_command('vm', desc='Manage VMs')
+    cmd_parser.add_sub_command('vm', 'get', desc='Get VMs', func=None)
+    cmd_parser.add_sub_command_arg('vm', 'get', name='--ready', action='store_true')
+    cmd_parser.add_sub_command('vm', 'info', desc='Show a VM', func=None)
+
+    script = completion.render_script('zsh', cmd_parser, self.index_path, self.cache_path)
+
+    self.assertIn('bashcompinit', script)
+    self.assertIn("candidates='version vm'", script)
+    self.assertIn("vm) candidates='get info';;", script)
+    self.assertIn("'vm get') candidates='--help --ready -h';;", script)
+    self.assertIn("'vm get') candidates=\"$(_vmpooler_client_index t)\";;", script)
+    self.assertIn("'vm info') candidates=\"$([ $positional -eq 0 ] && _vmpooler_client_index h)\"",
+                  script)
+    self.assertIn(self.index_path, script)
+
+    with self.assertRaises(ValueError):
+      completion.render_script('fish', cmd_parser, self.index_path, self.cache_path)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_refresh_cache(self):
+    """Verify only uncached VMs are requested and VMs remembered meanwhile are kept."""
+
+    cache = VmCache(self.cache_path)
+    cache.remember('a', 'centos-7-x86_64')
+    cache.remember('gone', 'centos-7-x86_64')
+    cache.save()
+
+    def _info_vms(vmpooler_hostname, vm_names, auth_token, workers):
+      self.assertEqual(vm_names, ['b'])
+
+      # A command run while the refresh was in flight.
+      cache.remember('new', 'debian-8-x86_64')
+      cache.save()
+
+      return [VmRecord('b', 'win-2012r2-x86_64', running=1.0)]
+
+    with patch.object(completion, 'list_vm', return_value=['win-2012r2-x86_64']), \
+         patch.object(completion, 'get_running_vms', return_value=['a', 'b']), \
+         patch.object(completion, 'info_vms', side_effect=_info_vms):
+      completion.refresh_cache(self.config, self.cache_path)
+
+    completion.write_index(VmCache(self.cache_path), self.index_path)
+
+    with open(self.index_path, 'r') as f:
+      self.assertEqual(f.read(), 't win-2012r2-x86_64\nh a\nh b\nh new\n')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_refresh_cache_unconfigured(self):
+    """Verify nothing is requested when there is no token to use."""
+
+    with patch.object(completion, 'list_vm') as list_vm:
+      completion.refresh_cache({'vmpooler_hostname': 'vmpooler'}, self.cache_path)
+
+    self.assertFalse(list_vm.called)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  @skipIf(find_executable('bash') is None, 'Completion scripts need bash!')
+  def test04_global_options(self):
+    """Verify global options and their values before the command are skipped."""
+
+    cmd_parser = CommandParser([])
+    cmd_parser.add_global_arg(name='--profile', choices=['cpu', 'mem'])
+    cmd_parser.add_global_arg(name='--timings', action='store_true')
+    cmd_parser.add_command('vm', desc='Manage VMs')
+    cmd_parser.add_sub_command('vm', 'get', desc='Get VMs', func=None)
+    cmd_parser.add_sub_command('vm', 'info', desc='Show a VM', func=None)
+
+    script = join(self.tmp_dir, 'completion.bash')
+
+    with open(script, 'w') as f:
+      f.write(completion.render_script('bash', cmd_parser, self.index_path, self.cache_path))
+
+    completion.write_index(VmCache(self.cache_path), self.index_path)
+
+    with open(self.index_path, 'a') as f:
+      f.write('t centos-7-x86_64\nh a1\n')
+
+    def _complete(*words):
+      # The first word stands in for the program, which is run to refresh a stale index.
+      line = ' '.join("'{}'".format(word) for word in ('true',) + words)
+
+      return check_output(['bash', '-c',
+                           'source "$0"; COMP_WORDS=({}); COMP_CWORD={}; _vmpooler_client; '
+                           'echo "${{COMPREPLY[*]}}"'.format(line, len(words)),
+                           script]).strip()
+
+    self.assertEqual(_complete('--profile', 'cpu', ''), 'vm')
+    self.assertEqual(_complete('--profile', 'cpu', 'vm', ''), 'get info')
+    self.assertEqual(_complete('--timings', '--profile', 'cpu', 'vm', 'get', ''),
+                     'centos-7-x86_64')
+    self.assertEqual(_complete('--profile', 'cpu', 'vm', 'info', 'a'), 'a1')
+    self.assertEqual(_complete('--profile', ''), '')
+    self.assertEqual(_complete('--t'), '--timings')
@@ -0,0 +1,240 @@
+"""
+.. module:: vmpooler_client.tests.unit.connpool_tests
+   :synopsis: Unit tests for reusing keep-alive connections.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import service
+from vmpooler_client.connpool import ConnectionPool
+from vmpooler_client.hedging import CancelledError, Cancellation
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from socket import error as socket_error, socket, SHUT_RDWR
+from threading import Event, Thread
+from time import sleep
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.server.connections.add(self.client_address)
+
+    # Simulate a server which does not answer until the test is over.
+    if self.path == '/hang':
+      self.server.hanging.set()
+      self.server.released.wait(5)
+      self.close_connection = 1
+      return
+
+    self.send_response(200)
+    self.send_header('Content-Length', '2')
+    self.end_headers()
+    self.wfile.write('{}')
+
+    # Simulate a server closing an idle keep-alive connection.
+    if self.path == '/close':
+      self.close_connection = 1
+
+  do_DELETE = do_GET
+
+  def do_POST(self):
+    self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+    self.do_GET()
+
+  def log_message(self, *args):
+    pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class _HangingResolver(object):
+  """A resolver which does not connect until it is released."""
+
+  def __init__(self):
+    self.released = Event()
+
+  def connect(self, host, port, timeout):
+    self.released.wait()
+    raise socket_error('Connection timed out')
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ConnectionPoolTests(TestCase):
+  """Tests for the connpool module."""
+
+  def setUp(self):
+    self.server = _Server(('127.0.0.1', 0), _KeepAliveHandler)
+    self.server.connections = set()
+    self.server.hanging = Event()
+    self.server.released = Event()
+    self.host = '127.0.0.1:{}'.format(self.server.server_address[1])
+
+    thread = Thread(target=self.server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+
+  def tearDown(self):
+    self.server.released.set()
+    self.server.shutdown()
+    self.server.server_close()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_reuse(self):
+    """Verify idempotent requests share one keep-alive connection."""
+
+    pool = ConnectionPool()
+
+    with patch.object(service, '_pool', pool):
+      for method in ('GET', 'DELETE', 'GET'):
+        resp = service._send_request(method, self.host, '/vm', '', {}, {})
+        self.assertEqual(resp.read(), '{}')
+
+    self.assertEqual(len(self.server.connections), 1)
+    self.assertEqual((pool.created, pool.reused), (1, 2))
+    pool.clear()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_closed_connection_retried(self):
+    """Verify a request on a connection the server has closed is retried on a new one."""
+
+    pool = ConnectionPool()
+
+    with patch.object(service, '_pool', pool):
+      service._send_request('GET', self.host, '/close', '', {}, {})
+
+      # The client cannot tell that the server closed the connection until it is reused.
+      resp = service._send_request('GET', self.host, '/vm', '', {}, {})
+
+    self.assertEqual(resp.status, 200)
+    self.assertEqual(len(self.server.connections), 2)
+    pool.clear()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_idle_timeout(self):
+    """Verify connections idle for longer than the timeout are not reused."""
+
+    pool = ConnectionPool(idle_timeout=0)
+
+    with patch.object(service, '_pool', pool):
+      for _ in range(2):
+        service._send_request('GET', self.host, '/vm', '', {}, {})
+
+    self.assertEqual((pool.created, pool.reused), (2, 0))
+    pool.clear()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_prewarm(self):
+    """Verify the pre-warmed connection is handed to the first request, even if not pooled."""
+
+    pool = ConnectionPool()
+    pool.prewarm(self.host)
+
+    with patch.object(service, '_pool', pool):
+      service._send_request('POST', self.host, '/vm', '', {}, {})
+
+    self.assertEqual(len(self.server.connections), 1)
+    self.assertEqual((pool.created, pool.prewarmed), (1, 1))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_prewarm_failure(self):
+    """Verify a request connects by itself when pre-warming failed."""
+
+    # Nothing listens on a port which was just released.
+    sock = socket()
+    sock.bind(('127.0.0.1', 0))
+    host = '127.0.0.1:{}'.format(sock.getsockname()[1])
+    sock.close()
+
+    pool = ConnectionPool()
+    pool.prewarm(host)
+    conn, connected = pool.open(host)
+
+    self.assertFalse(connected)
+    self.assertIsNone(conn.sock)
+    self.assertEqual(pool.prewarmed, 0)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test06_stale_prewarm_not_used(self):
+    """Verify a request which is not idempotent does not use a stale pre-warmed connection."""
+
+    pool = ConnectionPool(idle_timeout=0.1)
+    pool.prewarm(self.host)
+    pool._warming[self.host][1].wait()
+
+    # Simulate the server closing the pre-warmed connection while it sits unused.
+    pool._warming[self.host][0].sock.shutdown(SHUT_RDWR)
+    sleep(0.2)
+
+    with patch.object(service, '_pool', pool):
+      resp = service._send_request('POST', self.host, '/token', '{}', {}, {})
+
+    self.assertEqual(resp.status, 200)
+    self.assertEqual(pool.prewarmed, 0)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test07_prewarm_timeout(self):
+    """Verify a request stops waiting for a pre-warmed connection which takes too long."""
+
+    resolver = _HangingResolver()
+    pool = ConnectionPool(resolver=resolver)
+
+    with patch('vmpooler_client.connpool.PREWARM_TIMEOUT', 0.1), \
+         patch('vmpooler_client.connpool._POLL_INTERVAL', 0.02):
+      pool.prewarm(self.host)
+      conn, connected = pool.open(self.host)
+
+    resolver.released.set()
+
+    self.assertFalse(connected)
+    self.assertEqual(pool.prewarmed, 0)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test08_cancelled_request(self):
+    """Verify cancelling a request in flight stops it at once and closes its connection."""
+
+    pool = ConnectionPool()
+    cancellation = Cancellation()
+    errors = []
+
+    def _send():
+      try:
+        service._send_request('GET', self.host, '/hang', '', {}, {}, pool, cancellation)
+      except Exception as e:
+        errors.append(e)
+
+    thread = Thread(target=_send)
+    thread.daemon = True
+    thread.start()
+
+    self.assertTrue(self.server.hanging.wait(5))
+    cancellation.cancel()
+    thread.join(2)
+
+    self.assertFalse(thread.is_alive())
+    self.assertEqual(len(errors), 1)
+    self.assertIsInstance(errors[0], CancelledError)
+
+    # The connection of the cancelled request is not returned to the pool.
+    service._send_request('GET', self.host, '/vm', '', {}, {}, pool)
+
+    self.assertEqual((pool.created, pool.reused), (2, 0))
+    pool.clear()
@@ -0,0 +1,174 @@
+"""
+.. module:: vmpooler_client.tests.unit.hedging_tests
+   :synopsis: Unit tests for hedging idempotent requests.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import service
+from vmpooler_client.hedging import CancelledError, Cancellation, HedgeBudget, HedgePolicy, \
+  LatencyTracker
+from threading import Event, Lock
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+class _HttpResponse(object):
+  def __init__(self, status, return_value='default', reason='default'):
+    self.status = status
+    self.reason = reason
+    self.closed = False
+    self._return_value = return_value
+
+  def read(self):
+    return self._return_value
+
+  def close(self):
+    self.closed = True
+
+
+class _SlowFirstAttempt(object):
+  """An attempt whose first call blocks until released or cancelled and whose later calls return
+  at once."""
+
+  def __init__(self, first, rest):
+    self.calls = 0
+    self.cancelled = Event()
+    self.release = Event()
+    self._first = first
+    self._rest = rest
+    self._lock = Lock()
+
+  def __call__(self, cancellation):
+    with self._lock:
+      self.calls += 1
+      call = self.calls
+
+    if call == 1:
+      cancellation.attach(self.release.set)
+      self.release.wait(5)
+
+      if not cancellation.detach():
+        self.cancelled.set()
+        raise CancelledError('cancelled')
+
+      return self._first
+
+    return self._rest
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class HedgingTests(TestCase):
+  """Tests for the hedging module."""
+
+  def tearDown(self):
+    service.disable_hedging()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_threshold_percentile(self):
+    """Verify the threshold is the initial delay until warm and the percentile afterwards."""
+
+    tracker = LatencyTracker(percentile=90, min_samples=10, initial_delay=0.75)
+
+    self.assertEqual(tracker.threshold('GET /vm'), 0.75)
+
+    for sample in range(1, 11):
+      tracker.record('GET /vm', sample / 10.0)
+
+    self.assertEqual(tracker.threshold('GET /vm'), 0.9)
+    self.assertEqual(tracker.threshold('GET /vm/<hostname>'), 0.75)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_budget_caps_hedges(self):
+    """Verify hedges never exceed the configured fraction of requests plus the burst."""
+
+    budget = HedgeBudget(max_ratio=0.1, burst=1.0)
+
+    for _ in range(100):
+      budget.record_request()
+      budget.try_acquire()
+
+    self.assertLessEqual(budget.hedges, 11)
+    self.assertGreaterEqual(budget.hedges, 10)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_slow_request_hedged(self):
+    """Verify a slow request is hedged, the hedge wins and the loser is cancelled."""
+
+    slow = _HttpResponse(200, 'slow')
+    fast = _HttpResponse(200, 'fast')
+    attempt = _SlowFirstAttempt(slow, fast)
+    policy = HedgePolicy(initial_delay=0.01)
+
+    resp = policy.call('GET /vm', attempt, discard=lambda r: r.close())
+
+    self.assertIs(resp, fast)
+    self.assertTrue(attempt.cancelled.wait(5))
+    self.assertFalse(slow.closed)
+    self.assertEqual(attempt.calls, 2)
+    self.assertEqual(policy.budget.hedges, 1)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_fast_request_not_hedged(self):
+    """Verify a request answered within the threshold is not hedged."""
+
+    resp = _HttpResponse(200)
+    policy = HedgePolicy(initial_delay=5)
+
+    self.assertIs(policy.call('GET /vm', lambda cancellation: resp), resp)
+    self.assertEqual(policy.budget.hedges, 0)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_failed_attempt_propagates(self):
+    """Verify the error is raised when every attempt fails."""
+
+    def _fail(cancellation):
+      raise RuntimeError('boom')
+
+    policy = HedgePolicy(initial_delay=5)
+
+    with self.assertRaises(RuntimeError):
+      policy.call('GET /vm', _fail)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test06_service_hedges_info_vm(self):
+    """Verify "info_vm" is routed through the hedging policy once enabled."""
+
+    json_body = '{"ok": true, "j2bgvv6x1ihqslx": {"template": "centos-4-x86_64"}}'
+    resp = _HttpResponse(200, json_body)
+
+    service.enable_hedging()
+
+    with patch.object(service._hedge_policy, 'call', return_value=resp) as mock_func:
+      info = service.info_vm('vmpooler', 'j2bgvv6x1ihqslx', 'token')
+
+    self.assertEqual(info['template'], 'centos-4-x86_64')
+    self.assertEqual(mock_func.call_args[0][0], 'GET /vm/<hostname>')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test07_cancellation(self):
+    """Verify cancelling calls the attached function once and nothing attaches afterwards."""
+
+    stopped = []
+    cancellation = Cancellation()
+
+    self.assertTrue(cancellation.attach(lambda: stopped.append(True)))
+    cancellation.cancel()
+    cancellation.cancel()
+
+    self.assertEqual(stopped, [True])
+    self.assertFalse(cancellation.attach(lambda: stopped.append(True)))
+    self.assertFalse(cancellation.detach())
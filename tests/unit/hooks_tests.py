@@ -0,0 +1,113 @@
+"""
+.. module:: vmpooler_client.tests.unit.hooks_tests
+   :synopsis: Unit tests for the request hook registry.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import hooks, service
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+class _Handler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    body = '{"ok": true}'
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class HooksTests(TestCase):
+  """Tests for the hooks module."""
+
+  def setUp(self):
+    self.events = []
+
+  def tearDown(self):
+    hooks.clear()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_inactive_without_callbacks(self):
+    """Verify the registry reports no callbacks until one is registered."""
+
+    self.assertFalse(hooks.active())
+
+    hooks.register(after_response=self.events.append)
+    self.assertTrue(hooks.active())
+
+    hooks.unregister(self.events.append)
+    self.assertFalse(hooks.active())
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_hooks_observe_request(self):
+    """Verify callbacks receive the method, path, status, byte counts and timings."""
+
+    server = HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = Thread(target=server.handle_request)
+    thread.start()
+
+    before = []
+    hooks.register(before_request=before.append, after_response=self.events.append)
+
+    resp = service._make_request('GET',
+                                 '127.0.0.1:{}'.format(server.server_port),
+                                 '/vm/j2bgvv6x1ihqslx',
+                                 endpoint='GET /vm/<hostname>')
+    thread.join()
+    server.server_close()
+
+    self.assertEqual(resp.read(), '{"ok": true}')
+    self.assertEqual(len(before), 1)
+    self.assertEqual(len(self.events), 1)
+
+    event = self.events[0]
+
+    self.assertEqual(event.method, 'GET')
+    self.assertEqual(event.path, '/vm/j2bgvv6x1ihqslx')
+    self.assertEqual(event.endpoint, 'GET /vm/<hostname>')
+    self.assertEqual(event.status, 200)
+    self.assertEqual(event.bytes_sent, 0)
+    self.assertEqual(event.bytes_received, 12)
+    self.assertItemsEqual(event.timings.keys(), ['connect', 'first_byte', 'total'])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_error_hook(self):
+    """Verify the error callbacks receive the failure and the error is still raised."""
+
+    hooks.register(on_error=self.events.append)
+
+    with patch.object(service, '_send_request', side_effect=RuntimeError('down')):
+      with self.assertRaises(RuntimeError):
+        service._make_request('DELETE', 'vmpooler', '/vm/j2bgvv6x1ihqslx')
+
+    self.assertEqual(len(self.events), 1)
+    self.assertEqual(self.events[0].endpoint, 'DELETE /vm/j2bgvv6x1ihqslx')
+    self.assertEqual(str(self.events[0].error), 'down')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_load_hook_malformed(self):
+    """Negative test case for loading a hook without a function name."""
+
+    with self.assertRaises(RuntimeError):
+      hooks.load_hook('os.path')
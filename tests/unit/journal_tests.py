@@ -0,0 +1,151 @@
+"""
+.. module:: vmpooler_client.tests.unit.journal_tests
+   :synopsis: Unit tests for the bulk operation journal.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import journal as journal_module
+from vmpooler_client.journal import Journal, open_journal, run_journaled
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class JournalTests(TestCase):
+  """Tests for the journal module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.path = join(self.tmp_dir, 'destroy_all.log')
+    self.params = {'vmpooler': 'vmpooler.delivery.puppetlabs.net'}
+    self.items = ['a', 'b', 'c', 'd']
+
+  def tearDown(self):
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_resume(self):
+    """Verify an interrupted operation resumes with only the items which are not done."""
+
+    journal = Journal.start(self.path, 'destroy_all', self.params, self.items)
+    journal.complete(2)
+    journal.complete(0)
+
+    self.assertFalse(journal.close())
+
+    journal = Journal.load(self.path)
+
+    self.assertEqual(journal.operation, 'destroy_all')
+    self.assertDictEqual(journal.params, self.params)
+    self.assertEqual(journal.pending(), [(1, 'b'), (3, 'd')])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_finished_journal_removed(self):
+    """Verify the journal is removed once every item is done."""
+
+    journal = Journal.start(self.path, 'destroy_all', self.params, self.items)
+
+    for index in range(len(self.items)):
+      journal.complete(index)
+
+    self.assertTrue(journal.close())
+    self.assertFalse(exists(self.path))
+    self.assertIsNone(Journal.load(self.path))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_torn_line(self):
+    """Verify a line torn by a crash is dropped and later completions are still read."""
+
+    Journal.start(self.path, 'destroy_all', self.params, self.items).close()
+
+    with open(self.path, 'a') as f:
+      f.write('{"d": 1}\n{"d": 3')
+
+    journal = Journal.load(self.path)
+    self.assertEqual(journal.pending(), [(0, 'a'), (2, 'c'), (3, 'd')])
+
+    journal.complete(2)
+    journal.close()
+
+    self.assertEqual(Journal.load(self.path).pending(), [(0, 'a'), (3, 'd')])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_corrupt_plan_neg(self):
+    """Negative test case for a journal whose plan is unreadable."""
+
+    with open(self.path, 'w') as f:
+      f.write('{"operation": ')
+
+    with self.assertRaises(RuntimeError):
+      Journal.load(self.path)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_resume_failed_items(self):
+    """Verify only the items which failed are retried when a bulk operation is resumed."""
+
+    def _set_lifetime(pair):
+      if pair[0] == 'b':
+        raise RuntimeError('Could not connect to vmpooler!')
+
+      return pair[1]
+
+    vmpooler = self.params['vmpooler']
+
+    with patch('vmpooler_client.journal.locate_journal', return_value=self.path):
+      journal = open_journal('lifetime', vmpooler, False, lambda: [(vm, 24) for vm in self.items])
+      results = run_journaled(journal, _set_lifetime, 2)
+
+      self.assertEqual([error is None for _, _, error in results], [True, False, True, True])
+
+      with self.assertRaises(RuntimeError):
+        open_journal('lifetime', 'other.vmpooler.net', True, None)
+
+      journal = open_journal('lifetime', vmpooler, True, None)
+
+    self.assertEqual(journal.pending(), [(1, ['b', 24])])
+    self.assertEqual(run_journaled(journal, lambda pair: pair[1], 2), [(['b', 24], 24, None)])
+    self.assertFalse(exists(self.path))
+
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  @skipIf(journal_module.flock is None, 'The platform has no "flock"!')
+  def test06_concurrent_runs_neg(self):
+    """Negative test case for two runs of the same operation at once."""
+
+    vmpooler = self.params['vmpooler']
+
+    with patch('vmpooler_client.journal.locate_journal', return_value=self.path):
+      first = open_journal('destroy_all', vmpooler, False, lambda: self.items)
+      first.complete(0)
+
+      with self.assertRaises(RuntimeError):
+        open_journal('destroy_all', vmpooler, False, lambda: ['e', 'f'])
+
+      with self.assertRaises(RuntimeError):
+        open_journal('destroy_all', vmpooler, True, None)
+
+      first.complete(3)
+
+      self.assertFalse(first.close())
+
+      # The journal of the first run is left as it wrote it, ready to be resumed.
+      journal = open_journal('destroy_all', vmpooler, True, None)
+
+    self.assertEqual(journal.pending(), [(1, 'b'), (2, 'c')])
+
+    journal.close()
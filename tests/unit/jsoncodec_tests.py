@@ -0,0 +1,76 @@
+"""
+.. module:: vmpooler_client.tests.unit.jsoncodec_tests
+   :synopsis: Unit tests for selecting the JSON codec.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import jsoncodec
+from json import dumps
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class JsonCodecTests(TestCase):
+  """Tests for the jsoncodec module."""
+
+  def setUp(self):
+    self.selected = jsoncodec.codec()
+    self.token_info = {'ok': True,
+                       'token': {'user': 'ryan.gard',
+                                 'vms': {'running': ['j2bgvv6x1ihqslx', 'l2l7jdlpt6xlptq']}}}
+
+  def tearDown(self):
+    jsoncodec.use(self.selected)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_codecs_agree(self):
+    """Verify every installed codec decodes and encodes payloads like the json module."""
+
+    self.assertEqual(jsoncodec.available()[-1], 'json')
+    self.assertEqual(jsoncodec.codec(), jsoncodec.available()[0])
+
+    for name in jsoncodec.available():
+      jsoncodec.use(name)
+
+      self.assertEqual(jsoncodec.loads(dumps(self.token_info)), self.token_info)
+      self.assertEqual(jsoncodec.loads(jsoncodec.dumps(self.token_info)), self.token_info)
+
+      with self.assertRaises(ValueError):
+        jsoncodec.loads('{"ok": ')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_use_unavailable_neg(self):
+    """Negative test case for selecting a codec which is not installed."""
+
+    with self.assertRaises(ValueError):
+      jsoncodec.use('bogus')
+
+    self.assertEqual(jsoncodec.codec(), self.selected)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_readable_output_uses_json(self):
+    """Verify documents with an indent or sorted keys are always encoded by the json module."""
+
+    with patch.dict(jsoncodec._CODECS, {'fake': (None, lambda obj: 'fast')}):
+      jsoncodec.use('fake')
+
+      self.assertEqual(jsoncodec.dumps(self.token_info), 'fast')
+      self.assertEqual(jsoncodec.dumps(self.token_info, indent=2, sort_keys=True),
+                       dumps(self.token_info, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+  main()
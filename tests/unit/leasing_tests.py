@@ -0,0 +1,130 @@
+"""
+.. module:: vmpooler_client.tests.unit.leasing_tests
+   :synopsis: Unit tests for leasing VMs checked out once to many consumers.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import leasing
+from vmpooler_client.leasing import parse_needs, LeaseClient, LeasePool, LeaseServer
+from vmpooler_client.service import VmNotFoundError
+from itertools import count
+from threading import Thread
+from time import sleep
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class LeasingTests(TestCase):
+  """Tests for the leasing module."""
+
+  def setUp(self):
+    numbers = count()
+    self.get_vm = patch.object(leasing,
+                               'get_vm',
+                               side_effect=lambda host, template, token: '{}-{}'.format(
+                                 template, next(numbers))).start()
+    self.destroy_vm = patch.object(leasing, 'destroy_vm').start()
+    self.pool = LeasePool('vmpooler', 'token')
+
+  def tearDown(self):
+    patch.stopall()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_parse_needs(self):
+    """Verify needs are counted per template and invalid counts are rejected."""
+
+    self.assertEqual(parse_needs(['centos-7', 'win-2012:2', 'centos-7:3']),
+                     {'centos-7': 4, 'win-2012': 2})
+
+    for spec in ('centos-7:0', 'centos-7:many', ':2'):
+      with self.assertRaises(ValueError):
+        parse_needs([spec])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_lease_reuses_pool(self):
+    """Verify acquired VMs are leased again after release and all are destroyed on close."""
+
+    self.pool.acquire({'centos-7': 2})
+
+    first = self.pool.lease('centos-7')
+    second = self.pool.lease('centos-7')
+    self.pool.release(first)
+
+    self.assertEqual(self.pool.lease('centos-7'), first)
+    self.assertEqual(self.get_vm.call_count, 2)
+
+    with self.assertRaises(RuntimeError):
+      self.pool.lease('centos-7', timeout=0.05)
+
+    self.destroy_vm.side_effect = [None, VmNotFoundError('Gone!')]
+
+    self.assertEqual(self.pool.close(), [])
+    self.assertEqual(sorted(c[0][1] for c in self.destroy_vm.call_args_list),
+                     sorted([first, second]))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_wait_for_release(self):
+    """Verify a consumer waits for a VM to be released rather than checking out another."""
+
+    self.pool.acquire({'centos-7': 1})
+    hostname = self.pool.lease('centos-7')
+    leased = []
+
+    thread = Thread(target=lambda: leased.append(self.pool.lease('centos-7', timeout=5)))
+    thread.start()
+    sleep(0.05)
+    self.pool.release(hostname)
+    thread.join()
+
+    self.assertEqual(leased, [hostname])
+    self.assertEqual(self.get_vm.call_count, 1)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_undeclared_template(self):
+    """Verify a template that was not acquired is checked out once and then shared."""
+
+    hostname = self.pool.lease('win-2012')
+    self.pool.release(hostname)
+
+    self.assertEqual(self.pool.lease('win-2012'), hostname)
+    self.assertEqual(self.pool.hostnames(), {hostname: 'win-2012'})
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_remote_lease(self):
+    """Verify VMs are leased over a local connection and released when a client disconnects."""
+
+    self.pool.acquire({'centos-7': 1})
+    server = LeaseServer(self.pool)
+
+    try:
+      client = LeaseClient(server.address, server.authkey)
+      hostname = client.lease('centos-7', 5)
+
+      with self.assertRaises(RuntimeError):
+        client.lease('centos-7', 0.05)
+
+      client.close()
+
+      other = LeaseClient(server.address, server.authkey)
+      self.assertEqual(other.lease('centos-7', 5), hostname)
+      other.release(hostname)
+      other.close()
+    finally:
+      server.close()
+
+
+if __name__ == '__main__':
+  main()
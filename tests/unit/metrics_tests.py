@@ -0,0 +1,115 @@
+"""
+.. module:: vmpooler_client.tests.unit.metrics_tests
+   :synopsis: Unit tests for the client-side metrics.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import hooks, metrics, service
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+class _HttpResponse(object):
+  def __init__(self, status, return_value='default', reason='default'):
+    self.status = status
+    self.reason = reason
+    self._return_value = return_value
+
+  def read(self):
+    return self._return_value
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class MetricsTests(TestCase):
+  """Tests for the metrics module."""
+
+  def setUp(self):
+    self.registry = metrics.enable()
+    self.tmp_dir = mkdtemp()
+
+  def tearDown(self):
+    metrics.disable()
+    rmtree(self.tmp_dir)
+
+  def _respond(self, endpoint, path, status, total):
+    event = hooks.RequestEvent(endpoint.split()[0], 'vmpooler', path, endpoint, 0)
+    event.status = status
+    event.timings['total'] = total
+    hooks.fire_after_response(event)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_request_metrics(self):
+    """Verify responses are counted and timed per endpoint and checkouts per template."""
+
+    self._respond('POST /vm/<template>', '/vm/centos-7-x86_64', 200, 0.2)
+    self._respond('DELETE /vm/<hostname>', '/vm/j2bgvv6x1ihqslx', 404, 0.07)
+
+    text = self.registry.render()
+
+    self.assertIn('vmpooler_client_requests_total'
+                  '{endpoint="DELETE /vm/<hostname>",status="404"} 1', text)
+    self.assertIn('vmpooler_client_request_duration_seconds_bucket'
+                  '{endpoint="POST /vm/<template>",le="0.25"} 1', text)
+    self.assertIn('vmpooler_client_request_duration_seconds_bucket'
+                  '{endpoint="POST /vm/<template>",le="0.1"} 0', text)
+    self.assertIn('vmpooler_client_checkout_duration_seconds_count'
+                  '{template="centos-7-x86_64"} 1', text)
+    self.assertIn('# TYPE vmpooler_client_request_duration_seconds histogram', text)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_checkout_outcomes(self):
+    """Verify "get_vm" counts drained pools."""
+
+    resp = _HttpResponse(200, '{"ok": false}')
+
+    with patch.object(service, '_make_request', return_value=resp):
+      with self.assertRaises(RuntimeError):
+        service.get_vm('vmpooler', 'centos-7-x86_64', 'token')
+
+    self.assertIn('vmpooler_client_checkouts_total'
+                  '{outcome="drained",template="centos-7-x86_64"} 1', self.registry.render())
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_textfile_merges_invocations(self):
+    """Verify writing the textfile adds to the totals already in the file."""
+
+    path = join(self.tmp_dir, 'vmpooler_client.prom')
+
+    self._respond('GET /vm', '/vm', 200, 0.01)
+    metrics.write_textfile(path)
+    metrics.write_textfile(path)
+
+    with open(path) as f:
+      text = f.read()
+
+    self.assertIn('vmpooler_client_requests_total{endpoint="GET /vm",status="200"} 2', text)
+    self.assertIn('vmpooler_client_request_duration_seconds_bucket'
+                  '{endpoint="GET /vm",le="+Inf"} 2', text)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_label_escaping_round_trip(self):
+    """Verify label values with quotes survive a render and merge."""
+
+    self.registry.inc('vmpooler_client_request_errors_total', (('endpoint', 'GET /vm/"x"'),))
+
+    merged = metrics.Registry()
+    merged.merge(self.registry.render())
+
+    self.assertEqual(merged.render(), self.registry.render())
@@ -0,0 +1,144 @@
+"""
+.. module:: vmpooler_client.tests.unit.parallel_tests
+   :synopsis: Unit tests for running bulk operations with fixed and adaptive concurrency.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from threading import Lock
+from time import sleep
+from vmpooler_client import timings
+from vmpooler_client.parallel import AdaptiveLimit, bulk_workers, run_parallel
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ParallelTests(TestCase):
+  """Tests for the parallel module."""
+
+  def tearDown(self):
+    timings.disable()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_additive_increase(self):
+    """Verify the limit grows by about one per round of successful calls, up to the ceiling."""
+
+    limit = AdaptiveLimit('destroy', 4, ceiling=6)
+
+    for _ in range(5):
+      limit.release(limit.acquire(), False)
+
+    self.assertEqual(limit.limit, 5)
+
+    for _ in range(50):
+      limit.release(limit.acquire(), False)
+
+    self.assertEqual(limit.limit, 6)
+    self.assertEqual(limit.peak, 6)
+    self.assertEqual(limit.backoffs, 0)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_multiplicative_decrease(self):
+    """Verify a burst of failures backs off once and the limit never drops below the floor."""
+
+    limit = AdaptiveLimit('destroy', 16, ceiling=32, floor=2)
+    tickets = [limit.acquire() for _ in range(8)]
+
+    for ticket in tickets:
+      limit.release(ticket, True)
+
+    self.assertEqual(limit.limit, 8)
+    self.assertEqual(limit.backoffs, 1)
+
+    for _ in range(5):
+      limit.release(limit.acquire(), True)
+
+    self.assertEqual(limit.limit, 2)
+    self.assertEqual(limit.backoffs, 6)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_latency_spike(self):
+    """Verify a call much slower than the baseline backs off while steady calls do not."""
+
+    limit = AdaptiveLimit('running', 8)
+
+    with patch('vmpooler_client.parallel.time') as mock_time:
+      for latency in (0.01, 0.012, 0.2):
+        mock_time.return_value = 100.0
+        ticket = limit.acquire()
+        mock_time.return_value = 100.0 + latency
+        limit.release(ticket, False)
+
+        if latency < 0.2:
+          self.assertEqual(limit.backoffs, 0)
+
+    self.assertEqual(limit.backoffs, 1)
+    self.assertEqual(limit.limit, 4)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_run_parallel_respects_limit(self):
+    """Verify bulk operations never exceed the adaptive limit and back off on failures."""
+
+    limit = AdaptiveLimit('destroy', 2, ceiling=4)
+    lock = Lock()
+    state = {'in_flight': 0, 'most': 0}
+
+    def _call(item):
+      with lock:
+        state['in_flight'] += 1
+        state['most'] = max(state['most'], state['in_flight'])
+
+      sleep(0.01)
+
+      with lock:
+        state['in_flight'] -= 1
+
+      if item == 5:
+        raise RuntimeError('Could not connect to vmpooler! Status Code: 503')
+
+      return item * 2
+
+    results = run_parallel(_call, range(20), limit)
+
+    self.assertEqual([result for _, result, _ in results if result is not None],
+                     [item * 2 for item in range(20) if item != 5])
+    self.assertLessEqual(state['most'], 4)
+    self.assertEqual(limit.calls, 20)
+    self.assertGreaterEqual(limit.backoffs, 1)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_bulk_workers(self):
+    """Verify the concurrency of bulk operations is read from the settings and reported."""
+
+    # Limits are only kept while they can be reported.
+    bulk_workers({}, 'destroy')
+    self.assertEqual(timings._limits, [])
+
+    timings.enable()
+
+    self.assertEqual(bulk_workers({'max_workers': '3', 'adaptive_concurrency': 'false'}, 'x'), 3)
+
+    limit = bulk_workers({'max_workers': '3', 'max_concurrency': '12'}, 'destroy_all')
+
+    self.assertEqual((limit.limit, limit.ceiling), (3, 12))
+    self.assertEqual(bulk_workers({'max_workers': '40'}, 'running').ceiling, 40)
+    self.assertIn('Concurrency of destroy_all: limit 3 (peak 3, ceiling 12', timings.report())
+
+    with self.assertRaises(RuntimeError):
+      bulk_workers({'max_concurrency': 'many'}, 'destroy')
+
+
+if __name__ == '__main__':
+  main()
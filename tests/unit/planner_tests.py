@@ -0,0 +1,76 @@
+"""
+.. module:: vmpooler_client.tests.unit.planner_tests
+   :synopsis: Unit tests for ordering batches of releases, lifetime changes and acquisitions.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client.planner import plan
+from unittest import main, TestCase, skipIf
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+POOLER = 'vmpooler.delivery.puppetlabs.net'
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class PlannerTests(TestCase):
+  """Tests for the planner module."""
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_plan_without_changes(self):
+    """Verify a plain manifest is acquired in one request per vmpooler."""
+
+    steps = plan({POOLER: {'centos-7-x86_64': 2, 'win-2012r2-x86_64': 1}, 'other:8080': {'a': 1}})
+
+    self.assertEqual([(step.kind, step.pooler, step.counts, step.after) for step in steps],
+                     [('acquire', 'other:8080', {'a': 1}, []),
+                      ('acquire', POOLER, {'centos-7-x86_64': 2, 'win-2012r2-x86_64': 1}, [])])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_releases_before_acquisitions(self):
+    """Verify releases and lifetime changes come first and acquisitions only wait for the
+    releases of their own template."""
+
+    releases = [{'hostname': 'old1', 'template': 'centos-7-x86_64', 'pooler': POOLER},
+                {'hostname': 'old2', 'template': 'debian-8-x86_64', 'pooler': POOLER},
+                {'hostname': 'old3', 'template': 'centos-7-x86_64', 'pooler': 'other:8080'}]
+    lifetimes = [{'hostname': 'keep1', 'hours': 1, 'pooler': POOLER}]
+    demands = {POOLER: {'centos-7-x86_64': 2, 'win-2012r2-x86_64': 1, 'ubuntu-1604-x86_64': 1}}
+
+    steps = plan(demands, releases, lifetimes)
+
+    self.assertEqual([step.kind for step in steps],
+                     ['release', 'release', 'release', 'lifetime', 'acquire', 'acquire'])
+    self.assertEqual(steps[4].counts, {'win-2012r2-x86_64': 1, 'ubuntu-1604-x86_64': 1})
+    self.assertEqual(steps[4].after, [])
+    self.assertEqual(steps[5].counts, {'centos-7-x86_64': 2})
+    self.assertEqual(steps[5].after, [steps[0]])
+    self.assertEqual(steps[5].describe(),
+                     'Acquire 2 x centos-7-x86_64 from {} after releasing old1'.format(POOLER))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_unknown_template_holds_back_pooler(self):
+    """Verify a release with an unknown template holds back every acquisition from its vmpooler
+    in a single request."""
+
+    releases = [{'hostname': 'old1', 'template': None, 'pooler': POOLER}]
+
+    steps = plan({POOLER: {'centos-7-x86_64': 2, 'win-2012r2-x86_64': 1}}, releases)
+
+    self.assertEqual(len(steps), 2)
+    self.assertEqual(steps[1].counts, {'centos-7-x86_64': 2, 'win-2012r2-x86_64': 1})
+    self.assertEqual(steps[1].after, [steps[0]])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,126 @@
+"""
+.. module:: vmpooler_client.tests.unit.profiling_tests
+   :synopsis: Unit tests for running commands under the CPU and memory profilers.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+from StringIO import StringIO
+from pstats import Stats
+from shutil import rmtree
+from tempfile import mkdtemp
+from vmpooler_client import profiling
+from unittest import main, TestCase, skipIf
+from mock import Mock, patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+def _busy():
+  """Make a few calls for the profiler to count."""
+
+  return sum(len(str(number)) for number in range(1000))
+
+
+def _mock_tracemalloc(sites):
+  """Build a stand-in for the tracemalloc module which reports a number of allocation sites."""
+
+  mock_tracemalloc = Mock()
+  mock_tracemalloc.get_traced_memory.return_value = (2048, 4096)
+  mock_tracemalloc.take_snapshot.return_value.statistics.return_value = [
+    'vmpooler_client/service.py:{}: size=1 KiB, count=1'.format(line) for line in range(sites)]
+
+  return mock_tracemalloc
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ProfilingTests(TestCase):
+  """Tests for the profiling module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.output = os.path.join(self.tmp_dir, 'profile')
+
+  def tearDown(self):
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_cpu_profile_written(self):
+    """Verify the CPU profile is written to the output file, even if the function raises."""
+
+    with patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+      self.assertEqual(profiling.run_profiled('cpu', _busy, output=self.output), _busy())
+
+    self.assertIn('CPU profile written to "{}"'.format(self.output), mock_stderr.getvalue())
+    self.assertGreater(Stats(self.output).total_calls, 0)
+
+    os.remove(self.output)
+
+    def _fail():
+      raise RuntimeError('Could not connect to vmpooler!')
+
+    with patch('sys.stderr', new_callable=StringIO):
+      with self.assertRaises(RuntimeError):
+        profiling.run_profiled('cpu', _fail, output=self.output)
+
+    self.assertTrue(os.path.exists(self.output))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_top_limits_summary(self):
+    """Verify only the top entries are summarized."""
+
+    with patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+      profiling.run_profiled('cpu', _busy, output=self.output, top=3)
+
+    self.assertIn('due to restriction <3>', mock_stderr.getvalue())
+
+    with patch.object(profiling, 'tracemalloc', _mock_tracemalloc(10)), \
+         patch('sys.stderr', new_callable=StringIO):
+      profiling.run_profiled('mem', _busy, output=self.output, top=4)
+
+    with open(self.output) as report:
+      lines = report.read().splitlines()
+
+    self.assertIn('Peak traced memory: 4.0 KiB', lines)
+    self.assertIn('Top 4 allocation sites:', lines)
+    self.assertEqual(len([line for line in lines if line.startswith('vmpooler_client/')]), 4)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_unknown_profiler_neg(self):
+    """Negative test case for an unknown kind of profile."""
+
+    func = Mock()
+
+    with self.assertRaises(ValueError):
+      profiling.run_profiled('disk', func, output=self.output)
+
+    self.assertFalse(func.called)
+    self.assertFalse(os.path.exists(self.output))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_tracemalloc_missing_neg(self):
+    """Negative test case for memory profiling without the tracemalloc module."""
+
+    func = Mock()
+
+    with patch.object(profiling, 'tracemalloc', None):
+      with self.assertRaises(RuntimeError):
+        profiling.run_profiled('mem', func, output=self.output)
+
+    self.assertFalse(func.called)
+
+
+if __name__ == '__main__':
+  main()
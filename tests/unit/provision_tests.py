@@ -0,0 +1,159 @@
+"""
+.. module:: vmpooler_client.tests.unit.provision_tests
+   :synopsis: Unit tests for manifest-driven provisioning.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from time import sleep
+from vmpooler_client import provision
+from vmpooler_client.service import PoolDrainedError
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ProvisionTests(TestCase):
+  """Tests for the provision module."""
+
+  def setUp(self):
+    self.vmpooler_hostname = 'vmpooler.delivery.puppetlabs.net'
+    self.auth_token = 'bdct6vxix5yfxndry32kmark0pyhriq9'
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_parse_manifest(self):
+    """Verify counts are grouped per vmpooler and the deadline is read."""
+
+    manifest = {'deadline': 60,
+                'vms': {'centos-7-x86_64': 3,
+                        'win-2012r2-x86_64': {'count': 2, 'pooler': 'other:8080'},
+                        'ubuntu-1604-x86_64': 0}}
+
+    demands, deadline = provision.parse_manifest(manifest, self.vmpooler_hostname)
+
+    self.assertDictEqual(demands, {self.vmpooler_hostname: {'centos-7-x86_64': 3},
+                                   'other:8080': {'win-2012r2-x86_64': 2}})
+    self.assertEqual(deadline, 60)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_parse_manifest_neg(self):
+    """Negative test case for a manifest with an invalid count."""
+
+    for count in ('three', True, -1):
+      with self.assertRaises(RuntimeError):
+        provision.parse_manifest({'centos-7-x86_64': count}, self.vmpooler_hostname)
+
+    with self.assertRaises(RuntimeError):
+      provision.parse_manifest({'vms': {'centos-7-x86_64': {'count': False}}},
+                               self.vmpooler_hostname)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_provision_all(self):
+    """Happy path test to verify every VM is returned with its domain."""
+
+    vms = ([('centos-7-x86_64', 'b'), ('centos-7-x86_64', 'a')], 'delivery.puppetlabs.net')
+
+    with patch.object(provision, 'checkout_vms', return_value=vms):
+      result = provision.provision({self.vmpooler_hostname: {'centos-7-x86_64': 2}},
+                                   self.auth_token)
+
+    self.assertEqual([vm['hostname'] for vm in result], ['a', 'b'])
+    self.assertEqual(result[0]['fqdn'], 'a.delivery.puppetlabs.net')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_partial_failure_releases_everything(self):
+    """Verify VMs acquired from one vmpooler are released when another cannot be filled."""
+
+    def _checkout(pooler, counts, auth_token):
+      if pooler == 'drained:8080':
+        raise PoolDrainedError('Could not retrieve templates! A pool is drained!')
+
+      return ([('centos-7-x86_64', 'a'), ('centos-7-x86_64', 'b')], '')
+
+    demands = {self.vmpooler_hostname: {'centos-7-x86_64': 2},
+               'drained:8080': {'win-2012r2-x86_64': 1}}
+
+    with patch.object(provision, 'checkout_vms', side_effect=_checkout) as mock_checkout:
+      with patch.object(provision, 'destroy_vm') as mock_destroy:
+        with self.assertRaises(RuntimeError) as cm:
+          provision.provision(demands, self.auth_token, deadline=0.3, retry_interval=0.1)
+
+    self.assertGreater(mock_checkout.call_count, 2)
+    self.assertItemsEqual([c[0][1] for c in mock_destroy.call_args_list], ['a', 'b'])
+    self.assertIn('2 acquired VMs were released', str(cm.exception))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_parse_changes(self):
+    """Verify the VMs to release and the lifetime changes are read from a manifest."""
+
+    manifest = {'release': ['old1', {'hostname': 'old2', 'template': 'centos-7-x86_64',
+                                     'pooler': 'other:8080'}],
+                'lifetime': {'keep1': 2, 'keep2': {'hours': 4, 'pooler': 'other:8080'}},
+                'vms': {'centos-7-x86_64': 1}}
+
+    releases, lifetimes = provision.parse_changes(manifest, self.vmpooler_hostname)
+
+    self.assertEqual(releases,
+                     [{'hostname': 'old1', 'template': None, 'pooler': self.vmpooler_hostname},
+                      {'hostname': 'old2', 'template': 'centos-7-x86_64', 'pooler': 'other:8080'}])
+    self.assertEqual(lifetimes,
+                     [{'hostname': 'keep1', 'hours': 2, 'pooler': self.vmpooler_hostname},
+                      {'hostname': 'keep2', 'hours': 4, 'pooler': 'other:8080'}])
+    self.assertEqual(provision.parse_manifest({'release': ['old1']}, self.vmpooler_hostname),
+                     ({}, None))
+
+    for hours in (0, True):
+      with self.assertRaises(RuntimeError):
+        provision.parse_changes({'lifetime': {'keep1': hours}}, self.vmpooler_hostname)
+
+    with self.assertRaises(RuntimeError):
+      provision.parse_changes({'release': 'old1'}, self.vmpooler_hostname)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test06_rotate_releases_first(self):
+    """Verify acquisitions wait for the releases that refill their pool while the others start
+    straight away, and a failed lifetime change does not stop the batch."""
+
+    released = []
+    events = []
+
+    def _destroy(pooler, hostname, auth_token):
+      sleep(0.1)
+      released.append(hostname)
+      events.append('released ' + hostname)
+
+    def _checkout(pooler, counts, auth_token):
+      if 'centos-7-x86_64' in counts and not released:
+        raise PoolDrainedError('Could not retrieve templates! A pool is drained!')
+
+      events.append('acquired ' + ', '.join(sorted(counts)))
+
+      return ([(template_name, template_name[:3]) for template_name in counts], '')
+
+    releases = [{'hostname': 'old1', 'template': 'centos-7-x86_64', 'pooler': 'p'}]
+    lifetimes = [{'hostname': 'gone', 'hours': 1, 'pooler': 'p'}]
+    demands = {'p': {'centos-7-x86_64': 1, 'debian-8-x86_64': 1}}
+
+    with patch.object(provision, 'checkout_vms', side_effect=_checkout) as mock_checkout:
+      with patch.object(provision, 'destroy_vm', side_effect=_destroy):
+        with patch.object(provision, 'set_vm_lifetime', side_effect=RuntimeError('404')):
+          vms, failures = provision.run_batch(demands, self.auth_token, releases, lifetimes,
+                                              deadline=0.3, retry_interval=0.1, workers=2)
+
+    self.assertEqual([vm['hostname'] for vm in vms], ['cen', 'deb'])
+    self.assertEqual([hostname for hostname, _ in failures], ['gone'])
+    self.assertEqual(mock_checkout.call_count, 2)
+    self.assertEqual(events, ['acquired debian-8-x86_64',
+                              'released old1',
+                              'acquired centos-7-x86_64'])
@@ -0,0 +1,136 @@
+"""
+.. module:: vmpooler_client.tests.unit.proxy_tests
+   :synopsis: Unit tests for the local vmpooler proxy.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import proxy
+from vmpooler_client.proxy import ProxyServer
+from vmpooler_client.service import _Response
+from httplib import HTTPConnection
+from json import loads
+from threading import Event, Thread
+from time import sleep
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+def _forward_request(method, host, path, body='', headers=None, endpoint=None):
+  return _Response(200, 'OK', [('Content-Type', 'application/json')], '{"ok": true}')
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ProxyTests(TestCase):
+  """Tests for the proxy module."""
+
+  def setUp(self):
+    self.server = ProxyServer(('127.0.0.1', 0), 'vmpooler.example.com', ttl=60)
+    self.port = self.server.server_address[1]
+
+    thread = Thread(target=self.server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _request(self, method, path, token='tok'):
+    conn = HTTPConnection('127.0.0.1', self.port, timeout=5)
+    conn.request(method, path, '', {'X-AUTH-TOKEN': token})
+    resp = conn.getresponse()
+    result = (resp.status, resp.read())
+    conn.close()
+
+    return result
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_cached_per_token(self):
+    """Verify reads are served from the cache for the same credentials only."""
+
+    with patch.object(proxy, 'forward_request', side_effect=_forward_request) as forward:
+      self.assertEqual(self._request('GET', '/vm/abc'), (200, '{"ok": true}'))
+      self._request('GET', '/vm/abc')
+      self._request('GET', '/vm/abc', token='other')
+
+    self.assertEqual(forward.call_count, 2)
+    self.assertEqual(forward.call_args[0][:3], ('GET', 'vmpooler.example.com', '/vm/abc'))
+    self.assertEqual(forward.call_args[0][4]['X-AUTH-TOKEN'], 'other')
+    self.assertEqual((self.server.hits, self.server.misses), (1, 2))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_mutation_invalidates(self):
+    """Verify a mutating call is passed through and drops the VM reads but not the templates."""
+
+    with patch.object(proxy, 'forward_request', side_effect=_forward_request) as forward:
+      self._request('GET', '/vm')
+      self._request('GET', '/vm/abc')
+      self._request('DELETE', '/vm/abc')
+      self._request('GET', '/vm')
+      self._request('GET', '/vm/abc')
+
+    self.assertEqual([c[0][0] + ' ' + c[0][2] for c in forward.call_args_list],
+                     ['GET /vm', 'GET /vm/abc', 'DELETE /vm/abc', 'GET /vm/abc'])
+    self.assertEqual(forward.call_args_list[2][0][5], 'DELETE /vm/<hostname>')
+    self.assertEqual(self.server.passed, 1)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_coalesced(self):
+    """Verify concurrent identical reads share one upstream request."""
+
+    release = Event()
+    results = []
+
+    def _slow_forward_request(*args):
+      release.wait(5)
+      return _forward_request(*args)
+
+    with patch.object(proxy, 'forward_request', side_effect=_slow_forward_request) as forward:
+      threads = [Thread(target=lambda: results.append(self._request('GET', '/token/abc')))
+                 for _ in range(4)]
+
+      for thread in threads:
+        thread.start()
+
+      # Give every request time to join the one in flight.
+      while self.server.coalesced < 3:
+        sleep(0.01)
+
+      release.set()
+
+      for thread in threads:
+        thread.join()
+
+    self.assertEqual(forward.call_count, 1)
+    self.assertEqual(self.server.coalesced, 3)
+    self.assertEqual(results, [(200, '{"ok": true}')] * 4)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_upstream_failure(self):
+    """Verify an unreachable vmpooler is reported as a bad gateway and not cached."""
+
+    with patch.object(proxy, 'forward_request', side_effect=RuntimeError('Down!')) as forward:
+      status, body = self._request('GET', '/vm')
+      self._request('GET', '/vm')
+
+    self.assertEqual(status, 502)
+    self.assertEqual(loads(body), {'ok': False, 'reason': 'Down!'})
+    self.assertEqual(forward.call_count, 2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,155 @@
+"""
+.. module:: vmpooler_client.tests.unit.pytest_plugin_tests
+   :synopsis: Tests for the pytest plugin which leases session VMs to tests.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+
+These tests run pytest sessions in-process with the "pytester" plugin, so they are run by pytest
+rather than unittest: "pytest tests/unit/pytest_plugin_tests.py".
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from itertools import count
+from vmpooler_client import leasing
+from mock import patch
+
+try:
+  import pytest
+
+  # Imported before any session runs so that every session uses the module patched here.
+  from vmpooler_client import pytest_plugin
+except ImportError:
+  # The plugin and its tests need pytest, which the client itself does not.
+  pytest = None
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+pytest_plugins = 'pytester'
+
+if pytest is not None:
+  pytestmark = pytest.mark.skipif(SKIP_EVERYTHING,
+                                  reason='Skip if we are creating/modifying tests!')
+
+PLUGIN = '-p', 'vmpooler_client.pytest_plugin'
+
+_TESTS = """
+import pytest
+
+@pytest.mark.vmpooler('centos-7-x86_64')
+def test_with_vm(vmpooler_vms):
+    assert vmpooler_vms[0].startswith('centos-7-x86_64-')
+
+def test_plain():
+    pass
+"""
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+class _MockVmpooler(object):
+  """Patch the check out and destruction of VMs for the duration of a test."""
+
+  def __enter__(self):
+    numbers = count()
+
+    self.patches = [patch.object(pytest_plugin,
+                                 'load_config',
+                                 return_value={'vmpooler_hostname': 'vmpooler',
+                                               'auth_token': 'token'}),
+                    patch.object(leasing,
+                                 'get_vm',
+                                 side_effect=lambda host, template, token: '{}-{}'.format(
+                                   template, next(numbers))),
+                    patch.object(leasing, 'destroy_vm')]
+
+    self.load_config, self.get_vm, self.destroy_vm = [patcher.start() for patcher in self.patches]
+
+    return self
+
+  def __exit__(self, *exc_info):
+    for patcher in self.patches:
+      patcher.stop()
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+def test01_help_and_collect_only(testdir):
+  """Verify "--help" and "--collect-only" never check out VMs."""
+
+  testdir.makepyfile(test_vms=_TESTS)
+
+  with _MockVmpooler() as vmpooler:
+    assert testdir.runpytest(*PLUGIN + ('--help',)).ret == 0
+
+    result = testdir.runpytest(*PLUGIN + ('--collect-only', '--vmpooler-pool', 'centos-7-x86_64'))
+
+  assert result.ret == 0
+  assert not vmpooler.load_config.called
+  assert not vmpooler.get_vm.called
+
+
+def test02_checked_out_on_first_lease(testdir):
+  """Verify the VMs of the session are checked out for the first lease and destroyed at the
+  end of the session."""
+
+  testdir.makepyfile(test_vms=_TESTS)
+
+  with _MockVmpooler() as vmpooler:
+    result = testdir.runpytest(*PLUGIN + ('--vmpooler-pool', 'centos-7-x86_64:2'))
+
+  result.stdout.fnmatch_lines(['*Destroyed 2 of 2 vmpooler VMs*', '*2 passed*'])
+  assert vmpooler.get_vm.call_count == 2
+  assert vmpooler.destroy_vm.call_count == 2
+
+
+def test03_no_test_needs_vms(testdir):
+  """Verify a run which selects no test needing VMs never checks any out."""
+
+  testdir.makepyfile(test_vms=_TESTS)
+
+  with _MockVmpooler() as vmpooler:
+    result = testdir.runpytest(*PLUGIN + ('--vmpooler-pool', 'centos-7-x86_64', '-k', 'plain'))
+
+  result.stdout.fnmatch_lines(['*1 passed*'])
+  assert not vmpooler.get_vm.called
+  assert not vmpooler.destroy_vm.called
+
+
+def test04_check_out_failure_neg(testdir):
+  """Negative test case for VMs which cannot be checked out."""
+
+  testdir.makepyfile(test_vms=_TESTS)
+
+  with _MockVmpooler() as vmpooler:
+    vmpooler.get_vm.side_effect = RuntimeError('Could not connect to vmpooler!')
+    result = testdir.runpytest(*PLUGIN + ('--vmpooler-pool', 'centos-7-x86_64'))
+
+  result.stdout.fnmatch_lines(['*Could not check out 1 of 1 VMs!*', '*1 passed*1 error*'])
+
+
+def test05_worker_without_lease_address_neg(testdir):
+  """Negative test case for a pytest-xdist worker started without the lease server address."""
+
+  testdir.makepyfile(test_vms=_TESTS)
+  testdir.makepyfile(fakeworker="""
+import pytest
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    config.workerinput = {'workerid': 'gw0'}
+""")
+  testdir.syspathinsert()
+
+  with _MockVmpooler() as vmpooler:
+    result = testdir.runpytest('-p', 'fakeworker', *PLUGIN)
+
+  result.stdout.fnmatch_lines(['*was not given the address of the vmpooler lease server!*'])
+  assert 'AttributeError' not in result.stdout.str()
+  assert not vmpooler.get_vm.called
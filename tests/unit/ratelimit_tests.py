@@ -0,0 +1,101 @@
+"""
+.. module:: vmpooler_client.tests.unit.ratelimit_tests
+   :synopsis: Unit tests for the client-side rate limiter.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import ratelimit, service
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class RateLimitTests(TestCase):
+  """Tests for the ratelimit module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+
+  def tearDown(self):
+    service.disable_rate_limit()
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_bucket_reservations(self):
+    """Verify the burst is served at once and later tokens are spaced by the rate."""
+
+    bucket = ratelimit.TokenBucket(rate=10, burst=2)
+
+    self.assertEqual(bucket.reserve(100.0), 0)
+    self.assertEqual(bucket.reserve(100.0), 0)
+    self.assertAlmostEqual(bucket.reserve(100.0), 0.1)
+    self.assertAlmostEqual(bucket.reserve(100.0), 0.2)
+
+    # After a quiet second the bucket is full again but holds no more than the burst.
+    self.assertEqual(bucket.reserve(101.0), 0)
+    self.assertEqual(bucket.reserve(101.0), 0)
+    self.assertAlmostEqual(bucket.reserve(101.0), 0.1)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_shared_bucket(self):
+    """Verify two buckets backed by the same state file share their tokens."""
+
+    path = join(self.tmp_dir, 'ratelimit.json')
+    first = ratelimit.SharedTokenBucket(path, '*', rate=1)
+    second = ratelimit.SharedTokenBucket(path, '*', rate=1)
+
+    self.assertEqual(first.reserve(50.0), 0)
+    self.assertAlmostEqual(second.reserve(50.0), 1)
+    self.assertAlmostEqual(first.reserve(50.5), 1.5)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_limiter_endpoints(self):
+    """Verify endpoint limits only apply to their endpoint."""
+
+    limiter = ratelimit.RateLimiter(endpoint_rates={'DELETE /vm/<hostname>': 2})
+
+    with patch.object(ratelimit, 'sleep') as mock_sleep:
+      limiter.acquire('DELETE /vm/<hostname>')
+      limiter.acquire('GET /vm')
+      limiter.acquire('DELETE /vm/<hostname>')
+
+    self.assertEqual(mock_sleep.call_count, 1)
+    self.assertAlmostEqual(mock_sleep.call_args[0][0], 0.5, places=2)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_parse_rates(self):
+    """Verify endpoint rates can be read from a config string."""
+
+    self.assertDictEqual(ratelimit.parse_rates('DELETE /vm/<hostname>=5; GET /vm=0.5'),
+                         {'DELETE /vm/<hostname>': 5.0, 'GET /vm': 0.5})
+
+    with self.assertRaises(RuntimeError):
+      ratelimit.parse_rates('GET /vm=fast')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test05_service_acquires_before_sending(self):
+    """Verify requests made through the service layer wait on the limiter."""
+
+    service.enable_rate_limit(rate=5)
+
+    with patch.object(service._rate_limiter, 'acquire') as mock_acquire:
+      with patch.object(service, '_send_request') as mock_send:
+        service._make_request('DELETE', 'vmpooler', '/vm/x', endpoint='DELETE /vm/<hostname>')
+
+    mock_acquire.assert_called_once_with('DELETE /vm/<hostname>')
+    self.assertEqual(mock_send.call_count, 1)
@@ -0,0 +1,107 @@
+"""
+.. module:: vmpooler_client.tests.unit.readiness_tests
+   :synopsis: Unit tests for probing VM readiness.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client.readiness import fqdn, wait_ready
+import socket
+from threading import Event
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ReadinessTests(TestCase):
+  """Tests for the readiness module."""
+
+  def setUp(self):
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.bind(('127.0.0.1', 0))
+    self.listener.listen(5)
+    self.port = self.listener.getsockname()[1]
+
+  def tearDown(self):
+    self.listener.close()
+
+  def _closed_port(self):
+    """Find a local port with nothing listening on it."""
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_fqdn(self):
+    """Verify the domain is appended once and only when present."""
+
+    self.assertEqual(fqdn('j2bgvv6x1ihqslx', 'delivery.puppetlabs.net'),
+                     'j2bgvv6x1ihqslx.delivery.puppetlabs.net')
+    self.assertEqual(fqdn('j2bgvv6x1ihqslx.delivery.puppetlabs.net', 'delivery.puppetlabs.net'),
+                     'j2bgvv6x1ihqslx.delivery.puppetlabs.net')
+    self.assertEqual(fqdn('j2bgvv6x1ihqslx', ''), 'j2bgvv6x1ihqslx')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_listening_hosts_ready(self):
+    """Verify hosts accepting connections are reported ready."""
+
+    ready_after = wait_ready(['127.0.0.1', 'localhost'], port=self.port, timeout=5)
+
+    self.assertIsNotNone(ready_after['127.0.0.1'])
+    self.assertIsNotNone(ready_after['localhost'])
+    self.assertLess(ready_after['127.0.0.1'], 5)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_deadline(self):
+    """Verify refused and unresolvable hosts are reported not ready once the deadline passes."""
+
+    ready_after = wait_ready(['127.0.0.1', 'no-such-host.invalid'],
+                             port=self._closed_port(),
+                             timeout=0.3,
+                             interval=0.05)
+
+    self.assertDictEqual(ready_after, {'127.0.0.1': None, 'no-such-host.invalid': None})
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_slow_lookup(self):
+    """Verify a slow lookup does not hold up the probes of other hosts."""
+
+    getaddrinfo = socket.getaddrinfo
+    released = Event()
+    finished = Event()
+
+    def _getaddrinfo(host, *args):
+      if host == 'slow.invalid':
+        try:
+          released.wait(5)
+          raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        finally:
+          finished.set()
+
+      return getaddrinfo(host, *args)
+
+    with patch('socket.getaddrinfo', side_effect=_getaddrinfo):
+      ready_after = wait_ready(['slow.invalid', '127.0.0.1'], port=self.port, timeout=0.5)
+
+      # Let the abandoned lookup finish before the patch is removed.
+      released.set()
+      finished.wait(5)
+
+    self.assertIsNone(ready_after['slow.invalid'])
+    self.assertIsNotNone(ready_after['127.0.0.1'])
+    self.assertLess(ready_after['127.0.0.1'], 0.25)
@@ -0,0 +1,69 @@
+"""
+.. module:: vmpooler_client.tests.unit.records_tests
+   :synopsis: Unit tests for the compact VM record.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client.records import VmRecord
+from json import loads
+from unittest import main, TestCase, skipIf
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class RecordsTests(TestCase):
+  """Tests for the records module."""
+
+  def setUp(self):
+    self.hostname = 'j2bgvv6x1ihqslx'
+    self.template_name = 'centos-7-x86_64'
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_from_info(self):
+    """Verify numeric fields are parsed whether the vmpooler returns numbers or strings."""
+
+    info = loads('{{"template": "{}", "lifetime": "24", "running": "6.70", "state": "running", '
+                 '"domain": "delivery.puppetlabs.net"}}'.format(self.template_name))
+
+    vm = VmRecord.from_info(self.hostname, info)
+
+    self.assertEqual(vm.hostname, self.hostname)
+    self.assertEqual(vm.template, self.template_name)
+    self.assertEqual(vm.running, 6.7)
+    self.assertEqual(vm.lifetime, 24)
+    self.assertAlmostEqual(vm.remaining, 17.3)
+    self.assertEqual(vm.as_dict()['domain'], 'delivery.puppetlabs.net')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_shared_strings(self):
+    """Verify records built from separately parsed responses share their template strings."""
+
+    info = '{{"template": "{}", "running": 1.5}}'.format(self.template_name)
+
+    first = VmRecord.from_info('a', loads(info))
+    second = VmRecord.from_info('b', loads(info))
+
+    self.assertIs(first.template, second.template)
+    self.assertFalse(hasattr(first, '__dict__'))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_missing_fields(self):
+    """Verify missing and malformed fields are left empty."""
+
+    vm = VmRecord.from_info(self.hostname, {'running': 'unknown'})
+
+    self.assertIsNone(vm.template)
+    self.assertIsNone(vm.running)
+    self.assertIsNone(vm.lifetime)
+    self.assertIsNone(vm.remaining)
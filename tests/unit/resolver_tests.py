@@ -0,0 +1,139 @@
+"""
+.. module:: vmpooler_client.tests.unit.resolver_tests
+   :synopsis: Unit tests for the DNS cache and dual-stack connections.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import socket
+from vmpooler_client import resolver
+from vmpooler_client.resolver import Resolver
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _has_ipv6():
+  """Check if the loopback interface has an IPv6 address."""
+
+  try:
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    sock.bind(('::1', 0))
+    sock.close()
+  except (socket.error, AttributeError):
+    return False
+
+  return True
+
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ResolverTests(TestCase):
+  """Tests for the resolver module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.state_file = join(self.tmp_dir, '.vmpooler.dns')
+
+    # Find a port which is free on both loopback addresses.
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.bind(('127.0.0.1', 0))
+    self.listener.listen(8)
+    self.port = self.listener.getsockname()[1]
+
+    self.addrs = [(socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', self.port, 0, 0)),
+                  (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', self.port))]
+
+  def tearDown(self):
+    self.listener.close()
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_cache(self):
+    """Verify lookups are cached in the process and in the state file until they expire."""
+
+    dns = Resolver(ttl=60, state_file=self.state_file)
+
+    with patch.object(socket, 'getaddrinfo', return_value=self.addrs) as getaddrinfo:
+      first = dns.resolve('vmpooler', self.port)
+      dns.resolve('vmpooler', self.port)
+      Resolver(ttl=60, state_file=self.state_file).resolve('vmpooler', self.port)
+
+      self.assertEqual(getaddrinfo.call_count, 1)
+      self.assertEqual(first, [(socket.AF_INET6, ('::1', self.port, 0, 0)),
+                               (socket.AF_INET, ('127.0.0.1', self.port))])
+
+      with patch.object(resolver, 'time', return_value=10 ** 10):
+        dns.resolve('vmpooler', self.port)
+
+      self.assertEqual(getaddrinfo.call_count, 2)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_fallback_remembered(self):
+    """Verify the IPv4 address wins when nothing listens on IPv6 and is then tried first."""
+
+    dns = Resolver(ttl=60, state_file=self.state_file)
+
+    with patch.object(socket, 'getaddrinfo', return_value=self.addrs):
+      sock = dns.connect('vmpooler', self.port, timeout=5)
+
+    self.assertEqual(sock.family, socket.AF_INET)
+    self.assertEqual(sock.gettimeout(), 5)
+    sock.close()
+
+    self.assertEqual(Resolver(ttl=60, state_file=self.state_file).resolve('vmpooler', self.port),
+                     [(socket.AF_INET, ('127.0.0.1', self.port)),
+                      (socket.AF_INET6, ('::1', self.port, 0, 0))])
+
+  @skipIf(SKIP_EVERYTHING or not _has_ipv6(), 'Skip if IPv6 is not available!')
+  def test03_dual_stack(self):
+    """Verify a host listening on both families is reached on the first family tried."""
+
+    listener6 = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+
+    try:
+      listener6.bind(('::1', self.port))
+    except socket.error:
+      listener6.close()
+      self.skipTest('The port is in use on IPv6.')
+
+    listener6.listen(8)
+
+    try:
+      with patch.object(socket, 'getaddrinfo', return_value=self.addrs):
+        sock = Resolver().connect('vmpooler', self.port)
+
+      self.assertEqual(sock.family, socket.AF_INET6)
+      sock.close()
+    finally:
+      listener6.close()
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_stale_cache_resolved_again(self):
+    """Verify a host is resolved again when every cached address fails."""
+
+    self.listener.close()
+    dns = Resolver(ttl=60)
+
+    with patch.object(socket, 'getaddrinfo', return_value=self.addrs[1:]) as getaddrinfo:
+      dns.resolve('vmpooler', self.port)
+
+      with self.assertRaises(socket.error):
+        dns.connect('vmpooler', self.port, timeout=5)
+
+    self.assertEqual(getaddrinfo.call_count, 2)
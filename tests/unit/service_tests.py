@@ -204,3 +204,180 @@ class ServiceTests(TestCase):
         excep = cm.exception
 
         self.assertEqual(excep.msg, 'Invalid credentials provided!')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test09_snapshot_vm(self):
+    """Happy path test to verify snapshotting a VM instance."""
+
+    # Init
+    snapshot = 'n4eb4kdtp7rwv4x158366vd9jhac8btq'
+
+    # Construct mock return object.
+    json_body = '{{"ok": true, "{0}": {{"snapshot": "{1}"}}}}'.format(self.hostname, snapshot)
+
+    resp = _HttpResponse(202, json_body)
+
+    # Patch
+    with patch.object(service, '_make_request', return_value=resp) as mock_func:
+      self.assertEqual(service.snapshot_vm(self.vmpooler_hostname,
+                                           self.hostname,
+                                           self.auth_token),
+                       snapshot)
+      self.assertEqual(mock_func.call_args[0][2], '/vm/{}/snapshot'.format(self.hostname))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test10_revert_vm_neg(self):
+    """Negative test case for attempting to revert to a non-existent snapshot."""
+
+    # Construct mock return object.
+    json_body = '{"ok": false}'
+
+    resp = _HttpResponse(404, json_body)
+
+    # Patch
+    with patch.object(service, '_make_request', return_value=resp) as mock_func:
+      with self.assertRaises(RuntimeError):
+        service.revert_vm(self.vmpooler_hostname, self.hostname, 'bogus', self.auth_token)
+
+      self.assertEqual(mock_func.call_args[0][2], '/vm/{}/snapshot/bogus'.format(self.hostname))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test11_checkout_vms(self):
+    """Happy path test to verify retrieving several VM instances in one request."""
+
+    # Construct mock return object.
+    json_body = """
+      {{
+        "ok": true,
+        "{0}": {{
+          "hostname": ["{1}", "k4n7x9q2w1ihqsl"]
+        }},
+        "domain": "delivery.puppetlabs.net"
+      }}""".format(self.template_name, self.hostname)
+
+    resp = _HttpResponse(200, json_body)
+
+    # Patch
+    with patch.object(service, '_make_request', return_value=resp) as mock_func:
+      vms, domain = service.checkout_vms(self.vmpooler_hostname,
+                                         {self.template_name: 2},
+                                         self.auth_token)
+
+    self.assertEqual(vms, [(self.template_name, self.hostname),
+                           (self.template_name, 'k4n7x9q2w1ihqsl')])
+    self.assertEqual(domain, 'delivery.puppetlabs.net')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test12_get_running_vms(self):
+    """Happy path test to verify the running VMs are extracted from the token information."""
+
+    # Construct mock return object.
+    json_body = """
+      {{
+        "ok": true,
+        "{0}": {{
+          "user": "ryan.gard",
+          "vms": {{
+            "running": ["{1}", "k4n7x9q2w1ihqsl"]
+          }}
+        }}
+      }}""".format(self.auth_token, self.hostname)
+
+    # Patch
+    with patch.object(service, '_make_request', return_value=_HttpResponse(200, json_body)):
+      self.assertEqual(service.get_running_vms(self.vmpooler_hostname, self.auth_token),
+                       [self.hostname, 'k4n7x9q2w1ihqsl'])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test13_get_running_vms_neg(self):
+    """Negative test case for a revoked token."""
+
+    # Patch
+    with patch.object(service, '_make_request', return_value=_HttpResponse(404)):
+      with self.assertRaises(RuntimeError):
+        service.get_running_vms(self.vmpooler_hostname, self.auth_token)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test14_info_vms(self):
+    """Happy path test to verify retrieving records for many VMs in order."""
+
+    vm_names = ['vm{}'.format(i) for i in range(20)]
+
+    def _info_vm(vmpooler_hostname, vm_name, auth_token):
+      return {'template': self.template_name, 'running': vm_names.index(vm_name) / 2.0}
+
+    # Patch
+    with patch.object(service, 'info_vm', side_effect=_info_vm) as mock_func:
+      records = service.info_vms(self.vmpooler_hostname, vm_names, self.auth_token, workers=4)
+
+    self.assertEqual([vm.hostname for vm in records], vm_names)
+    self.assertEqual(records[3].running, 1.5)
+    self.assertEqual(records[3].template, self.template_name)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test15_info_vms_neg(self):
+    """Negative test case for a VM which could not be found."""
+
+    def _info_vm(vmpooler_hostname, vm_name, auth_token):
+      if vm_name == 'gone':
+        raise RuntimeError('Could not find VM! Check the VM name and try again!')
+
+      return {'template': self.template_name, 'running': 1.0}
+
+    # Patch
+    with patch.object(service, 'info_vm', side_effect=_info_vm) as mock_func:
+      with self.assertRaises(RuntimeError):
+        service.info_vms(self.vmpooler_hostname, ['a', 'gone', 'b'], self.auth_token)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test16_client_lease(self):
+    """Verify a lease retrieves VMs concurrently and hands them back even if the block raises."""
+
+    client = service.VmpoolerClient(self.vmpooler_hostname, self.auth_token)
+    names = iter(['a', 'b', 'c'])
+
+    with patch.object(client, 'get_vm', side_effect=lambda template: next(names)):
+      with patch.object(client, 'destroy_vm') as mock_destroy:
+        with self.assertRaises(ValueError):
+          with client.lease(self.template_name, count=3) as hosts:
+            self.assertItemsEqual(hosts, ['a', 'b', 'c'])
+            raise ValueError('Test failed!')
+
+    self.assertItemsEqual([c[0][0] for c in mock_destroy.call_args_list], ['a', 'b', 'c'])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test17_client_lease_neg(self):
+    """Negative test case for a lease which could only retrieve some of its VMs."""
+
+    client = service.VmpoolerClient(self.vmpooler_hostname, self.auth_token)
+    results = iter(['a', service.PoolDrainedError('Drained!')])
+
+    def _get_vm(template):
+      result = next(results)
+
+      if isinstance(result, Exception):
+        raise result
+
+      return result
+
+    with patch.object(client, 'get_vm', side_effect=_get_vm):
+      with patch.object(client, 'destroy_vm') as mock_destroy:
+        with self.assertRaises(RuntimeError):
+          with client.lease(self.template_name, count=2):
+            self.fail('The block must not run!')
+
+    mock_destroy.assert_called_once_with('a')
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test18_client_uses_own_pool(self):
+    """Verify a session sends its requests through its own pool with its own token."""
+
+    client = service.VmpoolerClient(self.vmpooler_hostname, self.auth_token)
+    resp = _HttpResponse(200, '{"ok": true}')
+
+    with patch.object(service, '_make_request', return_value=resp) as mock_func:
+      client.destroy_vm(self.hostname)
+
+    self.assertIs(mock_func.call_args[1]['pool'], client.pool)
+    self.assertIsNot(client.pool, service._pool)
+    self.assertEqual(mock_func.call_args[1]['headers'], {'X-AUTH-TOKEN': self.auth_token})
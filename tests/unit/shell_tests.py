@@ -0,0 +1,107 @@
+"""
+.. module:: vmpooler_client.tests.unit.shell_tests
+   :synopsis: Unit tests for the interactive shell.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import shell
+from vmpooler_client.command_parser import CommandParser
+from vmpooler_client.vmcache import VmCache
+from os import utime
+from os.path import join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class ShellTests(TestCase):
+  """Tests for the shell module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.cache_path = join(self.tmp_dir, '.vmpooler.cache')
+    self.calls = []
+
+    def _command(args, config):
+      self.calls.append((args.platform, config))
+
+      if args.platform == ['bad']:
+        raise RuntimeError('Could not retrieve VM!')
+
+    self.cmd_parser = CommandParser([])
+    self.cmd_parser.add_command('version', desc='Print the version', func=_command)
+    self.cmd_parser.add_command('vm', desc='Manage VMs')
+    self.cmd_parser.add_sub_command('vm', 'get', desc='Get VMs', func=_command)
+    self.cmd_parser.add_sub_command_arg('vm', 'get', name='platform', nargs='+')
+    self.cmd_parser.add_sub_command_arg('vm', 'get', name='--ready', action='store_true')
+    self.cmd_parser.add_sub_command('vm', 'destroy', desc='Destroy VMs', func=_command)
+    self.cmd_parser.add_sub_command('vm', 'destroy_all', desc='Destroy all VMs', func=_command)
+
+  def tearDown(self):
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_complete_commands(self):
+    """Verify commands, sub-commands and options are completed."""
+
+    completer = shell.Completer(self.cmd_parser, self.cache_path)
+
+    self.assertEqual(completer.matches([], ''), ['exit', 'help', 'quit', 'version', 'vm'])
+    self.assertEqual(completer.matches(['vm'], 'de'), ['destroy', 'destroy_all'])
+    self.assertEqual(completer.matches(['vm', 'get'], '--r'), ['--ready'])
+    self.assertEqual(completer.matches(['bogus'], ''), [])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_complete_from_cache(self):
+    """Verify templates and hostnames are completed from the VM cache as it changes."""
+
+    cache = VmCache(self.cache_path)
+    cache.remember_templates(['win-2012r2-x86_64', 'centos-7-x86_64', 'centos-6-x86_64'])
+    cache.remember('a1', 'centos-7-x86_64')
+    cache.save()
+
+    completer = shell.Completer(self.cmd_parser, self.cache_path)
+
+    self.assertEqual(completer.matches(['vm', 'get'], 'cent'),
+                     ['centos-6-x86_64', 'centos-7-x86_64'])
+    self.assertEqual(completer.matches(['vm', 'get', 'win-2012r2-x86_64'], 'w'),
+                     ['win-2012r2-x86_64'])
+    self.assertEqual(completer.matches(['vm', 'destroy'], ''), ['a1'])
+
+    cache.remember('a2', 'centos-7-x86_64')
+    cache.save()
+    utime(self.cache_path, (1, 1))
+
+    self.assertEqual(completer.matches(['vm', 'destroy', 'a1'], 'a'), ['a1', 'a2'])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_run_script(self):
+    """Verify commands share the configuration and a failing command does not stop the shell."""
+
+    config = {'vmpooler_hostname': 'vmpooler.delivery.puppetlabs.net'}
+    script = StringIO('vm get centos-7-x86_64\n\nvm get bad\nvm bogus\n'
+                      'vm get "unterminated\nvm get debian-8-x86_64\nexit\nvm get never\n')
+
+    with patch.object(shell, 'locate_cache', return_value=self.cache_path):
+      with self.assertRaises(RuntimeError) as cm:
+        shell.run(self.cmd_parser, config, stdin=script)
+
+    self.assertEqual([platform for platform, _ in self.calls],
+                     [['centos-7-x86_64'], ['bad'], ['debian-8-x86_64']])
+    self.assertTrue(all(conf is config for _, conf in self.calls))
+    self.assertIn('3 of 5 commands failed', str(cm.exception))
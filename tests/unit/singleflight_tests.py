@@ -0,0 +1,136 @@
+"""
+.. module:: vmpooler_client.tests.unit.singleflight_tests
+   :synopsis: Unit tests for coalescing identical concurrent reads.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client import service
+from vmpooler_client.singleflight import SingleFlight
+from threading import Event, Thread
+from time import sleep
+from unittest import main, TestCase, skipIf
+from mock import patch
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Mocks
+#===================================================================================================
+class _HttpResponse(object):
+  def __init__(self, status, return_value='default', reason='default'):
+    self.status = status
+    self.reason = reason
+    self._return_value = return_value
+
+  def read(self):
+    return self._return_value
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class SingleFlightTests(TestCase):
+  """Tests for the singleflight module."""
+
+  def _run_concurrently(self, count, func):
+    """Call a function from several threads at once and collect the results."""
+
+    results = []
+    threads = [Thread(target=lambda: results.append(func())) for _ in range(count)]
+
+    for thread in threads:
+      thread.start()
+
+    return threads, results
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_concurrent_calls_coalesced(self):
+    """Verify concurrent calls for the same key share a single call and its result."""
+
+    flight = SingleFlight()
+    release = Event()
+    result = {'template': 'centos-7-x86_64'}
+
+    def _slow():
+      release.wait(5)
+      return result
+
+    threads, results = self._run_concurrently(4, lambda: flight.do('key', _slow))
+
+    # Wait for every caller to join the call in flight before letting it finish.
+    while flight.executed + flight.coalesced < 4:
+      sleep(0.01)
+
+    release.set()
+
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(flight.executed, 1)
+    self.assertEqual(flight.coalesced, 3)
+    self.assertEqual(len(results), 4)
+    self.assertTrue(all(r is result for r in results))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_sequential_calls_not_coalesced(self):
+    """Verify a call made after the previous one finished is executed again."""
+
+    flight = SingleFlight()
+
+    flight.do('key', lambda: 1)
+    flight.do('key', lambda: 2)
+
+    self.assertEqual(flight.executed, 2)
+    self.assertEqual(flight.coalesced, 0)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_error_shared(self):
+    """Verify coalesced callers receive the error raised by the call in flight."""
+
+    flight = SingleFlight()
+    release = Event()
+    errors = []
+
+    def _fail():
+      release.wait(5)
+      raise RuntimeError('Could not find VM!')
+
+    def _call():
+      try:
+        flight.do('key', _fail)
+      except RuntimeError as e:
+        errors.append(e)
+
+    threads, _ = self._run_concurrently(2, _call)
+
+    while flight.executed + flight.coalesced < 2:
+      sleep(0.01)
+
+    release.set()
+
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(len(errors), 2)
+    self.assertIs(errors[0], errors[1])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test04_service_reads_keyed_by_arguments(self):
+    """Verify reads with different arguments are not coalesced."""
+
+    json_body = '{"ok": true, "a": {"running": 1}, "b": {"running": 2}}'
+    resp = _HttpResponse(200, json_body)
+
+    with patch.object(service, '_make_request', return_value=resp) as mock_func:
+      self.assertEqual(service.info_vm('vmpooler', 'a', 'token')['running'], 1)
+      self.assertEqual(service.info_vm('vmpooler', 'b', 'token')['running'], 2)
+
+    self.assertEqual(mock_func.call_count, 2)
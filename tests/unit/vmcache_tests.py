@@ -0,0 +1,84 @@
+"""
+.. module:: vmpooler_client.tests.unit.vmcache_tests
+   :synopsis: Unit tests for the VM cache.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from vmpooler_client.records import VmRecord
+from vmpooler_client.vmcache import VmCache
+from os import remove
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase, skipIf
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+SKIP_EVERYTHING = False
+
+#===================================================================================================
+# Tests
+#===================================================================================================
+class VmCacheTests(TestCase):
+  """Tests for the vmcache module."""
+
+  def setUp(self):
+    self.tmp_dir = mkdtemp()
+    self.path = join(self.tmp_dir, '.vmpooler.cache')
+    self.template_name = 'centos-7-x86_64'
+
+  def tearDown(self):
+    rmtree(self.tmp_dir)
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test01_round_trip(self):
+    """Verify cached templates and start times survive a save and load."""
+
+    cache = VmCache(self.path)
+    cache.remember_records([VmRecord('a', self.template_name, running=2.0)], now=10000.0)
+    cache.remember('b', 'win-2012r2-x86_64', now=10000.0)
+    cache.save()
+
+    cache = VmCache(self.path)
+
+    self.assertEqual(cache.get('a'), (self.template_name, 2800.0))
+    self.assertAlmostEqual(cache.running_hours('a', now=13600.0), 3.0)
+    self.assertAlmostEqual(cache.running_hours('b', now=13600.0), 1.0)
+    self.assertIsNone(cache.get('c'))
+    self.assertIsNone(cache.running_hours('c'))
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test02_retain(self):
+    """Verify VMs which are no longer running are dropped."""
+
+    cache = VmCache(self.path)
+
+    for hostname in ('a', 'b', 'c'):
+      cache.remember(hostname, self.template_name)
+
+    cache.retain(['b', 'd'])
+
+    self.assertEqual(cache.hostnames(), ['b'])
+
+  @skipIf(SKIP_EVERYTHING, 'Skip if we are creating/modifying tests!')
+  def test03_corrupt_cache(self):
+    """Verify an unreadable cache is treated as empty and unchanged caches are not written."""
+
+    with open(self.path, 'w') as f:
+      f.write('{"vms": ')
+
+    cache = VmCache(self.path)
+
+    self.assertEqual(cache.hostnames(), [])
+
+    remove(self.path)
+    cache.save()
+
+    self.assertFalse(exists(self.path))
@@ -0,0 +1,312 @@
+"""
+.. module:: vmpooler_client.cassette
+   :synopsis: Record exchanges with the vmpooler to a cassette file and replay them offline.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import re
+from contextlib import contextmanager
+from threading import Lock
+from time import sleep, time
+from jsoncodec import loads, dumps
+import service
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The version of the cassette file layout.
+FORMAT_VERSION = 1
+
+# Stands in for auth tokens in saved cassettes.
+REDACTED_TOKEN = '<token>'
+
+# Matches the auth token in the path of a token request. E.g. "/token/<token>"
+_TOKEN_PATH = re.compile(r'^/token/([^/?]+)')
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _replace_token(exchange, token, replacement):
+  """Copy an exchange with an auth token replaced in its path, body and response.
+
+  Args:
+    exchange |{str:obj}| = The exchange.
+    token |str| = The text to replace.
+    replacement |str| = The text to replace it with.
+
+  Returns:
+    |{str:obj}| = The copy of the exchange.
+
+  Raises:
+    |None|
+  """
+
+  exchange = dict(exchange)
+
+  for field in ('path', 'body', 'response'):
+    if exchange[field]:
+      exchange[field] = exchange[field].replace(token, replacement)
+
+  headers = []
+
+  # Keep the recorded length in step with the response.
+  for name, value in exchange['headers']:
+    if name == 'Content-Length':
+      value = str(len(exchange['response']))
+
+    headers.append((name, value))
+
+  exchange['headers'] = headers
+
+  return exchange
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class Recorder(object):
+  """A transport which sends requests to the vmpooler and records each exchange. Request headers
+  are not recorded, and auth tokens in paths and in the responses of "POST /token" are replaced
+  with "REDACTED_TOKEN" when the cassette is saved, so that credentials never end up in it.
+
+  Args:
+    path |str| = The cassette file to save to.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, path):
+
+    self.path = path
+    self.exchanges = []
+    self._tokens = set()
+    self._start = time()
+    self._lock = Lock()
+
+  def send(self, method, host, path, body, headers, timings, pool=None, cancellation=None):
+    """Send a request to the vmpooler and record the exchange. Takes the arguments of
+    "service._send_request".
+
+    Returns:
+      |obj| = The response.
+
+    Raises:
+      |RuntimeError| = The vmpooler could not be reached.
+    """
+
+    sent = time() - self._start
+    resp = service._send_request(method, host, path, body, headers, timings, pool, cancellation)
+    headers = [(name, resp.getheader(name))
+               for name in ('Content-Type', 'Content-Length') if resp.getheader(name)]
+    resp_body = resp.read()
+    tokens = set(_TOKEN_PATH.findall(path))
+
+    if (method, path) == ('POST', '/token'):
+      try:
+        tokens.add(loads(resp_body)['token'])
+      except (ValueError, KeyError, TypeError):
+        pass
+
+    with self._lock:
+      self._tokens.update(token for token in tokens if token)
+      self.exchanges.append({'method': method,
+                             'path': path,
+                             'body': body,
+                             'status': resp.status,
+                             'reason': resp.reason,
+                             'headers': headers,
+                             'response': resp_body,
+                             'sent': sent,
+                             'connect': timings.get('connect', 0.0),
+                             'first_byte': timings.get('first_byte', 0.0),
+                             'total': timings.get('total', 0.0)})
+
+    return resp
+
+  def save(self):
+    """Write the recorded exchanges to the cassette file in the order they were sent, with
+    every auth token seen replaced.
+
+    Raises:
+      |RuntimeError| = The cassette could not be written.
+    """
+
+    with self._lock:
+      exchanges = sorted(self.exchanges, key=lambda exchange: exchange['sent'])
+      tokens = sorted(self._tokens, key=len, reverse=True)
+
+    for token in tokens:
+      exchanges = [_replace_token(exchange, token, REDACTED_TOKEN) for exchange in exchanges]
+
+    try:
+      with open(self.path, 'w') as cassette:
+        cassette.write(dumps({'version': FORMAT_VERSION, 'exchanges': exchanges}, indent=2,
+                             sort_keys=True))
+    except IOError as e:
+      raise RuntimeError('Failed to write the "{}" cassette! {}'.format(self.path, e))
+
+
+class Player(object):
+  """A transport which answers requests from the exchanges in a cassette instead of the vmpooler.
+  Requests are matched on their method, path and body. Repeated requests are answered in the
+  order they were recorded. The auth token of a token request is matched against
+  "REDACTED_TOKEN" and put back into the response.
+
+  Args:
+    path |str| = The cassette file to replay.
+    speed |float| = Multiplies the recorded latency of each exchange. "0" replies at once.
+
+  Raises:
+    |RuntimeError| = The cassette could not be read or the speed is negative.
+  """
+
+  def __init__(self, path, speed=1.0):
+
+    if speed < 0:
+      raise RuntimeError('The replay speed must not be negative!')
+
+    try:
+      with open(path) as cassette:
+        exchanges = loads(cassette.read())['exchanges']
+    except (IOError, ValueError, KeyError, TypeError) as e:
+      raise RuntimeError('Failed to read the "{}" cassette! {}'.format(path, e))
+
+    self.path = path
+    self.speed = speed
+    self.requests = []
+    self._pending = {}
+    self._lock = Lock()
+
+    for exchange in exchanges:
+      key = (exchange['method'], exchange['path'], exchange['body'])
+      self._pending.setdefault(key, []).append(exchange)
+
+  def unplayed(self):
+    """Count the recorded exchanges which have not been replayed yet.
+
+    Returns:
+      |int| = The number of exchanges.
+    """
+
+    with self._lock:
+      return sum(len(queue) for queue in self._pending.values())
+
+  def send(self, method, host, path, body, headers, timings, pool=None, cancellation=None):
+    """Answer a request from the cassette after its recorded latency. Takes the arguments of
+    "service._send_request". Replayed requests are answered in full even if cancelled.
+
+    Returns:
+      |obj| = The response.
+
+    Raises:
+      |RuntimeError| = The cassette has no response left for the request.
+    """
+
+    token = _TOKEN_PATH.match(path)
+    key_path = path if token is None else path.replace(token.group(1), REDACTED_TOKEN)
+
+    with self._lock:
+      self.requests.append('{} {}'.format(method, path))
+      queue = self._pending.get((method, key_path, body))
+      exchange = queue.pop(0) if queue else None
+
+    if exchange is None:
+      raise RuntimeError('The "{}" cassette has no response for "{} {}"!'.format(
+        self.path, method, path))
+
+    if token is not None:
+      exchange = _replace_token(exchange, REDACTED_TOKEN, token.group(1))
+
+    timings['connect'] = exchange['connect'] * self.speed
+    timings['first_byte'] = exchange['first_byte'] * self.speed
+    timings['total'] = exchange['total'] * self.speed
+
+    sleep(timings['total'])
+
+    return service._Response(exchange['status'], exchange['reason'], exchange['headers'],
+                             exchange['response'])
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+@contextmanager
+def recording(path):
+  """Record every request sent within the block to a cassette.
+
+  Args:
+    path |str| = The cassette file to save to.
+
+  Returns:
+    |Recorder| = The recorder.
+
+  Raises:
+    |RuntimeError| = The cassette could not be written.
+  """
+
+  recorder = Recorder(path)
+  previous = service.use_transport(recorder)
+
+  try:
+    yield recorder
+  finally:
+    service.use_transport(previous)
+    recorder.save()
+
+
+@contextmanager
+def replaying(path, speed=1.0):
+  """Answer every request sent within the block from a cassette.
+
+  Args:
+    path |str| = The cassette file to replay.
+    speed |float| = Multiplies the recorded latency of each exchange. "0" replies at once.
+
+  Returns:
+    |Player| = The player.
+
+  Raises:
+    |RuntimeError| = The cassette could not be read.
+  """
+
+  player = Player(path, speed)
+  previous = service.use_transport(player)
+
+  try:
+    yield player
+  finally:
+    service.use_transport(previous)
+
+
+@contextmanager
+def use(record_path=None, replay_path=None, speed=1.0):
+  """Record to or replay from a cassette within the block, if either is given.
+
+  Args:
+    record_path |str| = The cassette file to record to.
+    replay_path |str| = The cassette file to replay.
+    speed |float| = Multiplies the recorded latency of each replayed exchange.
+
+  Returns:
+    |Recorder| or |Player| or |None| = The transport in use.
+
+  Raises:
+    |RuntimeError| = Both a recording and a replay were requested, or the cassette failed.
+  """
+
+  if record_path and replay_path:
+    raise RuntimeError('A cassette cannot be recorded and replayed at the same time!')
+
+  if record_path:
+    with recording(record_path) as recorder:
+      yield recorder
+  elif replay_path:
+    with replaying(replay_path, speed) as player:
+      yield player
+  else:
+    yield None
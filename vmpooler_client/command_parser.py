@@ -64,9 +64,34 @@ class CommandParser(object):
 
     self._commands = {}
     self._sub_commands = {}
+    self._args = None
+
+  def add_global_arg(self, **kwargs):
+    """Add an option which applies to every command. Global options must be given before the
+    top-level command on the command-line.
+
+    Args:
+      **kwargs |{str:obj}| = An arbitrary number of keyword arguments to pass to the
+        "ArgumentParser.add_argument()" method. The "name" keyword argument *must* be
+        supplied at a bare minimum!
+
+    Returns:
+      |None|
+
+    Raises:
+      |KeyError| = The **kwargs dictionary is missing the required "name" key.
+    """
+
+    if 'name' not in kwargs:
+      raise KeyError("The keyword argument 'name' must be specified for this method!")
+
+    arg_name = kwargs.pop('name')
+
+    self._parser.add_argument(arg_name, **kwargs)
 
   def add_command(self, cmd_name, desc, func=None):
-    """Create a top-level command.
+    """Create a top-level command. The name of the command given on the command-line is stored
+    in the "command" attribute of the parsed arguments.
 
     Args:
       cmd_name |str| = The name of the command.
@@ -83,6 +108,7 @@ class CommandParser(object):
 
     if cmd_name not in self._commands:
       command = self._sub_parsers.add_parser(cmd_name, description=desc)
+      command.set_defaults(command=cmd_name)
 
       if func:
         self._commands[cmd_name] = command
@@ -192,6 +218,91 @@ class CommandParser(object):
 
     self._sub_commands[sub_cmd_key].add_argument(arg_name, **kwargs)
 
+  def commands(self):
+    """List the top-level commands and their sub-commands, e.g. for completion.
+
+    Args:
+      None
+
+    Returns:
+      |{str:[str]}| = The sorted sub-command names of each top-level command. Commands that do
+        not allow sub-commands have none.
+
+    Raises:
+      None
+    """
+
+    names = dict((cmd_name, []) for cmd_name in self._commands)
+
+    for sub_cmd_key in self._sub_commands:
+      # Top-level command names never contain an underscore but sub-command names may.
+      parent, sub_cmd_name = sub_cmd_key.split('_', 1)
+      names[parent].append(sub_cmd_name)
+
+    for sub_cmd_names in names.values():
+      sub_cmd_names.sort()
+
+    return names
+
+  def global_options(self):
+    """List the options which apply to every command, e.g. for completion.
+
+    Args:
+      None
+
+    Returns:
+      |[(str, bln)]| = The sorted option strings and whether each takes a value.
+
+    Raises:
+      None
+    """
+
+    return sorted((option, action.nargs != 0)
+                  for action in self._parser._actions for option in action.option_strings)
+
+  def options(self, command, sub_cmd_name=None):
+    """List the options accepted by a command or sub-command, e.g. for completion.
+
+    Args:
+      command |str| = The name of the top-level command.
+      sub_cmd_name |str| = The name of the sub-command. Omit for commands that do not allow
+        sub-commands.
+
+    Returns:
+      |[str]| = The sorted option strings. E.g. "--help"
+
+    Raises:
+      |KeyError| = The command or sub-command specified does not exist.
+    """
+
+    if sub_cmd_name is None:
+      parser = self._commands[command]
+    else:
+      parser = self._sub_commands["{}_{}".format(command, sub_cmd_name)]
+
+    if not isinstance(parser, argparse.ArgumentParser):
+      return []
+
+    return sorted(option for action in parser._actions for option in action.option_strings)
+
+  def parse(self):
+    """Parse the command-line. The result is cached so the command-line is parsed only once.
+
+    Args:
+      None
+
+    Returns:
+      |argparse.Namespace| = A collection of arguments and flags.
+
+    Raises:
+      None
+    """
+
+    if self._args is None:
+      self._args = self._parser.parse_args(args=self._argv[1:])
+
+    return self._args
+
   def parse_execute(self, **kwargs):
     """Parse the command-line and execute the associated behavior with the given command.
 
@@ -206,7 +317,30 @@ class CommandParser(object):
       None
     """
 
-    args = self._parser.parse_args(args=self._argv[1:])
+    args = self.parse()
 
     # Execute the associated function for the given command and arguments.
     args.func(args, **kwargs)
+
+  def execute(self, argv, **kwargs):
+    """Parse and execute a command-line other than the one the parser was created with, e.g. a
+    line entered in the interactive shell. The result is not cached, so the same parser can
+    execute any number of command-lines.
+
+    Args:
+      argv |[str]| = The arguments of the command-line without the program name.
+      **kwargs |{str:obj}| = An arbitrary number of keyword arguments to pass to the associated
+        function for the given command and arguments.
+
+    Returns:
+      |argparse.Namespace| = A collection of arguments and flags.
+
+    Raises:
+      |SystemExit| = The command-line is invalid or help was requested.
+    """
+
+    args = self._parser.parse_args(args=argv)
+
+    args.func(args, **kwargs)
+
+    return args
@@ -0,0 +1,72 @@
+"""
+.. module:: vmpooler_client.commands.completion
+   :synopsis: Sub-commands for the "completion" top-level command.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+from ..completion import locate_index, refresh_cache, render_script, write_index, SHELLS
+from ..vmcache import load_cache, locate_cache
+
+#===================================================================================================
+# Subcommands
+#===================================================================================================
+def script(cmd_parser, shell_name, args, config):
+  """Main routine for the bash and zsh subcommands. The parser and shell are bound when the
+  sub-command is configured.
+
+  Args:
+    cmd_parser |vmpooler_client.command_parser.CommandParser| = The command parser.
+    shell_name |str| = The shell to generate the completion script for.
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The script could not be written.
+  """
+
+  content = render_script(shell_name, cmd_parser, locate_index(), locate_cache())
+
+  try:
+    with open(args.file, 'w') as f:
+      f.write(content)
+  except IOError as e:
+    raise RuntimeError('Could not write the completion script: {}'.format(e))
+
+  print('Wrote the {} completion script to "{}". Source it from your shell startup '
+        'file.'.format(shell_name, args.file))
+
+
+def refresh(args, config):
+  """Main routine for the refresh subcommand. Completion scripts run it in the background.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The vmpooler could not be queried.
+  """
+
+  index_path = locate_index()
+
+  # Mark the index as fresh first so that completions in the meantime do not start more refreshes.
+  with open(index_path, 'a'):
+    os.utime(index_path, None)
+
+  if not args.local:
+    refresh_cache(config, locate_cache())
+
+  write_index(load_cache(), index_path)
@@ -11,9 +11,50 @@
 # Imports
 #===================================================================================================
 from ..conf_file import get_vmpooler_hostname, get_auth_token
+from ..journal import open_journal, run_journaled
+from ..parallel import bulk_workers
+from ..records import VmRecord
 from ..service import info_vm, set_vm_lifetime
 from ..util import MAX_LIFETIME
 
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _set_lifetimes(config, resume, plan):
+  """Set the lifetimes of several VMs concurrently and record them in a journal so that an
+  interrupted run can be resumed.
+
+  Args:
+    config |{str:str}| = A dictionary of settings from the configuration file.
+    resume |bln| = Resume the interrupted run instead of starting a new one.
+    plan |func| = A function returning the hostname and lifetime of each VM of a new run.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The lifetime of a VM could not be set.
+  """
+
+  vmpooler_hostname = get_vmpooler_hostname(config)
+  auth_token = get_auth_token(config)
+  journal = open_journal('lifetime', vmpooler_hostname, resume, plan)
+
+  results = run_journaled(journal,
+                          lambda pair: set_vm_lifetime(vmpooler_hostname, pair[0], pair[1],
+                                                       auth_token),
+                          bulk_workers(config, 'lifetime'))
+  failed = []
+
+  for (vm, _), _, error in results:
+    if error:
+      failed.append(vm)
+      print("{} | Failed: {}".format(vm, error))
+
+  if failed:
+    raise RuntimeError('Could not set the lifetime of: {}. Use "lifetime resume" to retry '
+                       'them.'.format(', '.join(failed)))
+
 #===================================================================================================
 # Subcommands
 #===================================================================================================
@@ -31,13 +72,14 @@ def get(args, config):
     |None|
   """
 
-  lifetime = info_vm(get_vmpooler_hostname(config), args.hostname, get_auth_token(config))["lifetime"]
+  vm_info = info_vm(get_vmpooler_hostname(config), args.hostname, get_auth_token(config))
 
-  print("lifetime: {} hours".format(lifetime))
+  print("lifetime: {} hours".format(VmRecord.from_info(args.hostname, vm_info).lifetime))
 
 
 def set(args, config):
-  """Main routine for the lifetime set subcommand.
+  """Main routine for the lifetime set subcommand. The lifetimes of several VMs are set
+  concurrently and recorded in a journal so that an interrupted run can be resumed.
 
   Args:
     args |argparse.Namespace| = A collection of arguments and flags.
@@ -47,10 +89,28 @@ def set(args, config):
     |None|
 
   Raises:
+    |RuntimeError| = The lifetime of a VM could not be set.
+  """
+
+  _set_lifetimes(config, False, lambda: [(vm, args.hours) for vm in args.hostname])
+
+
+def resume(args, config):
+  """Main routine for the lifetime resume subcommand. An interrupted lifetime set is resumed,
+  skipping the VMs it changed.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
     |None|
+
+  Raises:
+    |RuntimeError| = There is nothing to resume or the lifetime of a VM could not be set.
   """
 
-  set_vm_lifetime(get_vmpooler_hostname(config), args.hostname, args.hours, get_auth_token(config))
+  _set_lifetimes(config, True, None)
 
 
 def extend(args, config):
@@ -64,11 +124,18 @@ def extend(args, config):
     |None|
 
   Raises:
-    |RuntimeError| = If the new lifetime would exceed the maximum allowed lifetime
+    |RuntimeError| = If the new lifetime would exceed the maximum allowed lifetime or the running
+      time of the VM is unknown
   """
 
   vm_info = info_vm(get_vmpooler_hostname(config), args.hostname, get_auth_token(config))
-  running = round(float(vm_info["running"]))
+  record = VmRecord.from_info(args.hostname, vm_info)
+
+  if record.running is None:
+    raise RuntimeError('The vmpooler did not report how long "{}" has been running!'.format(
+      args.hostname))
+
+  running = round(record.running)
   extension = int(args.hours)
 
   new_lifetime = int(running + extension)
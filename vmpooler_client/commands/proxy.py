@@ -0,0 +1,56 @@
+"""
+.. module:: vmpooler_client.commands.proxy
+   :synopsis: The "proxy" top-level command.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from socket import error as socket_error
+from ..conf_file import get_vmpooler_hostname
+from ..proxy import ProxyServer
+
+#===================================================================================================
+# Subcommands
+#===================================================================================================
+def serve(args, config):
+  """Main routine for the proxy command. Serves until interrupted.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The proxy would forward to itself or could not listen.
+  """
+
+  upstream = args.upstream or config.get('proxy_upstream') or get_vmpooler_hostname(config)
+  address = '{}:{}'.format(args.bind, args.port)
+
+  if upstream in (address, 'localhost:{}'.format(args.port)):
+    raise RuntimeError('The proxy would forward to itself! Use --upstream or set the '
+                       '"proxy_upstream" config option to the real vmpooler.')
+
+  try:
+    server = ProxyServer((args.bind, args.port), upstream, args.ttl)
+  except socket_error as e:
+    raise RuntimeError('Could not listen on {}: {}'.format(address, e))
+
+  print('Proxying {} to {}. Press Ctrl-C to stop.'.format(address, upstream))
+
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+  print('\nCache hits: {} | Misses: {} | Coalesced: {} | Passed through: {}'.format(
+    server.hits, server.misses, server.coalesced, server.passed))
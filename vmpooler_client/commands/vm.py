@@ -10,9 +10,36 @@
 #===================================================================================================
 # Imports
 #===================================================================================================
-from ..conf_file import get_vmpooler_hostname, get_auth_token
-from ..service import get_vm, list_vm, info_vm, destroy_vm, get_token_info
+import sys
+from fnmatch import fnmatchcase
+from heapq import nlargest, nsmallest
+from operator import attrgetter
+from time import time
+from ..conf_file import get_vmpooler_hostname, get_auth_token, get_float
+from ..journal import open_journal, run_journaled
+from ..jsoncodec import dumps
+from ..metrics import record_ready
+from ..parallel import bulk_workers, run_parallel, DEFAULT_WORKERS
+from ..planner import plan as plan_batch
+from ..provision import load_batch, run_batch, DEFAULT_DEADLINE
+from ..readiness import fqdn, wait_ready
+from ..service import (checkout_vm, list_vm, info_vm, info_vms, destroy_vm, get_running_vms,
+                       snapshot_vm, revert_vm, VmNotFoundError)
 from ..util import pretty_print
+from ..vmcache import load_cache
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The fields "vm running" can sort on and whether each is sorted largest first.
+SORT_FIELDS = {'running': True, 'lifetime': True, 'remaining': False, 'template': False}
+
+# Characters which make a "vm destroy" target a glob pattern.
+_GLOB_CHARS = frozenset('*?[')
+
+# Hours of leeway given to ages computed from cached start times, which may differ slightly from
+# the ages reported by the vmpooler.
+_CACHED_AGE_SLACK = 0.05
 
 #===================================================================================================
 # Functions: Private
@@ -79,12 +106,254 @@ def _list_running_vms(vmpooler_hostname, auth_token):
     |None|
   """
 
-  token_info = get_token_info(vmpooler_hostname, auth_token)
+  return get_running_vms(vmpooler_hostname, auth_token)
+
+
+def _matches(args, template, running, unknown=False, slack=0.0):
+  """Check a VM against the "--template", "--older-than" and "--younger-than" filters.
+
+  Args:
+    args |argparse.Namespace| = The arguments of the running subcommand.
+    template |str| = The template of the VM or "None" if it is not known.
+    running |float| = The hours the VM has been running or "None" if it is not known.
+    unknown |bln| = The result for a filter whose field is not known.
+    slack |float| = Hours of leeway given to the age filters.
+
+  Returns:
+    |bln| = Whether the VM passes every filter.
+
+  Raises:
+    |None|
+  """
 
-  if "vms" in token_info:
-    return token_info["vms"]["running"]
+  if args.template:
+    if template is None:
+      if not unknown:
+        return False
+    elif not _fuzzy_match(args.template, template):
+      return False
+
+  if args.older_than is not None or args.younger_than is not None:
+    if running is None:
+      return unknown
+    elif args.older_than is not None and running + slack < args.older_than:
+      return False
+    elif args.younger_than is not None and running - slack > args.younger_than:
+      return False
+
+  return True
+
+
+def _sort_key(field):
+  """Build a sort key for records which puts records missing the field last.
+
+  Args:
+    field |str| = The name of the field. One of "SORT_FIELDS".
+
+  Returns:
+    |func| = The key function.
+
+  Raises:
+    |None|
+  """
+
+  getter = attrgetter(field)
+
+  if SORT_FIELDS[field]:
+    return lambda vm: (getter(vm) is not None, getter(vm))
+
+  return lambda vm: (getter(vm) is None, getter(vm))
+
+
+def _wait_until_ready(checked_out, port, timeout):
+  """Wait for checked-out VMs to accept connections and report how long each one took.
+
+  Args:
+    checked_out |[(str, str)]| = The template and fully qualified domain name of each VM.
+    port |int| = The TCP port to probe.
+    timeout |float| = The number of seconds to wait for every VM.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = A VM did not accept connections before the deadline.
+  """
+
+  ready_after = wait_ready([host for _, host in checked_out], port=port, timeout=timeout)
+  not_ready = []
+
+  for template, host in checked_out:
+    seconds = ready_after[host]
+
+    if seconds is None:
+      not_ready.append(host)
+      print("{} | Not ready after {} seconds".format(host, timeout))
+    else:
+      record_ready(template, seconds)
+      print("{} | Ready in {:.1f} seconds".format(host, seconds))
+
+  if not_ready:
+    raise RuntimeError('VMs not accepting connections on port {}: {}'.format(port,
+                                                                            ', '.join(not_ready)))
+
+
+def _max_workers(config):
+  """Read the number of concurrent requests allowed for bulk operations.
+
+  Args:
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |int| = The number of concurrent requests.
+
+  Raises:
+    |RuntimeError| = The setting is not a number.
+  """
+
+  return max(int(get_float(config, 'max_workers', DEFAULT_WORKERS)), 1)
+
+
+def _read_snapshot_list(path):
+  """Read the VMs and snapshots saved by "vm snapshot --save".
+
+  Args:
+    path |str| = The path of the file or "-" for stdin. Each line holds a hostname and a
+      snapshot name separated by whitespace.
+
+  Returns:
+    |[(str, str)]| = The hostname and snapshot name pairs.
+
+  Raises:
+    |RuntimeError| = The file is unreadable or a line is malformed.
+  """
+
+  if path == '-':
+    lines = sys.stdin.readlines()
   else:
-    return []
+    try:
+      with open(path, 'r') as f:
+        lines = f.readlines()
+    except IOError as e:
+      raise RuntimeError('Could not read "{}": {}'.format(path, e.strerror))
+
+  pairs = []
+
+  for line in lines:
+    fields = line.split()
+
+    if not fields or fields[0].startswith('#'):
+      continue
+    elif len(fields) != 2:
+      raise RuntimeError('Expected "HOSTNAME SNAPSHOT" but found "{}"'.format(line.strip()))
+
+    pairs.append(tuple(fields))
+
+  return pairs
+
+
+def _resolve_targets(targets, fuzzy, vmpooler_hostname, auth_token):
+  """Expand the targets of "vm destroy" into hostnames. A target is a hostname, "-" to read
+  hostnames from stdin, or a glob pattern matched against the running VMs of the token. With
+  "fuzzy" every other target is fuzzily matched against the running VMs too.
+
+  Args:
+    targets |[str]| = The targets.
+    fuzzy |bln| = Treat hostnames as fuzzy patterns.
+    vmpooler_hostname |str| = The URL of the vmpooler
+    auth_token |str| = The authentication token for the user
+
+  Returns:
+    |[str]| = The hostnames in the order given, without duplicates.
+
+  Raises:
+    |RuntimeError| = The running VMs could not be listed.
+  """
+
+  running_vms = None
+  hostnames = []
+
+  for target in targets:
+    if target == '-':
+      for line in sys.stdin:
+        fields = line.split()
+
+        if fields and not fields[0].startswith('#'):
+          hostnames.append(fields[0])
+
+      continue
+    elif not fuzzy and not _GLOB_CHARS.intersection(target):
+      hostnames.append(target)
+      continue
+
+    if running_vms is None:
+      running_vms = _list_running_vms(vmpooler_hostname, auth_token)
+
+    if _GLOB_CHARS.intersection(target):
+      matched = [vm for vm in running_vms if fnmatchcase(vm, target)]
+    else:
+      matched = _fuzzy_filter(target, running_vms)
+
+    if not matched:
+      print("No running VMs match '{}'".format(target))
+
+    hostnames.extend(matched)
+
+  unique = []
+  seen = set()
+
+  for vm in hostnames:
+    if vm not in seen:
+      seen.add(vm)
+      unique.append(vm)
+
+  return unique
+
+
+def _destroy_vms(vmpooler_hostname, journal, auth_token, workers):
+  """Destroy the pending VMs of a journal concurrently. VMs which no longer exist are reported as
+  already destroyed.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    journal |Journal| = The journal holding the hostnames of the VMs.
+    auth_token |str| = The authentication token for the user
+    workers |int| or |AdaptiveLimit| = The maximum number of concurrent requests.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = Some VMs could not be destroyed.
+  """
+
+  def _destroy(vm):
+    try:
+      destroy_vm(vmpooler_hostname, vm, auth_token)
+    except VmNotFoundError:
+      return False
+
+    return True
+
+  for _, vm in journal.pending():
+    print("Destroying {}".format(vm))
+
+  results = run_journaled(journal, _destroy, workers)
+  failed = []
+
+  for vm, destroyed, error in results:
+    if error:
+      failed.append((vm, error))
+    elif not destroyed:
+      print("{} was already destroyed".format(vm))
+
+  cache = load_cache()
+  cache.forget(vm for vm, _, error in results if not error)
+  cache.save()
+
+  if failed:
+    raise RuntimeError('Could not destroy {} of {} VMs! Use --resume to retry them.\n{}'.format(
+      len(failed), len(results), '\n'.join('{}: {}'.format(vm, e) for vm, e in failed)))
 
 
 #===================================================================================================
@@ -106,6 +375,10 @@ def list(args, config):
 
   search_string = args.platform
   templates = list_vm(get_vmpooler_hostname(config), get_auth_token(config))
+  cache = load_cache()
+
+  cache.remember_templates(templates)
+  cache.save()
 
   if search_string:
     templates = (template for template in _fuzzy_filter(search_string, templates))
@@ -127,11 +400,25 @@ def get(args, config):
     |None|
 
   Raises:
-    |None|
+    |RuntimeError| = A VM did not become ready before the deadline.
   """
 
-  hostname = get_vm(get_vmpooler_hostname(config), args.platform, get_auth_token(config))
-  print('Hostname: {0}'.format(hostname))
+  vmpooler_hostname = get_vmpooler_hostname(config)
+  auth_token = get_auth_token(config)
+  checked_out = []
+
+  cache = load_cache()
+
+  for platform in args.platform:
+    hostname, domain = checkout_vm(vmpooler_hostname, platform, auth_token)
+    print('Hostname: {0}'.format(hostname))
+    checked_out.append((platform, fqdn(hostname, domain)))
+    cache.remember(hostname, platform)
+
+  cache.save()
+
+  if args.ready:
+    _wait_until_ready(checked_out, args.ready_port, args.ready_timeout)
 
 
 def info(args, config):
@@ -162,10 +449,26 @@ def destroy(args, config):
     |None|
 
   Raises:
-    |None|
+    |RuntimeError| = No hostnames were given or some VMs could not be destroyed.
   """
 
-  destroy_vm(get_vmpooler_hostname(config), args.hostname, get_auth_token(config))
+  if args.resume == bool(args.hostname):
+    raise RuntimeError('Specify either hostnames or --resume!')
+
+  vmpooler_hostname = get_vmpooler_hostname(config)
+  auth_token = get_auth_token(config)
+  journal = open_journal('destroy',
+                          vmpooler_hostname,
+                          args.resume,
+                          lambda: _resolve_targets(args.hostname,
+                                                   args.fuzzy,
+                                                   vmpooler_hostname,
+                                                   auth_token))
+
+  if journal:
+    _destroy_vms(vmpooler_hostname, journal, auth_token, bulk_workers(config, 'destroy'))
+  else:
+    print("No VMs to destroy")
 
 
 def destroy_all(args, config):
@@ -180,23 +483,125 @@ def destroy_all(args, config):
     |None|
 
   Raises:
+    |RuntimeError| = Some VMs could not be destroyed.
+  """
+
+  vmpooler_hostname = get_vmpooler_hostname(config)
+  auth_token = get_auth_token(config)
+  journal = open_journal('destroy_all',
+                          vmpooler_hostname,
+                          args.resume,
+                          lambda: _list_running_vms(vmpooler_hostname, auth_token))
+
+  if journal:
+    _destroy_vms(vmpooler_hostname, journal, auth_token, bulk_workers(config, 'destroy_all'))
+  else:
+    print("No VMs to destroy")
+
+
+def running(args, config):
+  """Main routine for the running subcommand. VMs whose template and start time are cached are
+  filtered before their information is requested.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |dict| = A dictionary of settings from the configuration file.
+
+  Returns:
     |None|
+
+  Raises:
+    |RuntimeError| = An invalid limit was specified.
   """
 
+  if args.limit is not None and args.limit < 1:
+    raise RuntimeError('The limit must be at least 1!')
+
   vmpooler_hostname = get_vmpooler_hostname(config)
   auth_token = get_auth_token(config)
   vm_list = _list_running_vms(vmpooler_hostname, auth_token)
+  cache = load_cache()
+  now = time()
+
+  cache.retain(vm_list)
+
+  candidates = []
 
   for vm in vm_list:
-    print("Destroying {}".format(vm))
-    destroy_vm(vmpooler_hostname, vm, auth_token)
+    template, _ = cache.get(vm) or (None, None)
+
+    if _matches(args, template, cache.running_hours(vm, now), True, _CACHED_AGE_SLACK):
+      candidates.append(vm)
+
+  records = info_vms(vmpooler_hostname, candidates, auth_token, bulk_workers(config, 'running'))
+
+  cache.remember_records(records)
+  cache.save()
+
+  records = [vm for vm in records if _matches(args, vm.template, vm.running)]
+  key = _sort_key(args.sort)
+
+  if args.limit is not None:
+    top = nlargest if SORT_FIELDS[args.sort] else nsmallest
+    records = top(args.limit, records, key)
+  else:
+    records.sort(key=key, reverse=SORT_FIELDS[args.sort])
+
+  for vm in records:
+    line = "{} | Running: {} hours | {}".format(vm.hostname, vm.running, vm.template)
+
+    if args.sort in ('lifetime', 'remaining'):
+      line += " | Lifetime: {} hours".format(vm.lifetime)
+
+    print(line)
 
   if not vm_list:
-    print("No VMs to destroy")
+    print("No VMs running for this user")
+  elif not records:
+    print("No running VMs match the filters")
 
 
-def running(args, config):
-  """Main routine for the running subcommand.
+def snapshot(args, config):
+  """Main routine for the snapshot subcommand.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |dict| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = A VM could not be snapshotted.
+  """
+
+  vmpooler_hostname = get_vmpooler_hostname(config)
+  auth_token = get_auth_token(config)
+
+  results = run_parallel(lambda vm: snapshot_vm(vmpooler_hostname, vm, auth_token),
+                         args.hostname,
+                         bulk_workers(config, 'snapshot'))
+  failed = []
+
+  for vm, snapshot_name, error in results:
+    if error:
+      failed.append(vm)
+      print("{} | Failed: {}".format(vm, error))
+    else:
+      print("{} | Snapshot: {}".format(vm, snapshot_name))
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      for vm, snapshot_name, error in results:
+        if not error:
+          f.write('{} {}\n'.format(vm, snapshot_name))
+
+  if failed:
+    raise RuntimeError('Could not snapshot: {}'.format(', '.join(failed)))
+
+
+def revert(args, config):
+  """Main routine for the revert subcommand.
 
   Args:
     args |argparse.Namespace| = A collection of arguments and flags.
@@ -209,20 +614,112 @@ def running(args, config):
     |None|
   """
 
+  revert_vm(get_vmpooler_hostname(config), args.hostname, args.snapshot, get_auth_token(config))
+
+
+def recycle(args, config):
+  """Main routine for the recycle subcommand.
+     Reverts every VM saved by "vm snapshot --save" to its snapshot in parallel.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |dict| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = A VM could not be reverted.
+  """
+
+  if args.resume == bool(args.file):
+    raise RuntimeError('Specify either a file or --resume!')
+
   vmpooler_hostname = get_vmpooler_hostname(config)
   auth_token = get_auth_token(config)
-  vm_list = _list_running_vms(vmpooler_hostname, auth_token)
+  journal = open_journal('recycle',
+                          vmpooler_hostname,
+                          args.resume,
+                          lambda: _read_snapshot_list(args.file))
 
-  # Associate the hostname with its info
-  vm_info_dict = dict((vm, info_vm(vmpooler_hostname, vm, auth_token)) for vm in vm_list)
+  if not journal:
+    print("No VMs to recycle")
+    return
 
-  # Sort on how long they've been running
-  sorted_vm_info = sorted(vm_info_dict.items(),
-                          key=lambda (k, v): float(v["running"]),
-                          reverse=True)
+  results = run_journaled(journal,
+                           lambda pair: revert_vm(vmpooler_hostname, pair[0], pair[1], auth_token),
+                           bulk_workers(config, 'recycle'))
+  failed = []
 
-  for hostname, info in sorted_vm_info:
-    print("{} | Running: {} hours | {}".format(hostname, info["running"], info["template"]))
+  for (vm, snapshot_name), _, error in results:
+    if error:
+      failed.append(vm)
+      print("{} | Failed: {}".format(vm, error))
+    else:
+      print("{} | Reverted to {}".format(vm, snapshot_name))
 
-  if not vm_list:
-    print("No VMs running for this user")
+  if failed:
+    raise RuntimeError('Could not revert: {}. Use --resume to retry them.'.format(
+      ', '.join(failed)))
+
+
+def provision(args, config):
+  """Main routine for the provision subcommand.
+     Releases VMs and changes lifetimes listed in a manifest, then acquires every VM in it
+     concurrently or releases all of them.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |dict| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The manifest is invalid, could not be filled before the deadline, or a
+      release or lifetime change failed.
+  """
+
+  vmpooler_hostname = get_vmpooler_hostname(config)
+  demands, manifest_deadline, releases, lifetimes = load_batch(args.manifest, vmpooler_hostname)
+  deadline = args.deadline or manifest_deadline or DEFAULT_DEADLINE
+  cache = load_cache()
+
+  # Knowing the template of a released VM lets only the acquisitions of that template wait.
+  for vm in releases:
+    if vm['template'] is None:
+      vm['template'] = (cache.get(vm['hostname']) or (None, None))[0]
+
+  if args.dry_run:
+    for step in plan_batch(demands, releases, lifetimes):
+      print(step.describe())
+
+    return
+
+  vms, failures = run_batch(demands,
+                            get_auth_token(config),
+                            releases,
+                            lifetimes,
+                            deadline=deadline,
+                            retry_interval=args.retry_interval,
+                            workers=_max_workers(config))
+  failed = [hostname for hostname, _ in failures]
+
+  for hostname, error in failures:
+    print("{} | Failed: {}".format(hostname, error))
+
+  cache.forget(vm['hostname'] for vm in releases if vm['hostname'] not in failed)
+  cache.save()
+
+  for vm in vms:
+    print("{} | {}".format(vm['fqdn'], vm['template']))
+
+  if args.inventory:
+    with open(args.inventory, 'w') as f:
+      f.write(dumps(vms, indent=2, sort_keys=True))
+
+  if not (vms or releases or lifetimes):
+    print("The manifest does not request any VMs")
+
+  if failed:
+    raise RuntimeError('Could not release or change the lifetime of: {}'.format(', '.join(failed)))
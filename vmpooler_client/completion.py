@@ -0,0 +1,329 @@
+"""
+.. module:: vmpooler_client.completion
+   :synopsis: Generate shell completion scripts and the local index they complete from.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+from os.path import dirname, join
+from tempfile import mkstemp
+from conf_file import locate_config, get_float
+from parallel import DEFAULT_WORKERS
+from service import list_vm, get_running_vms, info_vms
+from vmcache import VmCache
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+INDEX_NAME = '.vmpooler.completion'
+
+# The shells completion scripts can be generated for.
+SHELLS = ('bash', 'zsh')
+
+# The number of minutes after which completing a template or hostname refreshes the index from
+# the vmpooler in the background.
+REFRESH_MINUTES = 5
+
+# The sub-commands whose positional arguments are templates or VM hostnames, and whether they
+# accept more than one.
+TEMPLATE_ARGS = {('vm', 'get'): True, ('vm', 'list'): False}
+HOSTNAME_ARGS = {('vm', 'info'): False,
+                 ('vm', 'destroy'): True,
+                 ('vm', 'snapshot'): True,
+                 ('vm', 'revert'): False,
+                 ('lifetime', 'get'): False,
+                 ('lifetime', 'set'): True,
+                 ('lifetime', 'extend'): False}
+
+# The completion function shared by bash and zsh. The "@...@" markers are replaced with the
+# command tree, the global options and the paths of the index and VM cache.
+_SCRIPT = r'''_vmpooler_client_index() {
+  local index='@INDEX@' cache='@CACHE@' kind name
+
+  # Refresh the index in the background so that completion never waits on the vmpooler.
+  if [ -f "$index" ] && [ "$cache" -nt "$index" ]; then
+    ("${COMP_WORDS[0]}" completion refresh --local >/dev/null 2>&1 &)
+  elif [ ! -f "$index" ] || [ -n "$(find "$index" -mmin +@MINUTES@ 2>/dev/null)" ]; then
+    ("${COMP_WORDS[0]}" completion refresh >/dev/null 2>&1 &)
+  fi
+
+  [ -f "$index" ] || return 0
+
+  while read -r kind name; do
+    [ "$kind" = "$1" ] && printf '%s\n' "$name"
+  done < "$index"
+}
+
+_vmpooler_client() {
+  local cur="${COMP_WORDS[COMP_CWORD]}" cmd='' sub='' value=''
+  local candidates='' positional=0 i
+
+  # Global options and their values come before the command.
+  for ((i = 1; i < COMP_CWORD; i++)); do
+    case "${COMP_WORDS[i]}" in
+@VALUE_OPTIONS@
+      -*) ;;
+      *)
+        if [ -z "$cmd" ]; then
+          cmd="${COMP_WORDS[i]}"
+        elif [ -z "$sub" ]; then
+          sub="${COMP_WORDS[i]}"
+        else
+          positional=$((positional + 1))
+        fi;;
+    esac
+  done
+
+  if [ -n "$value" ]; then
+    # The value of a global option is being completed.
+    candidates=''
+  elif [ -z "$cmd" ]; then
+    if [[ "$cur" == -* ]]; then
+      candidates='@GLOBAL_OPTIONS@'
+    else
+      candidates='@COMMANDS@'
+    fi
+  elif [[ "$cur" == -* ]]; then
+    case "$cmd $sub" in
+@OPTIONS@
+    esac
+  elif [ -z "$sub" ]; then
+    case "$cmd" in
+@SUB_COMMANDS@
+    esac
+  else
+    case "$cmd $sub" in
+@VALUES@
+    esac
+  fi
+
+  COMPREPLY=($(compgen -W "$candidates" -- "$cur"))
+}
+'''
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _case(pattern, candidates):
+  """Render one branch of a "case" statement of the completion script.
+
+  Args:
+    pattern |str| = The pattern of the branch.
+    candidates |str| = The shell expression for the candidates.
+
+  Returns:
+    |str| = The branch.
+
+  Raises:
+    |None|
+  """
+
+  return '      {}) candidates={};;'.format(pattern, candidates)
+
+
+def _skip_value(value_options):
+  """Render the branch of the completion script which skips a global option and its value
+  while looking for the command.
+
+  Args:
+    value_options |[str]| = The global options which take a value.
+
+  Returns:
+    |str| = The branch, or an empty line if no global option takes a value.
+
+  Raises:
+    |None|
+  """
+
+  if not value_options:
+    return ''
+
+  return ('      {})\n'
+          '        [ -n "$cmd" ] && continue\n'
+          '        i=$((i + 1))\n'
+          '        [ "$i" -eq "$COMP_CWORD" ] && value=1;;').format('|'.join(value_options))
+
+
+def _write_atomically(path, content):
+  """Replace a file so that readers never see it partially written.
+
+  Args:
+    path |str| = The path of the file.
+    content |str| = The new content.
+
+  Returns:
+    |None|
+
+  Raises:
+    |IOError| = The file could not be written.
+    |OSError| = The file could not be written.
+  """
+
+  fd, tmp_path = mkstemp(dir=dirname(path) or '.', prefix='.vmpooler_client_completion')
+
+  with os.fdopen(fd, 'w') as f:
+    f.write(content)
+
+  os.rename(tmp_path, path)
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def locate_index():
+  """Locate the completion index, which lives next to the configuration file.
+
+  Args:
+    |None|
+
+  Returns:
+    |str| = The path to the completion index.
+
+  Raises:
+    |RuntimeError| = Unsupported platform.
+  """
+
+  return join(dirname(locate_config()), INDEX_NAME)
+
+
+def refresh_cache(config, cache_path):
+  """Update the templates and running VMs in the VM cache from the vmpooler. Only VMs which are
+  not cached yet are requested. Nothing is done if the vmpooler or token is not configured,
+  since there is nobody to prompt for them.
+
+  Args:
+    config |{str:str}| = A dictionary of settings from the configuration file.
+    cache_path |str| = The path of the VM cache.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The vmpooler could not be queried.
+  """
+
+  vmpooler_hostname = config.get('vmpooler_hostname')
+  auth_token = config.get('auth_token')
+
+  if not vmpooler_hostname or not auth_token:
+    return
+
+  templates = list_vm(vmpooler_hostname, auth_token)
+  running = get_running_vms(vmpooler_hostname, auth_token)
+  known = set(VmCache(cache_path).hostnames())
+  records = info_vms(vmpooler_hostname,
+                     [vm for vm in running if vm not in known],
+                     auth_token,
+                     max(int(get_float(config, 'max_workers', DEFAULT_WORKERS)), 1))
+
+  # Read the cache again and only forget VMs which were gone when the running VMs were listed, so
+  # that VMs remembered by commands in the meantime are kept.
+  cache = VmCache(cache_path)
+
+  cache.remember_templates(templates)
+  cache.forget(known.difference(running))
+  cache.remember_records(records)
+  cache.save()
+
+
+def write_index(cache, index_path):
+  """Write the templates and hostnames of the VM cache in a form shell scripts can read: one
+  "t TEMPLATE" or "h HOSTNAME" line per entry.
+
+  Args:
+    cache |VmCache| = The VM cache.
+    index_path |str| = The path of the completion index.
+
+  Returns:
+    |None|
+
+  Raises:
+    |IOError| = The index could not be written.
+    |OSError| = The index could not be written.
+  """
+
+  lines = ['t {}\n'.format(template) for template in cache.templates()]
+  lines.extend('h {}\n'.format(hostname) for hostname in cache.hostnames())
+
+  _write_atomically(index_path, ''.join(lines))
+
+
+def render_script(shell_name, cmd_parser, index_path, cache_path):
+  """Generate the completion script for a shell. Commands, sub-commands and options are taken
+  from the parser and written into the script. Templates and hostnames are read from the index
+  on every completion, and the index is refreshed in the background when it is stale.
+
+  Args:
+    shell_name |str| = The shell. One of "SHELLS".
+    cmd_parser |vmpooler_client.command_parser.CommandParser| = The command parser.
+    index_path |str| = The path of the completion index.
+    cache_path |str| = The path of the VM cache.
+
+  Returns:
+    |str| = The completion script.
+
+  Raises:
+    |ValueError| = The shell is not supported.
+  """
+
+  if shell_name not in SHELLS:
+    raise ValueError('The shell "{}" is not supported!'.format(shell_name))
+
+  commands = cmd_parser.commands()
+  global_options = cmd_parser.global_options()
+  value_options = [option for option, takes_value in global_options if takes_value]
+  options = []
+  sub_commands = []
+  values = []
+
+  for cmd_name in sorted(commands):
+    if commands[cmd_name]:
+      sub_commands.append(_case(cmd_name, "'{}'".format(' '.join(commands[cmd_name]))))
+    else:
+      opts = cmd_parser.options(cmd_name)
+      options.append(_case("'{} '*".format(cmd_name), "'{}'".format(' '.join(opts))))
+
+    for sub_cmd_name in commands[cmd_name]:
+      key = (cmd_name, sub_cmd_name)
+      pattern = "'{} {}'".format(cmd_name, sub_cmd_name)
+      opts = cmd_parser.options(cmd_name, sub_cmd_name)
+
+      options.append(_case(pattern, "'{}'".format(' '.join(opts))))
+
+      for kind, arg_map in (('t', TEMPLATE_ARGS), ('h', HOSTNAME_ARGS)):
+        if key not in arg_map:
+          continue
+
+        lookup = '_vmpooler_client_index {}'.format(kind)
+
+        if not arg_map[key]:
+          # Only the first positional argument is completed.
+          lookup = '[ $positional -eq 0 ] && ' + lookup
+
+        values.append(_case(pattern, '"$({})"'.format(lookup)))
+
+  script = (_SCRIPT.replace('@INDEX@', index_path)
+                   .replace('@CACHE@', cache_path)
+                   .replace('@MINUTES@', str(REFRESH_MINUTES))
+                   .replace('@COMMANDS@', ' '.join(sorted(commands)))
+                   .replace('@GLOBAL_OPTIONS@', ' '.join(option for option, _ in global_options))
+                   .replace('@VALUE_OPTIONS@', _skip_value(value_options))
+                   .replace('@OPTIONS@', '\n'.join(options))
+                   .replace('@SUB_COMMANDS@', '\n'.join(sub_commands))
+                   .replace('@VALUES@', '\n'.join(values)))
+
+  header = '# {} completion for vmpooler_client. Generated by "completion {}".\n'.format(
+    shell_name, shell_name)
+
+  if shell_name == 'zsh':
+    # zsh runs the bash completion function through its bash compatibility layer.
+    header += 'autoload -U +X bashcompinit && bashcompinit\n'
+
+  return (header + script +
+          'complete -F _vmpooler_client vmpooler_client_app.py vmpooler_client\n')
@@ -10,11 +10,11 @@
 #===================================================================================================
 # Imports
 #===================================================================================================
-from json import loads, dumps
 from os import environ
 from os.path import join, isfile
 from platform import system
 from getpass import getpass
+from jsoncodec import loads, dumps
 
 #===================================================================================================
 # Globals
@@ -201,3 +201,48 @@ def get_vmpooler_hostname(config):
   """
   prompt = "Please enter the hostname of the vmpooler. This will only be requested once"
   return request_config_value(config, "vmpooler_hostname", prompt)
+
+
+def get_flag(config, name, default=False):
+  """Read a boolean setting from the config. Settings written with "config set" are stored as
+  strings, so values like "true", "yes" and "1" are accepted.
+
+  Args:
+    config |{str:str}| = A dictionary of configuration values.
+    name |str| = The config value's name.
+    default |bln| = The value to use if the setting is absent.
+
+  Returns:
+    |bln| = The value of the setting.
+
+  Raises:
+    |None|
+  """
+
+  value = config.get(name, default)
+
+  if isinstance(value, basestring):
+    return value.strip().lower() in ('true', 'yes', 'on', '1')
+
+  return bool(value)
+
+
+def get_float(config, name, default):
+  """Read a numeric setting from the config.
+
+  Args:
+    config |{str:str}| = A dictionary of configuration values.
+    name |str| = The config value's name.
+    default |float| = The value to use if the setting is absent.
+
+  Returns:
+    |float| = The value of the setting.
+
+  Raises:
+    |RuntimeError| = The setting is not a number.
+  """
+
+  try:
+    return float(config.get(name, default))
+  except (TypeError, ValueError):
+    raise RuntimeError('The "{}" config option must be a number!'.format(name))
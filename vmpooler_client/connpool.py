@@ -0,0 +1,315 @@
+"""
+.. module:: vmpooler_client.connpool
+   :synopsis: Keep idle HTTP connections open so that later requests can reuse them.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from httplib import HTTPConnection
+from socket import error as socket_error, getdefaulttimeout, _GLOBAL_DEFAULT_TIMEOUT
+from threading import Event, Lock, Thread
+from time import time
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The default number of idle connections kept per host.
+DEFAULT_MAX_IDLE = 8
+
+# The default number of seconds an idle connection is kept. Servers close idle keep-alive
+# connections after a while, and reusing one they have closed costs a failed request.
+DEFAULT_IDLE_TIMEOUT = 15.0
+
+# The number of seconds a pre-warmed connection may take to connect before the request that
+# needs it gives up waiting and connects by itself.
+PREWARM_TIMEOUT = 10.0
+
+# The number of seconds between checks while waiting for a pre-warmed connection.
+_POLL_INTERVAL = 0.5
+
+#===================================================================================================
+# Classes: Private
+#===================================================================================================
+class _ResolvingConnection(HTTPConnection):
+  """An HTTP connection which looks up and connects to its host through a resolver.
+
+  Args:
+    host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+    resolver |vmpooler_client.resolver.Resolver| = The resolver.
+    **kwargs |{str:obj}| = Keyword arguments for "HTTPConnection".
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, host, resolver, **kwargs):
+
+    HTTPConnection.__init__(self, host, **kwargs)
+
+    self._resolver = resolver
+
+  def connect(self):
+    """Connect to the host.
+
+    Returns:
+      |None|
+
+    Raises:
+      |socket.gaierror| = The host could not be resolved.
+      |socket.error| = The host could not be connected to.
+    """
+
+    timeout = self.timeout
+
+    if timeout is _GLOBAL_DEFAULT_TIMEOUT:
+      timeout = getdefaulttimeout()
+
+    self.sock = self._resolver.connect(self.host, self.port, timeout)
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class ConnectionPool(object):
+  """Idle keep-alive connections keyed by host. Connections are handed out to one thread at a
+  time, and a connection is only returned to the pool once its response has been read in full.
+  A connection can also be opened ahead of time with "prewarm" and is then handed to the next
+  request for the host, pooled or not, unless it has been connected for longer than the idle
+  timeout.
+
+  Args:
+    max_idle |int| = The maximum number of idle connections kept per host.
+    idle_timeout |float| = The number of seconds an idle connection is kept.
+    resolver |vmpooler_client.resolver.Resolver| = Looks up and connects to hosts. Connections
+      use the system resolver one address at a time if "None".
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, max_idle=DEFAULT_MAX_IDLE, idle_timeout=DEFAULT_IDLE_TIMEOUT, resolver=None):
+
+    self.max_idle = max_idle
+    self.idle_timeout = idle_timeout
+    self.resolver = resolver
+    self.created = 0
+    self.reused = 0
+    self.prewarmed = 0
+    self._idle = {}
+    self._warming = {}
+    self._lock = Lock()
+
+  def _connection(self, host, **kwargs):
+    """Create a connection which is not connected yet.
+
+    Args:
+      host |str| = The host and port of the server.
+      **kwargs |{str:obj}| = Keyword arguments for "HTTPConnection".
+
+    Returns:
+      |HTTPConnection| = The connection.
+
+    Raises:
+      |None|
+    """
+
+    if self.resolver is None:
+      return HTTPConnection(host, **kwargs)
+
+    return _ResolvingConnection(host, self.resolver, **kwargs)
+
+  def _take_warm(self, host):
+    """Take the pre-warmed connection to a host, waiting up to "PREWARM_TIMEOUT" seconds for it
+    to connect if needed. A connection which has sat unused for longer than the idle timeout is
+    closed instead since the server may have closed it, and requests which are not idempotent
+    cannot be retried on another connection.
+
+    Args:
+      host |str| = The host and port of the server.
+
+    Returns:
+      |HTTPConnection| = The connected connection or "None" if there is none, it failed, it took
+        too long to connect or it is stale.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      warm = self._warming.pop(host, None)
+
+    if warm is None:
+      return None
+
+    conn, ready, connected = warm
+    deadline = time() + PREWARM_TIMEOUT
+
+    while not ready.wait(_POLL_INTERVAL):
+      if time() >= deadline:
+        return None
+
+    if conn.sock is None:
+      return None
+
+    if time() - connected[0] >= self.idle_timeout:
+      conn.close()
+      return None
+
+    with self._lock:
+      self.prewarmed += 1
+
+    return conn
+
+  def prewarm(self, host):
+    """Connect to a host on a background thread so that the DNS lookup and TCP handshake overlap
+    with other work. Failures are ignored: the request that would have used the connection
+    connects by itself and reports the error.
+
+    Args:
+      host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    conn = self._connection(host, timeout=PREWARM_TIMEOUT)
+    ready = Event()
+    connected = [None]
+
+    def _connect():
+      try:
+        conn.connect()
+        connected[0] = time()
+
+        # Requests made on the connection wait as long as any other request.
+        conn.sock.settimeout(None)
+      except (socket_error, ValueError):
+        conn.close()
+      finally:
+        ready.set()
+
+    with self._lock:
+      if host in self._warming:
+        return
+
+      self._warming[host] = (conn, ready, connected)
+      self.created += 1
+
+    thread = Thread(target=_connect, name='prewarm-{}'.format(host))
+    thread.daemon = True
+    thread.start()
+
+  def open(self, host):
+    """Open a connection for a request which must not share connections, such as a request
+    which is not idempotent. Takes the pre-warmed connection to the host if there is one and it
+    is not stale.
+
+    Args:
+      host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+
+    Returns:
+      |(HTTPConnection, bln)| = The connection and whether it is connected already.
+
+    Raises:
+      |None|
+    """
+
+    conn = self._take_warm(host)
+
+    if conn is None:
+      return (self._connection(host), False)
+
+    return (conn, True)
+
+  def acquire(self, host):
+    """Take the pre-warmed or an idle connection to a host or open a new one.
+
+    Args:
+      host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+
+    Returns:
+      |(HTTPConnection, bln)| = The connection and whether it is connected already. New
+        connections are not connected yet.
+
+    Raises:
+      |None|
+    """
+
+    conn = self._take_warm(host)
+
+    if conn is not None:
+      return (conn, True)
+
+    now = time()
+    expired = []
+
+    with self._lock:
+      idle = self._idle.get(host, [])
+
+      while idle:
+        conn, released = idle.pop()
+
+        if now - released < self.idle_timeout:
+          self.reused += 1
+          break
+
+        expired.append(conn)
+      else:
+        conn = None
+        self.created += 1
+
+    for stale in expired:
+      stale.close()
+
+    if conn is None:
+      return (self._connection(host), False)
+
+    return (conn, True)
+
+  def release(self, host, conn):
+    """Return a connection whose response has been read in full to the pool.
+
+    Args:
+      host |str| = The host the connection is for.
+      conn |HTTPConnection| = The connection.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      idle = self._idle.setdefault(host, [])
+
+      if len(idle) < self.max_idle:
+        idle.append((conn, time()))
+        return
+
+    conn.close()
+
+  def clear(self):
+    """Close every idle connection.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      idle, self._idle = self._idle, {}
+
+    for connections in idle.values():
+      for conn, _ in connections:
+        conn.close()
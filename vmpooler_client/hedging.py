@@ -0,0 +1,385 @@
+"""
+.. module:: vmpooler_client.hedging
+   :synopsis: Request hedging for idempotent reads against the vmpooler API.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import sys
+from collections import deque
+from threading import Event, Lock, Thread
+from time import time
+from Queue import Queue, Empty
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# How often (in seconds) blocking waits wake up so that Ctrl-C is still delivered.
+_POLL_INTERVAL = 0.5
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _wait(results):
+  """Block until an attempt reports an outcome.
+
+  Args:
+    results |Queue.Queue| = The queue the attempts report to.
+
+  Returns:
+    |(bln, obj)| = The outcome reported by the attempt.
+
+  Raises:
+    |None|
+  """
+
+  while True:
+    try:
+      return results.get(timeout=_POLL_INTERVAL)
+    except Empty:
+      pass
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class CancelledError(RuntimeError):
+  """The attempt was stopped because another attempt of the hedged request won."""
+
+  pass
+
+
+class Cancellation(object):
+  """Stop an attempt of a hedged request which is still in flight once another attempt has won.
+  The attempt attaches a function that stops it for as long as it can be stopped, and detaches
+  it before handing on anything the function would affect. E.g. a connection returned to a pool.
+
+  Args:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self):
+
+    self.cancelled = False
+    self._stop = None
+    self._lock = Lock()
+
+  def attach(self, stop):
+    """Attach the function which stops the attempt, unless it is cancelled already.
+
+    Args:
+      stop |func| = A function with no arguments. It is called from another thread.
+
+    Returns:
+      |bln| = The function was attached. "False" if the attempt is cancelled.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      if self.cancelled:
+        return False
+
+      self._stop = stop
+
+      return True
+
+  def detach(self):
+    """Detach the function which stops the attempt.
+
+    Args:
+      |None|
+
+    Returns:
+      |bln| = The attempt was not cancelled.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      self._stop = None
+
+      return not self.cancelled
+
+  def cancel(self):
+    """Cancel the attempt, stopping it if a function is attached.
+
+    Args:
+      |None|
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      self.cancelled = True
+      stop, self._stop = self._stop, None
+
+    if stop is not None:
+      stop()
+
+
+class LatencyTracker(object):
+  """Track recent response latencies per endpoint and derive a percentile from them.
+
+  Args:
+    percentile |float| = The percentile (0-100) used as the hedging threshold.
+    window |int| = The number of recent samples to keep per endpoint.
+    min_samples |int| = The number of samples required before the percentile is trusted.
+    initial_delay |float| = The threshold (in seconds) used until enough samples exist.
+
+  Raises:
+    |ValueError| = The percentile is not between 0 and 100.
+  """
+
+  def __init__(self, percentile=95, window=200, min_samples=20, initial_delay=0.5):
+
+    if not 0 < percentile <= 100:
+      raise ValueError('The percentile must be a value between "0" and "100"!')
+
+    self._percentile = percentile
+    self._window = window
+    self._min_samples = min_samples
+    self._initial_delay = initial_delay
+    self._samples = {}
+    self._lock = Lock()
+
+  def record(self, key, seconds):
+    """Record the latency of a completed request.
+
+    Args:
+      key |str| = The endpoint the request was made against. E.g. "GET /vm/<hostname>"
+      seconds |float| = The time taken for the response to arrive.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      if key not in self._samples:
+        self._samples[key] = deque(maxlen=self._window)
+
+      self._samples[key].append(seconds)
+
+  def threshold(self, key):
+    """Calculate the current hedging threshold for an endpoint.
+
+    Args:
+      key |str| = The endpoint to calculate the threshold for.
+
+    Returns:
+      |float| = The number of seconds to wait before hedging.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      samples = sorted(self._samples.get(key, ()))
+
+    if len(samples) < self._min_samples:
+      return self._initial_delay
+
+    index = int(round((self._percentile / 100.0) * (len(samples) - 1)))
+
+    return samples[index]
+
+
+class HedgeBudget(object):
+  """Cap the number of hedged requests to a fraction of all requests.
+
+  Every request earns "max_ratio" credits and every hedge spends one. Credits never exceed
+  "burst", so over any run the hedges sent are bounded by "max_ratio * requests + burst".
+
+  Args:
+    max_ratio |float| = The maximum fraction of requests which may be hedged.
+    burst |float| = The maximum number of credits that may be banked.
+
+  Raises:
+    |ValueError| = The ratio is not between 0 and 1.
+  """
+
+  def __init__(self, max_ratio=0.05, burst=1.0):
+
+    if not 0 <= max_ratio <= 1:
+      raise ValueError('The hedge ratio must be a value between "0" and "1"!')
+
+    self._max_ratio = max_ratio
+    self._burst = burst
+    self._credits = burst
+    self._lock = Lock()
+
+    self.requests = 0
+    self.hedges = 0
+
+  def record_request(self):
+    """Account for a new primary request.
+
+    Args:
+      |None|
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      self.requests += 1
+      self._credits = min(self._burst, self._credits + self._max_ratio)
+
+  def try_acquire(self):
+    """Spend a credit for a hedge if one is available.
+
+    Args:
+      |None|
+
+    Returns:
+      |bln| = Whether a hedge may be sent.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      if self._credits < 1:
+        return False
+
+      self._credits -= 1
+      self.hedges += 1
+
+      return True
+
+
+class HedgePolicy(object):
+  """Issue a duplicate of a slow idempotent request and use whichever response arrives first.
+
+  Args:
+    percentile |float| = The latency percentile after which a request is hedged.
+    max_ratio |float| = The maximum fraction of requests which may be hedged.
+    window |int| = The number of recent latency samples kept per endpoint.
+    min_samples |int| = The number of samples required before the percentile is trusted.
+    initial_delay |float| = The hedging delay (in seconds) used until enough samples exist.
+
+  Raises:
+    |ValueError| = Invalid percentile or ratio specified.
+  """
+
+  def __init__(self,
+               percentile=95,
+               max_ratio=0.05,
+               window=200,
+               min_samples=20,
+               initial_delay=0.5):
+
+    self.tracker = LatencyTracker(percentile, window, min_samples, initial_delay)
+    self.budget = HedgeBudget(max_ratio)
+
+  def call(self, key, attempt, discard=None):
+    """Run an attempt and hedge it with a second attempt if it is slower than the threshold.
+    Once an attempt succeeds, the other one is cancelled.
+
+    Args:
+      key |str| = The endpoint the request is made against. E.g. "GET /vm/<hostname>"
+      attempt |func| = A function that performs the request. It is called with the
+        "Cancellation" of the attempt.
+      discard |func| = An optional function called with the result of a losing attempt which
+        finished before it could be cancelled, so that its resources can be released.
+
+    Returns:
+      |obj| = The result of the first attempt to succeed.
+
+    Raises:
+      |Exception| = Every attempt failed. The error from the last attempt is raised.
+    """
+
+    results = Queue()
+    decided = Event()
+    guard = Lock()
+    cancellations = []
+
+    def _run(cancellation):
+      start = time()
+
+      try:
+        value = attempt(cancellation)
+      except Exception:
+        results.put((False, sys.exc_info()))
+        return
+
+      self.tracker.record(key, time() - start)
+
+      with guard:
+        late = decided.is_set()
+
+        if not late:
+          results.put((True, value))
+
+      # The other attempt already won so this result is thrown away.
+      if late and discard:
+        discard(value)
+
+    def _launch():
+      cancellation = Cancellation()
+      cancellations.append(cancellation)
+      thread = Thread(target=_run, args=(cancellation,))
+      thread.daemon = True
+      thread.start()
+
+    self.budget.record_request()
+    _launch()
+    pending = 1
+
+    try:
+      outcome = results.get(timeout=self.tracker.threshold(key))
+    except Empty:
+      if self.budget.try_acquire():
+        _launch()
+        pending += 1
+
+      outcome = _wait(results)
+
+    pending -= 1
+
+    # Give a hedge still in flight the chance to succeed where the other attempt failed.
+    while not outcome[0] and pending:
+      outcome = _wait(results)
+      pending -= 1
+
+    with guard:
+      decided.set()
+
+    # Stop the attempt still in flight, if any. Cancelling an attempt which is done does nothing.
+    for cancellation in cancellations:
+      cancellation.cancel()
+
+    # An attempt may have queued a result right before the decision was made.
+    while not results.empty():
+      ok, value = results.get()
+
+      if ok and discard:
+        discard(value)
+
+    ok, value = outcome
+
+    if not ok:
+      raise value[0], value[1], value[2]
+
+    return value
@@ -0,0 +1,247 @@
+"""
+.. module:: vmpooler_client.hooks
+   :synopsis: A registry of callbacks for observing requests made to the vmpooler API.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import sys
+from importlib import import_module
+from threading import Lock
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The registered callbacks. The lists are replaced rather than mutated so that they can be read
+# without holding the lock.
+_before_request = ()
+_after_response = ()
+_on_error = ()
+
+_lock = Lock()
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class RequestEvent(object):
+  """The details of a single request which are handed to every callback.
+
+  Args:
+    method |str| = Type of request. GET, POST, PUT or DELETE.
+    host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+    path |str| = The path of the url. E.g. /vm/vm_name
+    endpoint |str| = The path with names replaced by placeholders. E.g. "GET /vm/<hostname>"
+    bytes_sent |int| = The size of the request body.
+
+  Raises:
+    |None|
+  """
+
+  __slots__ = ('method', 'host', 'path', 'endpoint', 'status', 'bytes_sent', 'bytes_received',
+               'timings', 'error')
+
+  def __init__(self, method, host, path, endpoint, bytes_sent):
+
+    self.method = method
+    self.host = host
+    self.path = path
+    self.endpoint = endpoint
+    self.bytes_sent = bytes_sent
+
+    # Filled in once the response arrives or the request fails.
+    self.status = None
+    self.bytes_received = 0
+    self.error = None
+
+    # Seconds elapsed since the start of the request for each phase that completed:
+    # "connect", "first_byte" and "total".
+    self.timings = {}
+
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _fire(callbacks, event):
+  """Call each callback with the event.
+
+  Args:
+    callbacks |(func)| = The callbacks to call.
+    event |RequestEvent| = The request details.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  for callback in callbacks:
+    callback(event)
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def active():
+  """Check if any callbacks are registered. The service layer skips all bookkeeping otherwise.
+
+  Args:
+    |None|
+
+  Returns:
+    |bln| = Whether any callbacks are registered.
+
+  Raises:
+    |None|
+  """
+
+  return bool(_before_request or _after_response or _on_error)
+
+
+def register(before_request=None, after_response=None, on_error=None):
+  """Register callbacks. Each callback is called with a "RequestEvent" from the thread that
+  made the request. Exceptions raised by a callback are not suppressed.
+
+  Args:
+    before_request |func| = Called before the connection is opened.
+    after_response |func| = Called once the response body has been read.
+    on_error |func| = Called when the request fails before a response is read.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _before_request, _after_response, _on_error
+
+  with _lock:
+    if before_request:
+      _before_request += (before_request,)
+    if after_response:
+      _after_response += (after_response,)
+    if on_error:
+      _on_error += (on_error,)
+
+
+def unregister(callback):
+  """Remove a callback from every hook it was registered for.
+
+  Args:
+    callback |func| = The callback to remove.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _before_request, _after_response, _on_error
+
+  with _lock:
+    _before_request = tuple(c for c in _before_request if c != callback)
+    _after_response = tuple(c for c in _after_response if c != callback)
+    _on_error = tuple(c for c in _on_error if c != callback)
+
+
+def clear():
+  """Remove all registered callbacks.
+
+  Args:
+    |None|
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _before_request, _after_response, _on_error
+
+  with _lock:
+    _before_request = ()
+    _after_response = ()
+    _on_error = ()
+
+
+def fire_before_request(event):
+  """Call the "before_request" callbacks.
+
+  Args:
+    event |RequestEvent| = The request details.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  _fire(_before_request, event)
+
+
+def fire_after_response(event):
+  """Call the "after_response" callbacks.
+
+  Args:
+    event |RequestEvent| = The request details.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  _fire(_after_response, event)
+
+
+def fire_on_error(event):
+  """Call the "on_error" callbacks.
+
+  Args:
+    event |RequestEvent| = The request details.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  _fire(_on_error, event)
+
+
+def load_hook(spec):
+  """Import a hook installer given as "module:func" and call it with this module so that it can
+  register its callbacks. E.g. "mytracing.vmpooler:install"
+
+  Args:
+    spec |str| = The module path and function name separated by a colon.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The spec is malformed or the function could not be found.
+  """
+
+  module_name, _, func_name = spec.partition(':')
+
+  if not module_name or not func_name:
+    raise RuntimeError('The hook "{}" must be given as "module:func"!'.format(spec))
+
+  try:
+    installer = getattr(import_module(module_name), func_name)
+  except (ImportError, AttributeError) as e:
+    raise RuntimeError('Could not load the hook "{}": {}'.format(spec, e))
+
+  installer(sys.modules[__name__])
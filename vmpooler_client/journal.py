@@ -0,0 +1,434 @@
+"""
+.. module:: vmpooler_client.journal
+   :synopsis: Record the progress of bulk operations so that interrupted ones can be resumed.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+import sys
+from os.path import dirname, exists, join
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+from conf_file import locate_config
+from jsoncodec import loads, dumps
+from parallel import run_parallel
+
+try:
+  from fcntl import flock, LOCK_EX, LOCK_NB
+except ImportError:
+  # Windows has no "flock". Concurrent runs of an operation are not detected there.
+  flock = None
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+JOURNAL_DIR = '.vmpooler.journal'
+
+# The most time (in seconds) completed items may wait in the page cache before they are synced
+# to disk. Items whose completion is lost are simply done again on resume.
+SYNC_INTERVAL = 0.25
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _fsync_dir(path):
+  """Sync a directory so that a file created or renamed in it survives a crash.
+
+  Args:
+    path |str| = The path of the directory.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except (OSError, AttributeError):
+    return
+
+  try:
+    os.fsync(fd)
+  except OSError:
+    # Windows cannot sync directories.
+    pass
+  finally:
+    os.close(fd)
+
+
+def _lock(path):
+  """Take the lock of a journal so that no other run of the operation can use the journal until
+  it is released. The lock is held on a file next to the journal because starting an operation
+  replaces the journal itself. The lock file is never removed, so every run locks the same file.
+
+  Args:
+    path |str| = The path of the journal.
+
+  Returns:
+    |file| = The open lock file or "None" if the platform has no "flock".
+
+  Raises:
+    |RuntimeError| = Another run holds the lock.
+  """
+
+  if flock is None:
+    return None
+
+  lock_file = open(path + '.lock', 'a')
+
+  try:
+    flock(lock_file.fileno(), LOCK_EX | LOCK_NB)
+  except IOError:
+    lock_file.close()
+    raise RuntimeError('The journal "{}" is in use by another run! Wait for it to finish.'.format(
+      path))
+
+  return lock_file
+
+
+def _unlock(lock_file):
+  """Release the lock of a journal taken by "_lock".
+
+  Args:
+    lock_file |file| = The open lock file or "None".
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  if lock_file is not None:
+    lock_file.close()
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class Journal(object):
+  """An append-only log of a bulk operation. The first line holds the plan: the operation, its
+  parameters and every item it will process. Each following line marks one item as done by its
+  index in the plan. A line torn by a crash is ignored.
+
+  Completions are written as they happen but only synced every "SYNC_INTERVAL" seconds, so the
+  operations journaled must be safe to repeat for the last few items.
+
+  A journal is locked from the moment it is started or loaded until it is closed, so that two
+  runs of the same operation never write to the same journal.
+
+  Args:
+    path |str| = The path of the journal.
+    operation |str| = The name of the operation. E.g. "destroy_all"
+    params |{str:obj}| = The parameters of the operation.
+    items |[obj]| = The items of the operation.
+    done |set| = The indexes of the items already done.
+    lock_file |file| = The open lock file of the journal.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, path, operation, params, items, done, lock_file=None):
+
+    self.path = path
+    self.operation = operation
+    self.params = params
+    self.items = items
+    self.done = done
+    self._file = None
+    self._lock_file = lock_file
+    self._lock = Lock()
+    self._last_sync = time()
+
+  @classmethod
+  def start(cls, path, operation, params, items):
+    """Write the plan of a new operation, replacing any previous journal at the path.
+
+    Args:
+      path |str| = The path of the journal.
+      operation |str| = The name of the operation.
+      params |{str:obj}| = The parameters of the operation.
+      items |[obj]| = The items of the operation.
+
+    Returns:
+      |Journal| = The journal.
+
+    Raises:
+      |RuntimeError| = Another run is using the journal.
+      |IOError| = The journal could not be written.
+      |OSError| = The journal could not be written.
+    """
+
+    directory = dirname(path) or '.'
+    journal = cls(path, operation, params, items, set(), _lock(path))
+
+    try:
+      fd, tmp_path = mkstemp(dir=directory, prefix='.vmpooler_client_journal')
+
+      with os.fdopen(fd, 'w') as f:
+        f.write(dumps({'operation': operation, 'params': params, 'items': items}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+      if exists(path):
+        os.remove(path)
+
+      os.rename(tmp_path, path)
+      _fsync_dir(directory)
+    except (IOError, OSError):
+      journal.release()
+      raise
+
+    return journal
+
+  @classmethod
+  def load(cls, path):
+    """Read the journal of an interrupted operation.
+
+    Args:
+      path |str| = The path of the journal.
+
+    Returns:
+      |Journal| = The journal or "None" if there is none.
+
+    Raises:
+      |RuntimeError| = Another run is using the journal or the plan in it is unreadable.
+    """
+
+    lock_file = _lock(path)
+
+    try:
+      with open(path, 'r') as f:
+        lines = f.readlines()
+
+      plan = loads(lines[0])
+      operation, params, items = plan['operation'], plan['params'], plan['items']
+    except IOError:
+      _unlock(lock_file)
+
+      return None
+    except (IndexError, KeyError, TypeError, ValueError):
+      _unlock(lock_file)
+
+      raise RuntimeError('The journal "{}" is corrupt! Delete it to start over.'.format(path))
+
+    done = set()
+    valid = len(lines[0])
+
+    for line in lines[1:]:
+      if not line.endswith('\n'):
+        break
+
+      try:
+        done.add(loads(line)['d'])
+      except (KeyError, TypeError, ValueError):
+        break
+
+      valid += len(line)
+
+    # Drop a torn line so that new completions are not appended to it.
+    if valid < sum(len(line) for line in lines):
+      with open(path, 'r+') as f:
+        f.truncate(valid)
+
+    return cls(path, operation, params, items, done, lock_file)
+
+  def pending(self):
+    """Return the items which are not done yet.
+
+    Returns:
+      |[(int, obj)]| = The index and item of each pending item in plan order.
+
+    Raises:
+      |None|
+    """
+
+    return [(index, item) for index, item in enumerate(self.items) if index not in self.done]
+
+  def complete(self, index):
+    """Mark an item as done. Safe to call from several threads.
+
+    Args:
+      index |int| = The index of the item in the plan.
+
+    Returns:
+      |None|
+
+    Raises:
+      |IOError| = The journal could not be written.
+    """
+
+    with self._lock:
+      if self._file is None:
+        self._file = open(self.path, 'a')
+
+      self.done.add(index)
+      self._file.write('{{"d": {}}}\n'.format(index))
+      self._file.flush()
+
+      now = time()
+
+      if now - self._last_sync >= SYNC_INTERVAL:
+        os.fsync(self._file.fileno())
+        self._last_sync = now
+
+  def close(self):
+    """Sync the journal, removing it if every item is done, and release it.
+
+    Returns:
+      |bln| = Every item is done.
+
+    Raises:
+      |None|
+    """
+
+    try:
+      with self._lock:
+        if self._file is not None:
+          self._file.flush()
+          os.fsync(self._file.fileno())
+          self._file.close()
+          self._file = None
+
+      finished = len(self.done) >= len(self.items)
+
+      if finished:
+        os.remove(self.path)
+    finally:
+      self.release()
+
+    return finished
+
+  def release(self):
+    """Release the lock of the journal so that another run can use it. Closing the journal
+    releases it as well.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      _unlock(self._lock_file)
+      self._lock_file = None
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def locate_journal(operation):
+  """Locate the journal of an operation in the journal directory next to the configuration
+  file, creating the directory if needed.
+
+  Args:
+    operation |str| = The name of the operation. E.g. "destroy_all"
+
+  Returns:
+    |str| = The path of the journal.
+
+  Raises:
+    |RuntimeError| = Unsupported platform.
+  """
+
+  directory = join(dirname(locate_config()), JOURNAL_DIR)
+
+  if not exists(directory):
+    os.mkdir(directory)
+
+  return join(directory, '{}.log'.format(operation))
+
+
+def open_journal(operation, vmpooler_hostname, resume, plan):
+  """Start the journal of a bulk operation, or load it to resume an interrupted one.
+
+  Args:
+    operation |str| = The name of the operation. E.g. "destroy_all"
+    vmpooler_hostname |str| = The URL of the vmpooler
+    resume |bln| = Resume the interrupted operation instead of starting a new one.
+    plan |func| = A function returning the items of a new operation. It is not called when
+      resuming, so the items are not requested again.
+
+  Returns:
+    |Journal| = The journal or "None" if a new operation has no items.
+
+  Raises:
+    |RuntimeError| = There is nothing to resume, it was for another vmpooler or another run of the
+      operation is using its journal.
+  """
+
+  path = locate_journal(operation)
+  params = {'vmpooler': vmpooler_hostname}
+
+  if resume:
+    journal = Journal.load(path)
+
+    if journal is None:
+      raise RuntimeError('There is no interrupted "{}" to resume!'.format(operation))
+    elif journal.params != params:
+      journal.release()
+
+      raise RuntimeError('The interrupted "{}" was for the vmpooler "{}"!'.format(
+        operation, journal.params.get('vmpooler')))
+
+    print("Resuming {} with {} of {} done".format(operation,
+                                                  len(journal.done),
+                                                  len(journal.items)))
+
+    return journal
+
+  items = plan()
+
+  if not items:
+    return None
+
+  interrupted = exists(path)
+  journal = Journal.start(path, operation, params, items)
+
+  if interrupted:
+    sys.stderr.write('Discarding the journal of an interrupted "{}". Use --resume to continue '
+                     'an interrupted operation.\n'.format(operation))
+
+  return journal
+
+
+def run_journaled(journal, func, workers):
+  """Call a function with each pending item of a journal in parallel and mark every item for
+  which it returns as done. The journal is kept for "--resume" unless every item is done.
+
+  Args:
+    journal |Journal| = The journal of the operation.
+    func |func| = A function accepting a single item.
+    workers |int| or |AdaptiveLimit| = The maximum number of concurrent calls.
+
+  Returns:
+    |[(obj, obj, Exception)]| = The item, result and error of every pending call.
+
+  Raises:
+    |None|
+  """
+
+  def _call(entry):
+    index, item = entry
+    result = func(item)
+    journal.complete(index)
+
+    return result
+
+  try:
+    results = run_parallel(_call, journal.pending(), workers)
+  finally:
+    journal.close()
+
+  return [(item, result, error) for (_, item), result, error in results]
@@ -0,0 +1,474 @@
+"""
+.. module:: vmpooler_client.leasing
+   :synopsis: Check out VMs once and lend them to many consumers, in this process or others.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from os import urandom
+from threading import Condition, Lock, Thread
+from time import time
+from parallel import run_parallel, DEFAULT_WORKERS
+from service import get_vm, destroy_vm, VmNotFoundError
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# How often (in seconds) blocking waits wake up so that Ctrl-C is still delivered.
+_POLL_INTERVAL = 0.5
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def parse_needs(specs):
+  """Parse VM needs written as "TEMPLATE" or "TEMPLATE:COUNT". Needs for the same template add
+  up.
+
+  Args:
+    specs |[str]| = The needs.
+
+  Returns:
+    |{str:int}| = The number of VMs needed for each template.
+
+  Raises:
+    |ValueError| = A count is not a positive number.
+  """
+
+  needs = {}
+
+  for spec in specs:
+    template, _, count = spec.strip().partition(':')
+
+    try:
+      count = int(count) if count else 1
+    except ValueError:
+      count = 0
+
+    if not template or count < 1:
+      raise ValueError('Invalid VM need "{}"! Use TEMPLATE or TEMPLATE:COUNT.'.format(spec))
+
+    needs[template] = needs.get(template, 0) + count
+
+  return needs
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class LeasePool(object):
+  """A pool of VMs checked out once and leased to consumers one at a time. Templates acquired
+  up front are never checked out again, so consumers wait for a lease to be released. A lease
+  of any other template checks out one VM, which then joins the pool. Every VM is destroyed when
+  the pool is closed.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    auth_token |str| = The authentication token for the user
+    workers |int| = The maximum number of concurrent requests.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, vmpooler_hostname, auth_token, workers=DEFAULT_WORKERS):
+
+    self.vmpooler_hostname = vmpooler_hostname
+    self.auth_token = auth_token
+    self.workers = workers
+    self.leases = 0
+    self._free = {}
+    self._templates = {}
+    self._leased = set()
+    self._closed = False
+    self._cond = Condition()
+
+  def _checkout(self, template):
+    """Check out a VM from the vmpooler.
+
+    Args:
+      template |str| = The name of the template.
+
+    Returns:
+      |str| = The hostname of the VM.
+
+    Raises:
+      |RuntimeError| = The vmpooler is not configured or the VM could not be retrieved.
+    """
+
+    if not self.vmpooler_hostname or not self.auth_token:
+      raise RuntimeError('The "vmpooler_hostname" and "auth_token" settings must be configured '
+                         'to check out VMs!')
+
+    return get_vm(self.vmpooler_hostname, template, self.auth_token)
+
+  def hostnames(self):
+    """List every VM in the pool.
+
+    Returns:
+      |{str:str}| = The template of each VM by hostname.
+
+    Raises:
+      |None|
+    """
+
+    with self._cond:
+      return dict(self._templates)
+
+  def acquire(self, template_counts):
+    """Check out VMs concurrently and add them to the pool. The VMs that were checked out stay
+    in the pool even if others fail.
+
+    Args:
+      template_counts |{str:int}| = The number of VMs to check out for each template.
+
+    Returns:
+      |None|
+
+    Raises:
+      |RuntimeError| = Some VMs could not be checked out.
+    """
+
+    templates = [template
+                 for template, count in sorted(template_counts.items())
+                 for _ in range(count)]
+    results = run_parallel(self._checkout, templates, self.workers)
+
+    with self._cond:
+      for template, hostname, error in results:
+        self._free.setdefault(template, [])
+
+        if error is None:
+          self._templates[hostname] = template
+          self._free[template].append(hostname)
+
+      self._cond.notify_all()
+
+    errors = [error for _, _, error in results if error is not None]
+
+    if errors:
+      raise RuntimeError('Could not check out {} of {} VMs! {}'.format(len(errors),
+                                                                      len(templates),
+                                                                      errors[0]))
+
+  def lease(self, template, timeout=None):
+    """Lease a VM, waiting for one to be released if every VM of the template is leased.
+
+    Args:
+      template |str| = The name of the template.
+      timeout |float| = The seconds to wait for a VM or "None" to wait indefinitely.
+
+    Returns:
+      |str| = The hostname of the VM.
+
+    Raises:
+      |RuntimeError| = The pool is closed, no VM was released in time or a VM could not be
+        checked out.
+    """
+
+    deadline = None if timeout is None else time() + timeout
+
+    with self._cond:
+      while True:
+        if self._closed:
+          raise RuntimeError('The VM pool is closed!')
+
+        free = self._free.get(template)
+
+        if free:
+          hostname = free.pop(0)
+          self._leased.add(hostname)
+          self.leases += 1
+
+          return hostname
+        elif free is None:
+          # Nothing was acquired for the template. Reserve it while checking a VM out.
+          self._free[template] = []
+          break
+
+        wait = _POLL_INTERVAL
+
+        if deadline is not None:
+          if time() >= deadline:
+            raise RuntimeError('Timed out after {} seconds waiting for a "{}" VM!'.format(
+              timeout, template))
+
+          wait = min(wait, deadline - time())
+
+        self._cond.wait(max(wait, 0))
+
+    try:
+      hostname = self._checkout(template)
+    except RuntimeError:
+      with self._cond:
+        if template not in self._templates.values():
+          self._free.pop(template, None)
+
+        self._cond.notify_all()
+
+      raise
+
+    with self._cond:
+      closed = self._closed
+
+      if not closed:
+        self._templates[hostname] = template
+        self._leased.add(hostname)
+        self.leases += 1
+
+    if closed:
+      destroy_vm(self.vmpooler_hostname, hostname, self.auth_token)
+      raise RuntimeError('The VM pool is closed!')
+
+    return hostname
+
+  def release(self, hostname):
+    """Return a leased VM to the pool.
+
+    Args:
+      hostname |str| = The hostname of the VM.
+
+    Returns:
+      |None|
+
+    Raises:
+      |RuntimeError| = The VM is not leased from the pool.
+    """
+
+    with self._cond:
+      if hostname not in self._leased:
+        raise RuntimeError('The "{}" VM is not leased from the pool!'.format(hostname))
+
+      self._leased.remove(hostname)
+      self._free[self._templates[hostname]].append(hostname)
+      self._cond.notify_all()
+
+  def close(self):
+    """Destroy every VM in the pool concurrently, whether it is leased or not.
+
+    Returns:
+      |[(str, Exception)]| = The hostname and error of every VM that could not be destroyed.
+
+    Raises:
+      |None|
+    """
+
+    with self._cond:
+      self._closed = True
+      hostnames = sorted(self._templates)
+      self._templates = {}
+      self._free = {}
+      self._leased = set()
+      self._cond.notify_all()
+
+    def _destroy(hostname):
+      try:
+        destroy_vm(self.vmpooler_hostname, hostname, self.auth_token)
+      except VmNotFoundError:
+        pass
+
+    results = run_parallel(_destroy, hostnames, self.workers)
+
+    return [(hostname, error) for hostname, _, error in results if error is not None]
+
+
+class LeaseServer(object):
+  """Serve leases of a pool to other processes on a local connection. The VMs leased over a
+  connection are released when it closes, so a consumer that dies does not keep them.
+
+  Args:
+    pool |LeasePool| = The pool to lease VMs from.
+    authkey |str| = The key clients must authenticate with. A random key is used by default.
+
+  Raises:
+    |socket.error| = The server could not listen.
+  """
+
+  def __init__(self, pool, authkey=None):
+
+    self.pool = pool
+    self.authkey = authkey or urandom(16)
+    self._listener = Listener(('127.0.0.1', 0), authkey=self.authkey)
+    self.address = self._listener.address
+    self._owners = {}
+    self._lock = Lock()
+    self._closed = False
+
+    thread = Thread(target=self._serve)
+    thread.daemon = True
+    thread.start()
+
+  def _serve(self):
+    """Accept connections until the server is closed."""
+
+    while True:
+      try:
+        conn = self._listener.accept()
+      except (IOError, EOFError, AuthenticationError):
+        if self._closed:
+          return
+
+        continue
+
+      if self._closed:
+        conn.close()
+        return
+
+      thread = Thread(target=self._handle, args=(conn,))
+      thread.daemon = True
+      thread.start()
+
+  def _handle(self, conn):
+    """Answer the requests of one client until it disconnects.
+
+    Args:
+      conn |multiprocessing.connection.Connection| = The connection to the client.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    try:
+      while True:
+        try:
+          request = conn.recv()
+        except (IOError, EOFError):
+          return
+
+        try:
+          if request[0] == 'lease':
+            hostname = self.pool.lease(request[1], request[2])
+
+            with self._lock:
+              self._owners[hostname] = conn
+
+            reply = ('ok', hostname)
+          elif request[0] == 'release':
+            # A VM may be released over another connection of the same client.
+            with self._lock:
+              self._owners.pop(request[1], None)
+
+            self.pool.release(request[1])
+            reply = ('ok', None)
+          else:
+            reply = ('error', 'Unknown request "{}"!'.format(request[0]))
+        except RuntimeError as e:
+          reply = ('error', str(e))
+
+        conn.send(reply)
+    finally:
+      with self._lock:
+        leased = [hostname for hostname, owner in self._owners.items() if owner is conn]
+
+        for hostname in leased:
+          del self._owners[hostname]
+
+      for hostname in leased:
+        try:
+          self.pool.release(hostname)
+        except RuntimeError:
+          pass
+
+      conn.close()
+
+  def close(self):
+    """Stop accepting connections.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    self._closed = True
+
+    # Wake up the thread blocked in "accept".
+    try:
+      Client(self.address, authkey=self.authkey).close()
+    except (IOError, EOFError, AuthenticationError):
+      pass
+
+    self._listener.close()
+
+
+class LeaseClient(object):
+  """Lease VMs from a "LeaseServer". Concurrent calls use separate connections, so a thread
+  waiting for a lease does not block another releasing one.
+
+  Args:
+    address |(str, int)| = The address of the server.
+    authkey |str| = The key of the server.
+
+  Raises:
+    |socket.error| = The server could not be reached.
+    |AuthenticationError| = The key is wrong.
+  """
+
+  def __init__(self, address, authkey):
+
+    self.address = tuple(address)
+    self.authkey = authkey
+    self._idle = [Client(self.address, authkey=authkey)]
+    self._lock = Lock()
+
+  def _call(self, *request):
+    """Send a request and return the result of the reply.
+
+    Args:
+      request |tuple| = The name and arguments of the request.
+
+    Returns:
+      |obj| = The result.
+
+    Raises:
+      |RuntimeError| = The server reported an error.
+    """
+
+    with self._lock:
+      conn = self._idle.pop() if self._idle else None
+
+    if conn is None:
+      conn = Client(self.address, authkey=self.authkey)
+
+    try:
+      conn.send(request)
+      status, result = conn.recv()
+    except (IOError, EOFError):
+      conn.close()
+      raise
+
+    with self._lock:
+      self._idle.append(conn)
+
+    if status != 'ok':
+      raise RuntimeError(result)
+
+    return result
+
+  def lease(self, template, timeout=None):
+    """Lease a VM. See "LeasePool.lease"."""
+
+    return self._call('lease', template, timeout)
+
+  def release(self, hostname):
+    """Return a leased VM. See "LeasePool.release"."""
+
+    self._call('release', hostname)
+
+  def close(self):
+    """Disconnect. Any VMs still leased are released by the server."""
+
+    with self._lock:
+      idle, self._idle = self._idle, []
+
+    for conn in idle:
+      conn.close()
@@ -0,0 +1,460 @@
+"""
+.. module:: vmpooler_client.metrics
+   :synopsis: Client-side request and checkout metrics in the Prometheus text format.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import re
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from os import fdopen, remove, rename
+from os.path import dirname, exists
+from tempfile import mkstemp
+from threading import Lock, Thread
+import hooks
+from hedging import CancelledError
+
+try:
+  from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+  # Windows has no "flock". Concurrent merges are not serialized there.
+  flock = None
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# Upper bounds (in seconds) for the latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+# The metric families that are exported: {name: (type, help)}
+FAMILIES = {
+  'vmpooler_client_requests_total':
+    ('counter', 'Requests answered by the vmpooler by endpoint and status code.'),
+  'vmpooler_client_request_errors_total':
+    ('counter', 'Requests which failed before the vmpooler answered by endpoint.'),
+  'vmpooler_client_request_duration_seconds':
+    ('histogram', 'Time taken for the vmpooler to answer by endpoint.'),
+  'vmpooler_client_checkouts_total':
+    ('counter', 'VM checkouts by template and outcome (ok, drained, not_found, error).'),
+  'vmpooler_client_checkout_duration_seconds':
+    ('histogram', 'Time taken to check out a VM by template.'),
+  'vmpooler_client_time_to_ready_seconds':
+    ('histogram', 'Time taken for a checked-out VM to accept connections by template.'),
+  'vmpooler_client_coalesced_requests_total':
+    ('counter', 'Reads which shared the response of an identical read already in flight.')
+}
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)\s*$')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# The registry requests are recorded in. Metrics are disabled while this is "None".
+_registry = None
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _escape(value):
+  """Escape a label value for the text format."""
+
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _unescape(value):
+  """Reverse "_escape"."""
+
+  return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+
+
+def _format_float(value):
+  """Format a sample value or bucket bound for the text format."""
+
+  if value == float('inf'):
+    return '+Inf'
+  elif value == int(value):
+    return str(int(value)) if abs(value) < 1e15 else repr(value)
+
+  return repr(value)
+
+
+def _family_of(sample_name):
+  """Find the family a sample belongs to.
+
+  Args:
+    sample_name |str| = The name of the sample. E.g. "vmpooler_client_checkouts_total"
+
+  Returns:
+    |str| = The family name or "None" if the sample is not one of ours.
+
+  Raises:
+    |None|
+  """
+
+  if sample_name in FAMILIES:
+    return sample_name
+
+  for suffix in ('_bucket', '_sum', '_count'):
+    if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in FAMILIES:
+      return sample_name[:-len(suffix)]
+
+  return None
+
+
+def _record_response(event):
+  """The "after_response" hook."""
+
+  registry = _registry
+
+  if registry is None:
+    return
+
+  registry.inc('vmpooler_client_requests_total',
+               (('endpoint', event.endpoint), ('status', str(event.status))))
+
+  if 'total' in event.timings:
+    registry.observe('vmpooler_client_request_duration_seconds',
+                     (('endpoint', event.endpoint),),
+                     event.timings['total'])
+
+    if event.endpoint == 'POST /vm/<template>':
+      registry.observe('vmpooler_client_checkout_duration_seconds',
+                       (('template', event.path[len('/vm/'):]),),
+                       event.timings['total'])
+
+
+def _record_error(event):
+  """The "on_error" hook."""
+
+  registry = _registry
+
+  # The losing attempt of a hedged request is cancelled on purpose; it is not an error.
+  if registry is not None and not isinstance(event.error, CancelledError):
+    registry.inc('vmpooler_client_request_errors_total', (('endpoint', event.endpoint),))
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class Registry(object):
+  """A thread-safe collection of counter and histogram samples.
+
+  Args:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self):
+
+    # {(sample_name, ((label, value),)): float}
+    self._samples = {}
+    self._lock = Lock()
+
+  def inc(self, name, labels, amount=1):
+    """Increment a counter.
+
+    Args:
+      name |str| = The name of the counter.
+      labels |((str, str),)| = The labels of the sample.
+      amount |float| = The amount to add.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    key = (name, labels)
+
+    with self._lock:
+      self._samples[key] = self._samples.get(key, 0) + amount
+
+  def observe(self, name, labels, value):
+    """Record an observation in a histogram.
+
+    Args:
+      name |str| = The name of the histogram.
+      labels |((str, str),)| = The labels of the sample.
+      value |float| = The observed value.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      # Buckets are cumulative and every bucket is exported, even when empty.
+      for bound in LATENCY_BUCKETS:
+        key = (name + '_bucket', labels + (('le', _format_float(bound)),))
+        self._samples[key] = self._samples.get(key, 0) + (1 if value <= bound else 0)
+
+      for key, amount in (((name + '_sum', labels), value), ((name + '_count', labels), 1)):
+        self._samples[key] = self._samples.get(key, 0) + amount
+
+  def merge(self, text):
+    """Add the samples from previously rendered text to this registry. Every exported sample is
+    a counter, bucket, sum or count, so samples are merged by adding them.
+
+    Args:
+      text |str| = Metrics in the text format.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    for line in text.splitlines():
+      match = _SAMPLE_RE.match(line)
+
+      if line.startswith('#') or not match or not _family_of(match.group(1)):
+        continue
+
+      labels = tuple((k, _unescape(v)) for k, v in _LABEL_RE.findall(match.group(2) or ''))
+
+      try:
+        self.inc(match.group(1), labels, float(match.group(3)))
+      except ValueError:
+        continue
+
+  def render(self):
+    """Render the samples in the Prometheus text format.
+
+    Args:
+      |None|
+
+    Returns:
+      |str| = The rendered metrics.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      samples = self._samples.items()
+
+    by_family = {}
+
+    for (name, labels), value in samples:
+      by_family.setdefault(_family_of(name), []).append((name, labels, value))
+
+    def _sort_key(sample):
+      name, labels, _ = sample
+      bucket = dict(labels).get('le')
+      bound = float('inf') if bucket in (None, '+Inf') else float(bucket)
+
+      return (tuple(l for l in labels if l[0] != 'le'), name, bound)
+
+    lines = []
+
+    for family in sorted(by_family):
+      metric_type, help_text = FAMILIES[family]
+      lines.append('# HELP {} {}'.format(family, help_text))
+      lines.append('# TYPE {} {}'.format(family, metric_type))
+
+      for name, labels, value in sorted(by_family[family], key=_sort_key):
+        label_text = ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels)
+        lines.append('{}{{{}}} {}'.format(name, label_text, _format_float(value)))
+
+    return '\n'.join(lines) + '\n'
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def enable():
+  """Start recording metrics for every request made through the service layer.
+
+  Args:
+    |None|
+
+  Returns:
+    |Registry| = The registry metrics are recorded in.
+
+  Raises:
+    |None|
+  """
+
+  global _registry
+
+  if _registry is None:
+    _registry = Registry()
+    hooks.register(after_response=_record_response, on_error=_record_error)
+
+  return _registry
+
+
+def disable():
+  """Stop recording metrics and discard the recorded samples.
+
+  Args:
+    |None|
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _registry
+
+  hooks.unregister(_record_response)
+  hooks.unregister(_record_error)
+  _registry = None
+
+
+def record_checkout(template_name, outcome):
+  """Count the outcome of a VM checkout. Does nothing while metrics are disabled.
+
+  Args:
+    template_name |str| = The name of the template on the vmpooler.
+    outcome |str| = One of "ok", "drained", "not_found" or "error".
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  registry = _registry
+
+  if registry is not None:
+    registry.inc('vmpooler_client_checkouts_total',
+                 (('outcome', outcome), ('template', template_name)))
+
+
+def record_ready(template_name, seconds):
+  """Record the time a checked-out VM took to accept connections. Does nothing while metrics are
+  disabled.
+
+  Args:
+    template_name |str| = The name of the template on the vmpooler.
+    seconds |float| = The seconds between the start of probing and the first connection.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  registry = _registry
+
+  if registry is not None:
+    registry.observe('vmpooler_client_time_to_ready_seconds',
+                     (('template', template_name),),
+                     seconds)
+
+
+def record_coalesced(function_name):
+  """Count a read which was coalesced with an identical read in flight. Does nothing while
+  metrics are disabled.
+
+  Args:
+    function_name |str| = The name of the service function. E.g. "info_vm"
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  registry = _registry
+
+  if registry is not None:
+    registry.inc('vmpooler_client_coalesced_requests_total', (('function', function_name),))
+
+
+def write_textfile(path):
+  """Merge the recorded samples into a file for the node exporter textfile collector. The
+  samples already in the file are added to ours, so the file holds the totals for every
+  invocation. The file is replaced atomically and concurrent writers are serialized with a lock
+  file where the platform supports it.
+
+  Args:
+    path |str| = The path of the ".prom" file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |IOError| = Failed to write the metrics file.
+  """
+
+  registry = _registry
+
+  if registry is None:
+    return
+
+  with open(path + '.lock', 'a') as lock_file:
+    if flock:
+      flock(lock_file.fileno(), LOCK_EX)
+
+    try:
+      merged = Registry()
+      merged.merge(registry.render())
+
+      if exists(path):
+        with open(path, 'r') as f:
+          merged.merge(f.read())
+
+      fd, tmp_path = mkstemp(dir=dirname(path) or '.', prefix='.vmpooler_client_metrics')
+      try:
+        with fdopen(fd, 'w') as f:
+          f.write(merged.render())
+        rename(tmp_path, path)
+      except:
+        remove(tmp_path)
+        raise
+    finally:
+      if flock:
+        flock(lock_file.fileno(), LOCK_UN)
+
+
+def serve(port, address='127.0.0.1'):
+  """Serve the recorded metrics over HTTP from a background thread. Metrics are enabled if they
+  are not already.
+
+  Args:
+    port |int| = The port to listen on. Use "0" to pick a free port.
+    address |str| = The address to listen on.
+
+  Returns:
+    |BaseHTTPServer.HTTPServer| = The running server.
+
+  Raises:
+    |socket.error| = The port could not be bound.
+  """
+
+  registry = enable()
+
+  class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      body = registry.render()
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/plain; version=0.0.4')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = HTTPServer((address, port), _MetricsHandler)
+  thread = Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+
+  return server
@@ -0,0 +1,264 @@
+"""
+.. module:: vmpooler_client.parallel
+   :synopsis: Run a function over many items from a pool of threads.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from threading import Condition, Lock, Thread
+from time import time
+from Queue import Queue, Empty
+from conf_file import get_flag, get_float
+import timings
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The default number of requests in flight for bulk operations.
+DEFAULT_WORKERS = 8
+
+# How often (in seconds) blocking waits wake up so that Ctrl-C is still delivered.
+_POLL_INTERVAL = 0.5
+
+# The default highest number of concurrent calls an adaptive limit may reach.
+DEFAULT_CEILING = 32
+
+# A call is a latency spike when it takes longer than this many times the baseline latency.
+DEFAULT_TOLERANCE = 2.0
+
+# The limit is multiplied by this on every back-off.
+DEFAULT_DECREASE = 0.5
+
+# Seconds a call may exceed the tolerated latency by before it counts as a spike, so that the
+# jitter of very fast calls is not mistaken for one.
+_SPIKE_SLACK = 0.05
+
+# How far the baseline latency moves towards a slower call. Faster calls replace it outright.
+_BASELINE_DRIFT = 0.05
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class AdaptiveLimit(object):
+  """A limit on concurrent calls which grows additively while calls succeed at a steady latency
+  and shrinks multiplicatively when a call fails or its latency spikes. Calls which started
+  before the last back-off cannot cause another one, so a burst of failures backs off once.
+
+  Args:
+    name |str| = What the limit is for. E.g. "destroy"
+    initial |int| = The starting limit.
+    ceiling |int| = The highest limit.
+    floor |int| = The lowest limit.
+    tolerance |float| = How many times the baseline latency a call may take before it counts as
+      a latency spike.
+    decrease |float| = The limit is multiplied by this on every back-off.
+
+  Raises:
+    |ValueError| = The tolerance is not above 1 or the decrease is not between 0 and 1.
+  """
+
+  def __init__(self,
+               name,
+               initial,
+               ceiling=DEFAULT_CEILING,
+               floor=1,
+               tolerance=DEFAULT_TOLERANCE,
+               decrease=DEFAULT_DECREASE):
+
+    if tolerance <= 1:
+      raise ValueError('The latency tolerance must be above 1!')
+    elif not 0 < decrease < 1:
+      raise ValueError('The back-off factor must be between 0 and 1!')
+
+    self.name = name
+    self.ceiling = max(int(ceiling), 1)
+    self.floor = min(max(int(floor), 1), self.ceiling)
+    self.tolerance = tolerance
+    self.decrease = decrease
+    self.peak = min(max(int(initial), self.floor), self.ceiling)
+    self.calls = 0
+    self.backoffs = 0
+    self._limit = float(self.peak)
+    self._baseline = None
+    self._in_flight = 0
+    self._epoch = 0
+    self._cond = Condition(Lock())
+
+  @property
+  def limit(self):
+    """The number of calls currently allowed at once."""
+
+    return int(self._limit)
+
+  def acquire(self):
+    """Wait until another call is allowed.
+
+    Args:
+      |None|
+
+    Returns:
+      |(float, int)| = The ticket of the call, to hand to "release".
+
+    Raises:
+      |None|
+    """
+
+    with self._cond:
+      while self._in_flight >= int(self._limit):
+        self._cond.wait(_POLL_INTERVAL)
+
+      self._in_flight += 1
+
+      return (time(), self._epoch)
+
+  def release(self, ticket, failed):
+    """Finish a call and adapt the limit to its outcome.
+
+    Args:
+      ticket |(float, int)| = The ticket of the call, as returned by "acquire".
+      failed |bln| = Whether the call failed.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    start, epoch = ticket
+    latency = time() - start
+
+    with self._cond:
+      self._in_flight -= 1
+      self.calls += 1
+      spike = False
+
+      if not failed:
+        if self._baseline is None or latency < self._baseline:
+          self._baseline = latency
+        else:
+          spike = latency > self._baseline * self.tolerance + _SPIKE_SLACK
+          self._baseline += (latency - self._baseline) * _BASELINE_DRIFT
+
+      if failed or spike:
+        if epoch == self._epoch:
+          self._limit = max(self._limit * self.decrease, self.floor)
+          self._epoch += 1
+          self.backoffs += 1
+      else:
+        # Grow by about one for every round of calls at the current limit.
+        self._limit = min(self._limit + 1.0 / self._limit, self.ceiling)
+        self.peak = max(self.peak, int(self._limit))
+
+      self._cond.notify_all()
+
+  def describe(self):
+    """Summarize the limit for people.
+
+    Args:
+      |None|
+
+    Returns:
+      |str| = The summary.
+
+    Raises:
+      |None|
+    """
+
+    return '{}: limit {} (peak {}, ceiling {}, {} back-offs over {} calls)'.format(
+      self.name, self.limit, self.peak, self.ceiling, self.backoffs, self.calls)
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def run_parallel(func, items, workers=DEFAULT_WORKERS):
+  """Call a function with each item from a pool of threads. An error raised for one item does
+  not stop the others.
+
+  Args:
+    func |func| = A function accepting a single item.
+    items |[obj]| = The items to process.
+    workers |int| or |AdaptiveLimit| = The maximum number of concurrent calls, or a limit which
+      adapts the number of concurrent calls to their latency and failures.
+
+  Returns:
+    |[(obj, obj, Exception)]| = The item, result and error of every call in the order of
+      "items". The error is "None" for calls that succeeded and the result is "None" for calls
+      that failed.
+
+  Raises:
+    |None|
+  """
+
+  items = list(items)
+  limit = workers if isinstance(workers, AdaptiveLimit) else None
+  results = [None] * len(items)
+  pending = Queue()
+
+  for index, item in enumerate(items):
+    pending.put((index, item))
+
+  def _worker():
+    while True:
+      try:
+        index, item = pending.get_nowait()
+      except Empty:
+        return
+
+      start = limit.acquire() if limit else None
+
+      try:
+        results[index] = (item, func(item), None)
+      except Exception as e:
+        results[index] = (item, None, e)
+
+      if limit:
+        limit.release(start, results[index][2] is not None)
+
+  if limit:
+    workers = limit.ceiling
+
+  threads = [Thread(target=_worker) for _ in range(max(min(workers, len(items)), 0))]
+
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+
+  for thread in threads:
+    while thread.is_alive():
+      thread.join(_POLL_INTERVAL)
+
+  return results
+
+
+def bulk_workers(config, operation):
+  """Choose the concurrency of a bulk operation from the settings. It starts at "max_workers"
+  and, unless "adaptive_concurrency" is off, adapts up to "max_concurrency".
+
+  Args:
+    config |{str:str}| = A dictionary of settings from the configuration file.
+    operation |str| = The name of the operation. E.g. "destroy"
+
+  Returns:
+    |int| or |AdaptiveLimit| = The number of concurrent calls or an adaptive limit.
+
+  Raises:
+    |RuntimeError| = A setting is not a number.
+  """
+
+  workers = max(int(get_float(config, 'max_workers', DEFAULT_WORKERS)), 1)
+
+  if not get_flag(config, 'adaptive_concurrency', True):
+    return workers
+
+  ceiling = max(int(get_float(config, 'max_concurrency', DEFAULT_CEILING)), workers)
+
+  limit = AdaptiveLimit(operation, workers, ceiling)
+  timings.record_limit(limit)
+
+  return limit
@@ -0,0 +1,128 @@
+"""
+.. module:: vmpooler_client.planner
+   :synopsis: Order batches of releases, lifetime changes and acquisitions by vmpooler capacity.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from threading import Event
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class Step(object):
+  """A single request of a batch and the steps it must wait for.
+
+  Args:
+    kind |str| = One of "release", "lifetime" or "acquire".
+    pooler |str| = The vmpooler the request is sent to.
+    hostname |str| = The VM released or changed. "None" for acquisitions.
+    template |str| = The template of a released VM, or "None" if it is unknown.
+    hours |int| = The new lifetime of a VM. "None" for other steps.
+    counts |{str:int}| = The number of VMs to acquire for each template. "None" for other steps.
+    after |[Step]| = The steps which must finish before this one starts.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, kind, pooler, hostname=None, template=None, hours=None, counts=None,
+               after=()):
+
+    self.kind = kind
+    self.pooler = pooler
+    self.hostname = hostname
+    self.template = template
+    self.hours = hours
+    self.counts = counts
+    self.after = list(after)
+
+    # Set once the step has finished, whether it succeeded or not.
+    self.done = Event()
+
+  def describe(self):
+    """Summarize the step for people.
+
+    Args:
+      |None|
+
+    Returns:
+      |str| = The summary.
+
+    Raises:
+      |None|
+    """
+
+    if self.kind == 'release':
+      return 'Release {} ({})'.format(self.hostname, self.template or 'unknown template')
+    elif self.kind == 'lifetime':
+      return 'Set the lifetime of {} to {} hours'.format(self.hostname, self.hours)
+
+    summary = 'Acquire {} from {}'.format(
+      ', '.join('{} x {}'.format(count, template) for template, count in
+                sorted(self.counts.items())),
+      self.pooler)
+
+    if self.after:
+      summary += ' after releasing {}'.format(', '.join(step.hostname for step in self.after))
+
+    return summary
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def plan(demands, releases=(), lifetimes=()):
+  """Order a batch so that capacity is handed back before it is asked for. Releases come first,
+  then lifetime changes, then acquisitions. Templates which nothing is released for are
+  acquired in one request per vmpooler straight away. Templates which VMs are being released
+  for wait for those releases, and only those, so the two phases overlap. A release with an
+  unknown template holds back every acquisition from its vmpooler.
+
+  Args:
+    demands |{str:{str:int}}| = The counts per template for each vmpooler.
+    releases |[{str:str}]| = The "hostname", "pooler" and "template" of each VM to release. The
+      template may be "None" if it is unknown.
+    lifetimes |[{str:obj}]| = The "hostname", "pooler" and "hours" of each lifetime change.
+
+  Returns:
+    |[Step]| = The steps in the order they should be started.
+
+  Raises:
+    |None|
+  """
+
+  release_steps = [Step('release', vm['pooler'], vm['hostname'], vm.get('template'))
+                   for vm in releases]
+  lifetime_steps = [Step('lifetime', change['pooler'], change['hostname'], hours=change['hours'])
+                    for change in lifetimes]
+  ready = []
+  waiting = []
+
+  for pooler, counts in sorted(demands.items()):
+    freed = [step for step in release_steps if step.pooler == pooler]
+    unknown = [step for step in freed if step.template is None]
+    free_counts = {}
+    groups = {}
+
+    # Templates waiting on the same releases are still acquired in one request.
+    for template_name, count in sorted(counts.items()):
+      after = [step for step in freed if step.template == template_name] + unknown
+
+      if after:
+        key = tuple(id(step) for step in after)
+        groups.setdefault(key, (after, {}))[1][template_name] = count
+      else:
+        free_counts[template_name] = count
+
+    if free_counts:
+      ready.append(Step('acquire', pooler, counts=free_counts))
+
+    for after, group_counts in sorted(groups.values(), key=lambda group: sorted(group[1])):
+      waiting.append(Step('acquire', pooler, counts=group_counts, after=after))
+
+  return release_steps + lifetime_steps + ready + waiting
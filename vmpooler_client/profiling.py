@@ -0,0 +1,149 @@
+"""
+.. module:: vmpooler_client.profiling
+   :synopsis: Run a command under the CPU or memory profiler.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import sys
+from cProfile import Profile
+from pstats import Stats
+
+try:
+  import tracemalloc
+except ImportError:
+  # Python 2.7 only has "tracemalloc" when the "pytracemalloc" backport is installed.
+  tracemalloc = None
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+PROFILERS = ('cpu', 'mem')
+
+# The number of stack frames kept for each allocation.
+_TRACE_DEPTH = 25
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _profile_cpu(func, output, top):
+  """Run a function under cProfile, dump the stats and print the most expensive calls.
+
+  Args:
+    func |func| = A function with no arguments to profile.
+    output |str| = The path to dump the "pstats" data to.
+    top |int| = The number of entries to print in the summary.
+
+  Returns:
+    |obj| = The return value of the function.
+
+  Raises:
+    |Exception| = Anything raised by the function.
+  """
+
+  profiler = Profile()
+
+  try:
+    return profiler.runcall(func)
+  finally:
+    profiler.dump_stats(output)
+
+    sys.stderr.write('\nCPU profile written to "{}"\n'.format(output))
+    Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(top)
+
+
+def _profile_mem(func, output, top):
+  """Run a function under tracemalloc and report the top allocation sites and peak memory.
+
+  Args:
+    func |func| = A function with no arguments to profile.
+    output |str| = The path to write the allocation report to.
+    top |int| = The number of allocation sites to report.
+
+  Returns:
+    |obj| = The return value of the function.
+
+  Raises:
+    |RuntimeError| = The tracemalloc module is not available.
+    |Exception| = Anything raised by the function.
+  """
+
+  if tracemalloc is None:
+    raise RuntimeError('Memory profiling requires the "tracemalloc" module! On Python 2.7 '
+                       'install the "pytracemalloc" backport.')
+
+  tracemalloc.start(_TRACE_DEPTH)
+
+  try:
+    return func()
+  finally:
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lines = ['Peak traced memory: {:.1f} KiB'.format(peak / 1024.0),
+             'Traced memory at exit: {:.1f} KiB'.format(current / 1024.0),
+             '',
+             'Top {} allocation sites:'.format(top)]
+
+    for stat in snapshot.statistics('lineno')[:top]:
+      lines.append(str(stat))
+
+    report = '\n'.join(lines) + '\n'
+
+    with open(output, 'w') as f:
+      f.write(report)
+
+    sys.stderr.write('\nMemory profile written to "{}"\n{}'.format(output, report))
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def default_output(kind):
+  """Build the default output path for a profile.
+
+  Args:
+    kind |str| = The kind of profile. Either "cpu" or "mem".
+
+  Returns:
+    |str| = The default path in the current directory.
+
+  Raises:
+    |None|
+  """
+
+  return 'vmpooler_client.{}'.format('pstats' if kind == 'cpu' else 'memprof.txt')
+
+
+def run_profiled(kind, func, output=None, top=20):
+  """Run a function under a profiler. The profile is written even if the function raises.
+
+  Args:
+    kind |str| = The kind of profile. Either "cpu" or "mem".
+    func |func| = A function with no arguments to profile.
+    output |str| = The path to write the profile to. Defaults to a file in the current directory.
+    top |int| = The number of entries to print in the summary.
+
+  Returns:
+    |obj| = The return value of the function.
+
+  Raises:
+    |ValueError| = Unknown kind of profile.
+    |RuntimeError| = The profiler is not available.
+  """
+
+  if kind not in PROFILERS:
+    raise ValueError('The profiler must be one of: {}'.format(', '.join(PROFILERS)))
+
+  output = output or default_output(kind)
+
+  if kind == 'cpu':
+    return _profile_cpu(func, output, top)
+  else:
+    return _profile_mem(func, output, top)
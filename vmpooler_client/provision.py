@@ -0,0 +1,370 @@
+"""
+.. module:: vmpooler_client.provision
+   :synopsis: Provision sets of VMs described by a manifest with all-or-nothing semantics.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from threading import Event, Lock
+from time import time
+from jsoncodec import loads
+from parallel import run_parallel, DEFAULT_WORKERS
+from planner import plan
+from readiness import fqdn
+from service import checkout_vms, destroy_vm, set_vm_lifetime, PoolDrainedError, VmNotFoundError
+from util import MAX_LIFETIME
+
+try:
+  import yaml
+except ImportError:
+  # YAML manifests are only supported when PyYAML is installed.
+  yaml = None
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The default number of seconds to keep retrying drained pools.
+DEFAULT_DEADLINE = 300
+
+# The default number of seconds between attempts on a drained pool.
+DEFAULT_RETRY_INTERVAL = 5
+
+# The keys of a manifest which lists its VMs under "vms" rather than at the top level.
+_SECTIONS = ('vms', 'release', 'lifetime')
+
+# How often (in seconds) blocking waits wake up so that Ctrl-C is still delivered.
+_POLL_INTERVAL = 0.5
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _read_manifest(path):
+  """Read a JSON or YAML manifest.
+
+  Args:
+    path |str| = The path to the manifest. Files ending in ".yaml" or ".yml" are read as YAML.
+
+  Returns:
+    |obj| = The parsed manifest.
+
+  Raises:
+    |RuntimeError| = The manifest is unreadable, malformed or YAML support is not installed.
+  """
+
+  try:
+    with open(path, 'r') as f:
+      text = f.read()
+  except IOError as e:
+    raise RuntimeError('Could not read the manifest "{}": {}'.format(path, e.strerror))
+
+  if path.endswith(('.yaml', '.yml')):
+    if yaml is None:
+      raise RuntimeError('YAML manifests require PyYAML! Install it or use a JSON manifest.')
+
+    return yaml.safe_load(text)
+
+  try:
+    return loads(text)
+  except ValueError as e:
+    raise RuntimeError('The manifest "{}" is not valid JSON: {}'.format(path, e))
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def parse_manifest(manifest, default_pooler):
+  """Convert a manifest into the VMs to request from each vmpooler. A manifest maps template
+  names to either a count or a dictionary with a "count" and an optional "pooler". The mapping
+  may be given at the top level or under a "vms" key next to an optional "deadline" and the
+  changes read by "parse_changes".
+
+  Args:
+    manifest |{str:obj}| = The parsed manifest.
+    default_pooler |str| = The vmpooler used for templates that do not name one.
+
+  Returns:
+    |({str:{str:int}}, float)| = The counts per template for each vmpooler and the deadline
+      from the manifest or "None" if it has none.
+
+  Raises:
+    |RuntimeError| = The manifest is malformed.
+  """
+
+  if not isinstance(manifest, dict):
+    raise RuntimeError('The manifest must map template names to VM counts!')
+
+  sectioned = any(key in manifest for key in _SECTIONS)
+  deadline = manifest.get('deadline') if sectioned else None
+  templates = (manifest.get('vms') or {}) if sectioned else manifest
+  demands = {}
+
+  for template_name, entry in templates.items():
+    if isinstance(entry, dict):
+      count = entry.get('count', 1)
+      pooler = entry.get('pooler', default_pooler)
+    else:
+      count = entry
+      pooler = default_pooler
+
+    # Booleans are integers to Python but never a count.
+    if isinstance(count, bool) or not isinstance(count, int) or count < 0:
+      raise RuntimeError('The count for "{}" must be a non-negative integer!'.format(
+        template_name))
+
+    if count:
+      counts = demands.setdefault(pooler, {})
+      counts[template_name] = counts.get(template_name, 0) + count
+
+  return (demands, float(deadline) if deadline is not None else None)
+
+
+def parse_changes(manifest, default_pooler):
+  """Read the VMs to release and the lifetimes to change from a manifest. "release" lists
+  hostnames, or dictionaries with a "hostname" and an optional "template" and "pooler".
+  "lifetime" maps hostnames to hours, or to dictionaries with the "hours" and an optional
+  "pooler".
+
+  Args:
+    manifest |{str:obj}| = The parsed manifest.
+    default_pooler |str| = The vmpooler used for VMs that do not name one.
+
+  Returns:
+    |([{str:str}], [{str:obj}])| = The "hostname", "template" and "pooler" of each VM to
+      release and the "hostname", "hours" and "pooler" of each lifetime change.
+
+  Raises:
+    |RuntimeError| = The changes are malformed.
+  """
+
+  if not isinstance(manifest, dict) or not any(key in manifest for key in _SECTIONS):
+    return ([], [])
+
+  entries = manifest.get('release') or []
+  changes = manifest.get('lifetime') or {}
+
+  if not isinstance(entries, list):
+    raise RuntimeError('The VMs to release must be a list!')
+  elif not isinstance(changes, dict):
+    raise RuntimeError('The lifetimes must map hostnames to hours!')
+
+  releases = []
+  lifetimes = []
+
+  for entry in entries:
+    if not isinstance(entry, dict):
+      entry = {'hostname': entry}
+
+    if not isinstance(entry.get('hostname'), basestring):
+      raise RuntimeError('Every VM to release must have a hostname!')
+
+    releases.append({'hostname': entry['hostname'],
+                     'template': entry.get('template'),
+                     'pooler': entry.get('pooler', default_pooler)})
+
+  for hostname, entry in sorted(changes.items()):
+    if isinstance(entry, dict):
+      hours = entry.get('hours')
+      pooler = entry.get('pooler', default_pooler)
+    else:
+      hours = entry
+      pooler = default_pooler
+
+    if isinstance(hours, bool) or not isinstance(hours, int) or not 0 < hours <= MAX_LIFETIME:
+      raise RuntimeError('The lifetime for "{}" must be between 1 and {} hours!'.format(
+        hostname, MAX_LIFETIME))
+
+    lifetimes.append({'hostname': hostname, 'hours': hours, 'pooler': pooler})
+
+  return (releases, lifetimes)
+
+
+def load_manifest(path, default_pooler):
+  """Read a JSON or YAML manifest. See "parse_manifest" for the format.
+
+  Args:
+    path |str| = The path to the manifest. Files ending in ".yaml" or ".yml" are read as YAML.
+    default_pooler |str| = The vmpooler used for templates that do not name one.
+
+  Returns:
+    |({str:{str:int}}, float)| = The counts per template for each vmpooler and the deadline
+      from the manifest or "None" if it has none.
+
+  Raises:
+    |RuntimeError| = The manifest is unreadable, malformed or YAML support is not installed.
+  """
+
+  return parse_manifest(_read_manifest(path), default_pooler)
+
+
+def load_batch(path, default_pooler):
+  """Read a JSON or YAML manifest with the VMs to acquire, release and change. See
+  "parse_manifest" and "parse_changes" for the format.
+
+  Args:
+    path |str| = The path to the manifest. Files ending in ".yaml" or ".yml" are read as YAML.
+    default_pooler |str| = The vmpooler used for VMs that do not name one.
+
+  Returns:
+    |({str:{str:int}}, float, [{str:str}], [{str:obj}])| = The counts per template for each
+      vmpooler, the deadline or "None", the VMs to release and the lifetime changes.
+
+  Raises:
+    |RuntimeError| = The manifest is unreadable, malformed or YAML support is not installed.
+  """
+
+  manifest = _read_manifest(path)
+  demands, deadline = parse_manifest(manifest, default_pooler)
+
+  return (demands, deadline) + parse_changes(manifest, default_pooler)
+
+
+def release(vms, auth_token, workers=DEFAULT_WORKERS):
+  """Hand VMs back to their vmpoolers in parallel.
+
+  Args:
+    vms |[{str:str}]| = The VMs returned by "provision".
+    auth_token |str| = The authentication token for the user.
+    workers |int| = The maximum number of concurrent requests.
+
+  Returns:
+    |[({str:str}, Exception)]| = The VMs which could not be released and the errors.
+
+  Raises:
+    |None|
+  """
+
+  results = run_parallel(lambda vm: destroy_vm(vm['pooler'], vm['hostname'], auth_token),
+                         vms,
+                         workers)
+
+  return [(vm, error) for vm, _, error in results if error]
+
+
+def provision(demands,
+              auth_token,
+              deadline=DEFAULT_DEADLINE,
+              retry_interval=DEFAULT_RETRY_INTERVAL,
+              workers=DEFAULT_WORKERS):
+  """Acquire every VM in the demands or none of them. The VMs for each vmpooler are requested in
+  a single batched request and the vmpoolers are served concurrently. Drained pools are retried
+  until the deadline. If any request cannot be filled, every VM acquired so far is released in
+  parallel.
+
+  Args:
+    demands |{str:{str:int}}| = The counts per template for each vmpooler.
+    auth_token |str| = The authentication token for the user.
+    deadline |float| = The number of seconds to keep retrying drained pools.
+    retry_interval |float| = The number of seconds between attempts on a drained pool.
+    workers |int| = The maximum number of concurrent requests.
+
+  Returns:
+    |[{str:str}]| = The "hostname", "template", "domain", "fqdn" and "pooler" of every VM.
+
+  Raises:
+    |RuntimeError| = A request could not be filled before the deadline. The message lists any
+      VMs that could not be released.
+  """
+
+  return run_batch(demands,
+                   auth_token,
+                   deadline=deadline,
+                   retry_interval=retry_interval,
+                   workers=workers)[0]
+
+
+def run_batch(demands,
+              auth_token,
+              releases=(),
+              lifetimes=(),
+              deadline=DEFAULT_DEADLINE,
+              retry_interval=DEFAULT_RETRY_INTERVAL,
+              workers=DEFAULT_WORKERS):
+  """Release VMs, change lifetimes and acquire VMs in one batch ordered by "planner.plan", so
+  that acquisitions find the capacity the releases hand back. Acquisitions are all-or-nothing
+  like "provision". A failed release or lifetime change does not stop the batch.
+
+  Args:
+    demands |{str:{str:int}}| = The counts per template for each vmpooler.
+    auth_token |str| = The authentication token for the user.
+    releases |[{str:str}]| = The VMs to release. See "planner.plan".
+    lifetimes |[{str:obj}]| = The lifetime changes. See "planner.plan".
+    deadline |float| = The number of seconds to keep retrying drained pools.
+    retry_interval |float| = The number of seconds between attempts on a drained pool.
+    workers |int| = The maximum number of concurrent requests.
+
+  Returns:
+    |([{str:str}], [(str, Exception)])| = The "hostname", "template", "domain", "fqdn" and
+      "pooler" of every VM acquired, and the hostname and error of every release or lifetime
+      change that failed.
+
+  Raises:
+    |RuntimeError| = An acquisition could not be filled before the deadline. The message lists
+      any VMs that could not be released.
+  """
+
+  end = time() + deadline
+  acquired = []
+  lock = Lock()
+  abort = Event()
+
+  def _fill(pooler, counts):
+    while True:
+      try:
+        vms, domain = checkout_vms(pooler, counts, auth_token)
+        break
+      except PoolDrainedError:
+        if abort.is_set() or time() + retry_interval >= end:
+          raise
+
+        abort.wait(retry_interval)
+      except Exception:
+        abort.set()
+        raise
+
+    with lock:
+      acquired.extend({'hostname': hostname,
+                       'template': template_name,
+                       'domain': domain,
+                       'fqdn': fqdn(hostname, domain),
+                       'pooler': pooler} for template_name, hostname in vms)
+
+  def _run(step):
+    try:
+      # The planner orders releases first, so the steps waited for are already underway.
+      for prerequisite in step.after:
+        while not prerequisite.done.wait(_POLL_INTERVAL):
+          pass
+
+      if step.kind == 'release':
+        try:
+          destroy_vm(step.pooler, step.hostname, auth_token)
+        except VmNotFoundError:
+          pass
+      elif step.kind == 'lifetime':
+        set_vm_lifetime(step.pooler, step.hostname, step.hours, auth_token)
+      else:
+        _fill(step.pooler, step.counts)
+    finally:
+      step.done.set()
+
+  results = run_parallel(_run, plan(demands, releases, lifetimes), workers)
+  failures = [(step.hostname, error) for step, _, error in results
+              if error and step.kind != 'acquire']
+  errors = ['{}: {}'.format(step.pooler, error) for step, _, error in results
+            if error and step.kind == 'acquire']
+
+  if errors:
+    leaked = release(acquired, auth_token, workers)
+    message = 'Provisioning failed and {} acquired VMs were released!\n{}'.format(
+      len(acquired) - len(leaked), '\n'.join(errors))
+
+    if leaked:
+      message += '\nCould not release: {}'.format(', '.join(vm['hostname'] for vm, _ in leaked))
+
+    raise RuntimeError(message)
+
+  return (sorted(acquired, key=lambda vm: (vm['template'], vm['hostname'])), failures)
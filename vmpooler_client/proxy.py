@@ -0,0 +1,251 @@
+"""
+.. module:: vmpooler_client.proxy
+   :synopsis: A local proxy which shares cached vmpooler reads between many clients on one host.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from httplib import HTTPException
+from socket import error as socket_error
+from threading import Lock
+from time import time
+from jsoncodec import dumps
+from service import forward_request
+from singleflight import SingleFlight
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The default number of seconds a read is served from the cache.
+DEFAULT_TTL = 5.0
+
+# The reads which are cached. Every other request is passed straight through.
+CACHED_ENDPOINTS = ('GET /vm', 'GET /vm/<hostname>', 'GET /token/<token>')
+
+# The request headers passed on to the vmpooler. Reads are cached per credentials.
+_FORWARDED_HEADERS = ('X-AUTH-TOKEN', 'Authorization', 'Content-Type')
+
+# The number of cached reads above which expired ones are dropped.
+_PURGE_SIZE = 1024
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _endpoint(method, path):
+  """Name a request the way the service layer does, with names replaced by placeholders.
+
+  Args:
+    method |str| = Type of request. GET, POST, PUT or DELETE.
+    path |str| = The path of the url. E.g. /vm/vm_name
+
+  Returns:
+    |str| = The endpoint. E.g. "GET /vm/<hostname>"
+
+  Raises:
+    |None|
+  """
+
+  parts = path.split('?', 1)[0].strip('/').split('/')
+
+  if parts[0] == 'vm':
+    if len(parts) == 1:
+      return '{} /vm'.format(method)
+    elif len(parts) == 2:
+      return '{} /vm/{}'.format(method, '<template>' if method == 'POST' else '<hostname>')
+    elif len(parts) == 3 and parts[2] == 'snapshot':
+      return '{} /vm/<hostname>/snapshot'.format(method)
+    elif len(parts) == 4 and parts[2] == 'snapshot':
+      return '{} /vm/<hostname>/snapshot/<snapshot>'.format(method)
+  elif parts[0] == 'token':
+    if len(parts) == 1:
+      return '{} /token'.format(method)
+    elif len(parts) == 2:
+      return '{} /token/<token>'.format(method)
+
+  return '{} {}'.format(method, path)
+
+
+#===================================================================================================
+# Classes: Private
+#===================================================================================================
+class _ProxyHandler(BaseHTTPRequestHandler):
+  """Pass each request to the proxy server and write its response back to the client."""
+
+  protocol_version = 'HTTP/1.1'
+
+  def _proxy(self):
+    length = int(self.headers.getheader('Content-Length') or 0)
+    body = self.rfile.read(length) if length else ''
+    headers = {}
+
+    for name in _FORWARDED_HEADERS:
+      value = self.headers.getheader(name)
+
+      if value is not None:
+        headers[name] = value
+
+    try:
+      status, reason, content_type, resp_body = self.server.fetch(self.command,
+                                                                  self.path,
+                                                                  body,
+                                                                  headers)
+    except (RuntimeError, HTTPException, socket_error) as e:
+      status, reason, content_type = 502, 'Bad Gateway', 'application/json'
+      resp_body = dumps({'ok': False, 'reason': str(e)})
+
+    self.send_response(status, reason)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(resp_body)))
+    self.end_headers()
+    self.wfile.write(resp_body)
+
+  do_GET = do_POST = do_PUT = do_DELETE = _proxy
+
+  def log_message(self, *args):
+    pass
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class ProxyServer(ThreadingMixIn, HTTPServer):
+  """An HTTP server which forwards vmpooler API requests to the vmpooler through the connection
+  pool of this process. Reads in "CACHED_ENDPOINTS" are cached per path and credentials for a
+  short TTL, and identical reads in flight share one request. Every other request is passed
+  through and then drops the cached reads it may have changed, so that a client always sees its
+  own changes. The list of templates is kept since no request changes it.
+
+  Args:
+    address |(str, int)| = The address and port to listen on.
+    upstream |str| = The host and port of the vmpooler. E.g. vmpooler.myhost.com:8080
+    ttl |float| = The number of seconds a read is served from the cache.
+
+  Raises:
+    |socket.error| = The address is not available.
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address, upstream, ttl=DEFAULT_TTL):
+
+    HTTPServer.__init__(self, address, _ProxyHandler)
+
+    self.upstream = upstream
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.passed = 0
+    self._cache = {}
+    self._generation = 0
+    self._lock = Lock()
+    self._flights = SingleFlight()
+
+  @property
+  def coalesced(self):
+    """The number of reads which shared a request already in flight."""
+
+    return self._flights.coalesced
+
+  def _forward(self, method, path, body, headers, endpoint):
+    """Forward a request to the vmpooler.
+
+    Args:
+      method |str| = Type of request. GET, POST, PUT or DELETE.
+      path |str| = The path of the url.
+      body |str| = The body of the request.
+      headers |{str:str}| = The headers of the request.
+      endpoint |str| = The request with names replaced by placeholders.
+
+    Returns:
+      |(int, str, str, str)| = The status, reason, content type and body of the response.
+
+    Raises:
+      |RuntimeError| = If the vmpooler URL can't be reached
+    """
+
+    resp = forward_request(method, self.upstream, path, body, headers, endpoint)
+
+    return (resp.status,
+            resp.reason,
+            resp.getheader('Content-Type', 'application/json'),
+            resp.read())
+
+  def invalidate(self):
+    """Drop every cached read which a change to VMs or tokens may make stale.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      self._generation += 1
+      self._cache = dict((key, entry) for key, entry in self._cache.items() if key[0] == '/vm')
+
+  def fetch(self, method, path, body, headers):
+    """Answer a request from the cache or the vmpooler.
+
+    Args:
+      method |str| = Type of request. GET, POST, PUT or DELETE.
+      path |str| = The path of the url. E.g. /vm/vm_name
+      body |str| = The body of the request.
+      headers |{str:str}| = The headers to forward.
+
+    Returns:
+      |(int, str, str, str)| = The status, reason, content type and body of the response.
+
+    Raises:
+      |RuntimeError| = If the vmpooler URL can't be reached
+    """
+
+    endpoint = _endpoint(method, path)
+
+    if endpoint not in CACHED_ENDPOINTS:
+      with self._lock:
+        self.passed += 1
+
+      try:
+        return self._forward(method, path, body, headers, endpoint)
+      finally:
+        if method != 'GET':
+          self.invalidate()
+
+    key = (path, headers.get('X-AUTH-TOKEN'), headers.get('Authorization'))
+
+    with self._lock:
+      entry = self._cache.get(key)
+      generation = self._generation
+
+      if entry is not None and entry[0] > time():
+        self.hits += 1
+        return entry[1]
+
+      self.misses += 1
+
+    def _fetch():
+      response = self._forward(method, path, body, headers, endpoint)
+
+      # Only successful reads are cached, and only if nothing changed while they were in flight.
+      if response[0] == 200:
+        with self._lock:
+          if self._generation == generation:
+            if len(self._cache) >= _PURGE_SIZE:
+              now = time()
+              self._cache = dict((k, e) for k, e in self._cache.items() if e[0] > now)
+
+            self._cache[key] = (time() + self.ttl, response)
+
+      return response
+
+    # Reads which arrive after a change must not share a read started before it.
+    return self._flights.do((generation, key), _fetch)
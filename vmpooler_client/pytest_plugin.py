@@ -0,0 +1,315 @@
+"""
+.. module:: vmpooler_client.pytest_plugin
+   :synopsis: A pytest plugin which leases VMs checked out once per session to the tests.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+
+Enable the plugin with "-p vmpooler_client.pytest_plugin" or by listing it in the
+"pytest_plugins" of a conftest. The VMs of the session are declared with the "vmpooler_pool" ini
+option or "--vmpooler-pool TEMPLATE[:COUNT]". A test marked with
+"@pytest.mark.vmpooler(TEMPLATE, ...)" gets a VM of each template from the "vmpooler_vms" fixture
+for the duration of the test.
+
+The main process checks out the VMs concurrently when the first test leases one, so "--help",
+"--collect-only" and runs which select no test needing VMs never contact the vmpooler. It leases
+them to pytest-xdist workers over a local connection, so the pool is shared rather than
+multiplied by the number of workers. Every VM is destroyed in parallel when the session
+finishes. The time each test waited for and held its VMs is recorded in the "user_properties" of
+its report (and so in JUnit XML) and the longest waits are listed in the terminal summary.
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import pytest
+from threading import Lock
+from time import time
+from conf_file import load_config, get_float
+from leasing import parse_needs, LeaseClient, LeasePool, LeaseServer
+from parallel import DEFAULT_WORKERS
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The default number of seconds a test waits for a VM before it errors.
+DEFAULT_LEASE_TIMEOUT = 1800.0
+
+#===================================================================================================
+# Classes: Private
+#===================================================================================================
+class _SessionPool(object):
+  """The VMs of the session, checked out when the first test leases one. A failed check out is
+  reported to every test that leases a VM afterwards.
+
+  Args:
+    needs |{str:int}| = The number of VMs to check out for each template.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, needs):
+
+    self.needs = needs
+    self._pool = None
+    self._error = None
+    self._closed = False
+    self._lock = Lock()
+
+  def _acquired(self):
+    """Check out the VMs of the session unless that has been done already.
+
+    Returns:
+      |LeasePool| = The pool of the session.
+
+    Raises:
+      |RuntimeError| = The VMs could not be checked out or the session has finished.
+    """
+
+    with self._lock:
+      if self._closed:
+        raise RuntimeError('The vmpooler VMs of the session have been destroyed already!')
+
+      if self._pool is None and self._error is None:
+        try:
+          settings = load_config()
+          self._pool = LeasePool(settings.get('vmpooler_hostname'),
+                                 settings.get('auth_token'),
+                                 max(int(get_float(settings, 'max_workers', DEFAULT_WORKERS)), 1))
+          self._pool.acquire(self.needs)
+        except RuntimeError as e:
+          self._error = str(e)
+
+      if self._error is not None:
+        raise RuntimeError(self._error)
+
+      return self._pool
+
+  def lease(self, template, timeout=None):
+    """Lease a VM, checking out the VMs of the session first. See "LeasePool.lease"."""
+
+    return self._acquired().lease(template, timeout)
+
+  def release(self, hostname):
+    """Return a leased VM. See "LeasePool.release"."""
+
+    self._pool.release(hostname)
+
+  def hostnames(self):
+    """List every VM checked out for the session. See "LeasePool.hostnames"."""
+
+    with self._lock:
+      pool = self._pool
+
+    return {} if pool is None else pool.hostnames()
+
+  def close(self):
+    """Destroy every VM checked out for the session. See "LeasePool.close"."""
+
+    with self._lock:
+      pool = self._pool
+      self._closed = True
+
+    return [] if pool is None else pool.close()
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _lease_timings(terminalreporter):
+  """Collect the lease timings of every test from the teardown reports, which are the only
+  reports created after the VMs are released.
+
+  Args:
+    terminalreporter |_pytest.terminal.TerminalReporter| = The terminal reporter.
+
+  Returns:
+    |[(float, float, str, str)]| = The wait, hold, test ID and VMs of every test with a lease.
+
+  Raises:
+    |None|
+  """
+
+  timings = []
+
+  for reports in terminalreporter.stats.values():
+    for report in reports:
+      if getattr(report, 'when', None) != 'teardown':
+        continue
+
+      properties = dict(getattr(report, 'user_properties', ()))
+
+      if 'vmpooler_lease_wait' in properties:
+        timings.append((properties['vmpooler_lease_wait'],
+                        properties.get('vmpooler_lease_held', 0.0),
+                        report.nodeid,
+                        properties.get('vmpooler_vms', '')))
+
+  return sorted(timings, reverse=True)
+
+
+#===================================================================================================
+# Functions: Public (Hooks)
+#===================================================================================================
+def pytest_addoption(parser):
+  group = parser.getgroup('vmpooler', 'VMs leased from the vmpooler')
+  group.addoption('--vmpooler-pool',
+                  action='append',
+                  default=[],
+                  metavar='TEMPLATE[:COUNT]',
+                  help='Check out VMs of a template for the session. May be repeated.')
+  group.addoption('--vmpooler-lease-timeout',
+                  type=float,
+                  default=DEFAULT_LEASE_TIMEOUT,
+                  metavar='SECONDS',
+                  help='How long a test waits for a VM to be released')
+  group.addoption('--vmpooler-durations',
+                  type=int,
+                  default=10,
+                  metavar='N',
+                  help='Show the N longest lease waits (0 for all)')
+  parser.addini('vmpooler_pool',
+                type='linelist',
+                help='VMs to check out for the session, one TEMPLATE[:COUNT] per line')
+
+
+def pytest_configure(config):
+  config.addinivalue_line('markers',
+                          'vmpooler(*templates): lease a VM of each template to the test '
+                          'through the "vmpooler_vms" fixture')
+
+  workerinput = getattr(config, 'workerinput', None)
+
+  # A pytest-xdist worker leases from the main process.
+  if workerinput is not None:
+    if 'vmpooler_lease_address' in workerinput:
+      config._vmpooler_leaser = LeaseClient(workerinput['vmpooler_lease_address'],
+                                            workerinput['vmpooler_lease_authkey'])
+    return
+
+  try:
+    needs = parse_needs(config.getini('vmpooler_pool') + config.getoption('vmpooler_pool'))
+  except ValueError as e:
+    raise pytest.UsageError(str(e))
+
+  # Nothing is checked out until a test leases a VM.
+  config._vmpooler_pool = _SessionPool(needs)
+  config._vmpooler_server = None
+  config._vmpooler_leaser = config._vmpooler_pool
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+  config = node.config
+
+  # The server is only needed once pytest-xdist starts workers.
+  if config._vmpooler_server is None:
+    config._vmpooler_server = LeaseServer(config._vmpooler_pool)
+
+  node.workerinput['vmpooler_lease_address'] = config._vmpooler_server.address
+  node.workerinput['vmpooler_lease_authkey'] = config._vmpooler_server.authkey
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_sessionfinish(session):
+  config = session.config
+  pool = getattr(config, '_vmpooler_pool', None)
+
+  if pool is not None:
+    if config._vmpooler_server is not None:
+      config._vmpooler_server.close()
+
+    config._vmpooler_released = len(pool.hostnames())
+    config._vmpooler_release_errors = pool.close()
+    config._vmpooler_pool = None
+
+
+def pytest_unconfigure(config):
+  leaser = getattr(config, '_vmpooler_leaser', None)
+
+  if isinstance(leaser, LeaseClient):
+    leaser.close()
+
+  # The session did not finish, e.g. collection was interrupted.
+  if getattr(config, '_vmpooler_pool', None) is not None:
+    if config._vmpooler_server is not None:
+      config._vmpooler_server.close()
+
+    config._vmpooler_pool.close()
+
+
+def pytest_terminal_summary(terminalreporter):
+  config = terminalreporter.config
+
+  if getattr(config, 'workerinput', None) is not None or not hasattr(config, '_vmpooler_server'):
+    return
+
+  timings = _lease_timings(terminalreporter)
+  count = config.getoption('vmpooler_durations')
+
+  if timings:
+    terminalreporter.write_sep('=', 'vmpooler lease waits')
+
+    for wait, held, nodeid, vms in (timings[:count] if count else timings):
+      terminalreporter.write_line('{:.2f}s wait {:.2f}s held {} ({})'.format(wait,
+                                                                             held,
+                                                                             nodeid,
+                                                                             vms))
+
+    terminalreporter.write_line('{} leases, {:.2f}s waiting in total'.format(
+      len(timings), sum(wait for wait, _, _, _ in timings)))
+
+  errors = getattr(config, '_vmpooler_release_errors', [])
+
+  if getattr(config, '_vmpooler_released', 0):
+    terminalreporter.write_line('Destroyed {} of {} vmpooler VMs'.format(
+      config._vmpooler_released - len(errors), config._vmpooler_released))
+
+  for hostname, error in errors:
+    terminalreporter.write_line('Could not destroy {}: {}'.format(hostname, error), red=True)
+
+
+#===================================================================================================
+# Fixtures
+#===================================================================================================
+@pytest.fixture
+def vmpooler_vms(request):
+  """The hostnames of the VMs leased to the test, one for each template of its "vmpooler"
+  marker. They are returned to the pool after the test.
+  """
+
+  marker = request.node.get_closest_marker('vmpooler')
+
+  if marker is None or not marker.args:
+    pytest.fail('The "vmpooler_vms" fixture needs a @pytest.mark.vmpooler(TEMPLATE, ...) marker!')
+
+  leaser = getattr(request.config, '_vmpooler_leaser', None)
+
+  if leaser is None:
+    raise pytest.UsageError('This pytest-xdist worker was not given the address of the vmpooler '
+                            'lease server! Enable "vmpooler_client.pytest_plugin" with "-p" or '
+                            'in an ini file so that the main process loads it too.')
+
+  timeout = request.config.getoption('vmpooler_lease_timeout')
+  hostnames = []
+  start = time()
+
+  try:
+    for template in marker.args:
+      hostnames.append(leaser.lease(template, timeout))
+  except RuntimeError:
+    for hostname in hostnames:
+      leaser.release(hostname)
+    raise
+
+  leased = time()
+  request.node.user_properties.append(('vmpooler_lease_wait', round(leased - start, 3)))
+  request.node.user_properties.append(('vmpooler_vms', ' '.join(hostnames)))
+
+  yield hostnames
+
+  for hostname in hostnames:
+    leaser.release(hostname)
+
+  request.node.user_properties.append(('vmpooler_lease_held', round(time() - leased, 3)))
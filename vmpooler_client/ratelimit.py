@@ -0,0 +1,233 @@
+"""
+.. module:: vmpooler_client.ratelimit
+   :synopsis: Token-bucket rate limiting for requests made to the vmpooler API.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from threading import Lock
+from time import time, sleep
+from jsoncodec import loads, dumps
+
+try:
+  from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+  # Windows has no "flock". Buckets are only shared between threads there.
+  flock = None
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def parse_rates(rates):
+  """Parse per-endpoint rates from the configuration file. The rates may be a dictionary or a
+  string such as "DELETE /vm/<hostname>=5;POST /vm/<template>=2".
+
+  Args:
+    rates |{str:float}| or |str| = The per-endpoint rates in requests per second.
+
+  Returns:
+    |{str:float}| = The rates keyed by endpoint.
+
+  Raises:
+    |RuntimeError| = The rates are malformed.
+  """
+
+  if isinstance(rates, dict):
+    items = rates.items()
+  else:
+    items = [entry.rpartition('=')[::2] for entry in rates.split(';') if entry.strip()]
+
+  try:
+    return dict((endpoint.strip(), float(rate)) for endpoint, rate in items)
+  except ValueError:
+    raise RuntimeError('Endpoint rate limits must be given as "ENDPOINT=RATE;ENDPOINT=RATE"!')
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class TokenBucket(object):
+  """A token bucket shared by every thread in the process. Callers reserve a token and are told
+  how long to wait for it, so waiting never happens while the lock is held and waiters are served
+  in order.
+
+  Args:
+    rate |float| = The number of tokens added per second.
+    burst |float| = The maximum number of tokens the bucket holds.
+
+  Raises:
+    |ValueError| = The rate is not positive.
+  """
+
+  def __init__(self, rate, burst=1.0):
+
+    if rate <= 0:
+      raise ValueError('The rate limit must be greater than "0"!')
+
+    self.rate = float(rate)
+    self.burst = max(float(burst), 1.0)
+    self._tokens = self.burst
+    self._stamp = None
+    self._lock = Lock()
+
+  def _refill_and_take(self, tokens, stamp, now):
+    """Refill a bucket state for the time elapsed and take one token from it.
+
+    Args:
+      tokens |float| = The tokens in the bucket at "stamp". Negative when reserved ahead.
+      stamp |float| = The time the state was last updated or "None" if never.
+      now |float| = The current time.
+
+    Returns:
+      |(float, float)| = The tokens left and the seconds to wait before using the token.
+
+    Raises:
+      |None|
+    """
+
+    if stamp is not None:
+      tokens = min(self.burst, tokens + max(now - stamp, 0) * self.rate)
+
+    tokens -= 1
+
+    return tokens, max(-tokens / self.rate, 0)
+
+  def reserve(self, now):
+    """Reserve a token.
+
+    Args:
+      now |float| = The current time.
+
+    Returns:
+      |float| = The number of seconds to wait before the token may be used.
+
+    Raises:
+      |None|
+    """
+
+    with self._lock:
+      self._tokens, wait = self._refill_and_take(self._tokens, self._stamp, now)
+      self._stamp = now
+
+    return wait
+
+
+class SharedTokenBucket(TokenBucket):
+  """A token bucket shared by every process on the host through a small state file. The file is
+  locked while the bucket state is updated.
+
+  Args:
+    path |str| = The state file shared by the processes.
+    name |str| = The name of the bucket within the state file.
+    rate |float| = The number of tokens added per second.
+    burst |float| = The maximum number of tokens the bucket holds.
+
+  Raises:
+    |ValueError| = The rate is not positive.
+  """
+
+  def __init__(self, path, name, rate, burst=1.0):
+
+    super(SharedTokenBucket, self).__init__(rate, burst)
+
+    self._path = path
+    self._name = name
+
+  def reserve(self, now):
+    """Reserve a token.
+
+    Args:
+      now |float| = The current time.
+
+    Returns:
+      |float| = The number of seconds to wait before the token may be used.
+
+    Raises:
+      |IOError| = The state file could not be written.
+    """
+
+    with self._lock:
+      with open(self._path, 'a+') as f:
+        flock(f.fileno(), LOCK_EX)
+
+        try:
+          f.seek(0)
+
+          try:
+            state = loads(f.read() or '{}')
+          except ValueError:
+            # A corrupt state file only costs the banked tokens.
+            state = {}
+
+          tokens, stamp = state.get(self._name, (self.burst, None))
+          tokens, wait = self._refill_and_take(tokens, stamp, now)
+          state[self._name] = (tokens, now)
+
+          f.seek(0)
+          f.truncate()
+          f.write(dumps(state))
+          f.flush()
+        finally:
+          flock(f.fileno(), LOCK_UN)
+
+    return wait
+
+
+class RateLimiter(object):
+  """Limit requests with a global bucket and optional per-endpoint buckets.
+
+  Args:
+    rate |float| = The global rate in requests per second or "None" for no global limit.
+    endpoint_rates |{str:float}| = Rates for individual endpoints keyed by endpoint.
+      E.g. {"DELETE /vm/<hostname>": 5}
+    burst |float| = The number of requests that may be sent back to back.
+    state_file |str| = A file used to share the buckets between processes on this host. The
+      buckets are only shared between threads if "None" or the platform has no "flock".
+
+  Raises:
+    |ValueError| = A rate is not positive.
+  """
+
+  def __init__(self, rate=None, endpoint_rates=None, burst=1.0, state_file=None):
+
+    def _bucket(name, bucket_rate):
+      if state_file and flock:
+        return SharedTokenBucket(state_file, name, bucket_rate, burst)
+
+      return TokenBucket(bucket_rate, burst)
+
+    self._global = _bucket('*', rate) if rate else None
+    self._endpoints = dict((endpoint, _bucket(endpoint, endpoint_rate))
+                           for endpoint, endpoint_rate in (endpoint_rates or {}).items())
+
+  def acquire(self, endpoint):
+    """Block until a request to the endpoint is allowed.
+
+    Args:
+      endpoint |str| = The endpoint of the request. E.g. "DELETE /vm/<hostname>"
+
+    Returns:
+      |float| = The number of seconds spent waiting.
+
+    Raises:
+      |None|
+    """
+
+    now = time()
+    wait = 0
+
+    if self._global:
+      wait = self._global.reserve(now)
+
+    if endpoint in self._endpoints:
+      wait = max(wait, self._endpoints[endpoint].reserve(now))
+
+    if wait > 0:
+      sleep(wait)
+
+    return wait
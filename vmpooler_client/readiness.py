@@ -0,0 +1,239 @@
+"""
+.. module:: vmpooler_client.readiness
+   :synopsis: Wait for checked-out VMs to resolve and accept TCP connections.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import errno
+import socket
+from select import select
+from threading import Thread
+from time import sleep, time
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# Errors from a non-blocking "connect_ex" which mean the connection is still being established.
+_IN_PROGRESS = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+
+# The most seconds the probes wait before checking whether a lookup has finished.
+_LOOKUP_POLL = 0.05
+
+#===================================================================================================
+# Classes: Private
+#===================================================================================================
+class _Probe(object):
+  """The readiness state of a single host."""
+
+  __slots__ = ('host', 'address', 'resolving', 'sock', 'attempt_started', 'next_attempt',
+               'ready_after')
+
+  def __init__(self, host):
+
+    self.host = host
+    self.address = None
+    self.resolving = False
+    self.sock = None
+    self.attempt_started = None
+    self.next_attempt = 0
+    self.ready_after = None
+
+  def close(self):
+    """Close the socket of the current attempt."""
+
+    if self.sock is not None:
+      self.sock.close()
+      self.sock = None
+
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _resolve(probe, port, interval):
+  """Resolve the host of a probe. This runs in a thread of its own so that a slow lookup never
+  holds up the other probes.
+
+  Args:
+    probe |_Probe| = The host to probe.
+    port |int| = The TCP port to connect to.
+    interval |float| = The seconds to wait before retrying a failed lookup.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  try:
+    family, _, _, _, address = socket.getaddrinfo(probe.host, port, 0, socket.SOCK_STREAM)[0]
+    probe.address = (family, address)
+  except socket.error:
+    # The DNS record may not be up yet for a fresh VM.
+    probe.next_attempt = time() + interval
+  finally:
+    probe.resolving = False
+
+
+def _start_lookup(probe, port, interval):
+  """Start resolving the host of a probe in the background.
+
+  Args:
+    probe |_Probe| = The host to probe.
+    port |int| = The TCP port to connect to.
+    interval |float| = The seconds to wait before retrying a failed lookup.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  probe.resolving = True
+  lookup = Thread(target=_resolve, args=(probe, port, interval))
+
+  # A lookup cannot be cancelled, so one still running at the deadline is left to finish alone.
+  lookup.daemon = True
+  lookup.start()
+
+
+def _start_attempt(probe, port, now, interval):
+  """Start a non-blocking connection to the resolved address of a host.
+
+  Args:
+    probe |_Probe| = The host to probe.
+    port |int| = The TCP port to connect to.
+    now |float| = The current time.
+    interval |float| = The seconds to wait before retrying a failed attempt.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  try:
+    probe.sock = socket.socket(probe.address[0], socket.SOCK_STREAM)
+    probe.sock.setblocking(0)
+    result = probe.sock.connect_ex(probe.address[1])
+  except socket.error:
+    # The network may not be up yet for a fresh VM.
+    probe.close()
+    probe.next_attempt = now + interval
+    return
+
+  if result not in _IN_PROGRESS:
+    probe.close()
+    probe.next_attempt = now + interval
+  else:
+    probe.attempt_started = now
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def fqdn(hostname, domain):
+  """Build the fully qualified domain name of a VM.
+
+  Args:
+    hostname |str| = The hostname returned by the vmpooler.
+    domain |str| = The domain returned by the vmpooler. May be empty.
+
+  Returns:
+    |str| = The fully qualified domain name.
+
+  Raises:
+    |None|
+  """
+
+  if not domain or hostname.endswith('.' + domain):
+    return hostname
+
+  return '{}.{}'.format(hostname, domain)
+
+
+def wait_ready(hosts, port=22, timeout=300, interval=1.0):
+  """Probe every host concurrently until each accepts a TCP connection on the given port or the
+  deadline passes. Hosts are resolved in background threads. Unresolvable hosts and refused
+  connections are retried every "interval" seconds, and an attempt that has not connected within
+  "interval" seconds is abandoned and retried.
+
+  Args:
+    hosts |[str]| = The hostnames or addresses to probe.
+    port |int| = The TCP port to probe. E.g. 22 for SSH.
+    timeout |float| = The number of seconds to wait for every host to become ready.
+    interval |float| = The number of seconds between attempts for a host.
+
+  Returns:
+    |{str:float}| = The seconds each host took to become ready, or "None" for hosts which did
+      not become ready before the deadline.
+
+  Raises:
+    |None|
+  """
+
+  start = time()
+  deadline = start + timeout
+  probes = [_Probe(host) for host in hosts]
+
+  try:
+    while True:
+      now = time()
+      pending = [p for p in probes if p.ready_after is None]
+
+      if not pending or now >= deadline:
+        break
+
+      for probe in pending:
+        if probe.sock is not None and now - probe.attempt_started >= interval:
+          probe.close()
+          probe.next_attempt = now
+
+        if probe.sock is None and not probe.resolving and now >= probe.next_attempt:
+          if probe.address is None:
+            _start_lookup(probe, port, interval)
+          else:
+            _start_attempt(probe, port, now, interval)
+
+      connecting = [p for p in pending if p.sock is not None]
+      idle = [p for p in pending if p.sock is None and not p.resolving]
+      next_attempt = min([p.next_attempt for p in idle] or [deadline])
+      wait = max(min(deadline, next_attempt, now + interval) - now, 0)
+
+      if any(p.resolving for p in pending):
+        wait = min(wait, _LOOKUP_POLL)
+
+      # Windows cannot "select" on an empty set of sockets.
+      if not connecting:
+        sleep(wait)
+        continue
+
+      _, writable, errored = select([], [p.sock for p in connecting], [p.sock for p in connecting],
+                                    wait)
+      done = set(writable) | set(errored)
+      now = time()
+
+      for probe in connecting:
+        if probe.sock not in done:
+          continue
+
+        if probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+          probe.ready_after = now - start
+        else:
+          probe.next_attempt = now + interval
+
+        probe.close()
+  finally:
+    for probe in probes:
+      probe.close()
+
+  return dict((p.host, p.ready_after) for p in probes)
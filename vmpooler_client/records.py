@@ -0,0 +1,138 @@
+"""
+.. module:: vmpooler_client.records
+   :synopsis: A compact record of the state of a VM for commands that handle many VMs.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _intern(value):
+  """Intern a string so that every record with the same value shares one copy.
+
+  Args:
+    value |str| = The string. The json module returns unicode strings which cannot be interned,
+      so they are encoded as UTF-8 first.
+
+  Returns:
+    |str| = The interned string or "None" if the value is "None".
+
+  Raises:
+    |None|
+  """
+
+  if value is None:
+    return None
+  elif isinstance(value, unicode):
+    value = value.encode('utf-8')
+
+  return intern(value)
+
+
+def _number(value, convert):
+  """Parse a numeric field returned by the vmpooler, which may be a number or a string.
+
+  Args:
+    value |obj| = The value of the field.
+    convert |type| = The numeric type to convert strings to. E.g. "float"
+
+  Returns:
+    |int| or |float| = The number or "None" if the value is missing or not a number.
+
+  Raises:
+    |None|
+  """
+
+  if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+    return value
+
+  try:
+    return convert(value)
+  except (TypeError, ValueError):
+    return None
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class VmRecord(object):
+  """The state of a VM with its numeric fields parsed once. Records use "__slots__" and share
+  their template, state and domain strings, so tens of thousands of them take a fraction of the
+  memory of the dictionaries returned by "info_vm" and sort without re-parsing any fields.
+
+  Args:
+    hostname |str| = The hostname of the VM.
+    template |str| = The template the VM was created from.
+    state |str| = The state of the VM. E.g. "running"
+    domain |str| = The domain of the VM.
+    running |float| = The number of hours the VM has been running.
+    lifetime |int| = The lifetime of the VM in hours.
+
+  Raises:
+    |None|
+  """
+
+  __slots__ = ('hostname', 'template', 'state', 'domain', 'running', 'lifetime')
+
+  def __init__(self, hostname, template=None, state=None, domain=None, running=None,
+               lifetime=None):
+
+    self.hostname = hostname
+    self.template = _intern(template)
+    self.state = _intern(state)
+    self.domain = _intern(domain)
+    self.running = _number(running, float)
+    self.lifetime = _number(lifetime, int)
+
+  @classmethod
+  def from_info(cls, hostname, info):
+    """Build a record from the VM information returned by "info_vm".
+
+    Args:
+      hostname |str| = The hostname of the VM.
+      info |{str:str}| = The VM information.
+
+    Returns:
+      |VmRecord| = The record.
+
+    Raises:
+      |None|
+    """
+
+    return cls(hostname,
+               info.get('template'),
+               info.get('state'),
+               info.get('domain'),
+               info.get('running'),
+               info.get('lifetime'))
+
+  @property
+  def remaining(self):
+    """The number of hours until the VM is destroyed or "None" if it is not known."""
+
+    if self.running is None or self.lifetime is None:
+      return None
+
+    return self.lifetime - self.running
+
+  def as_dict(self):
+    """Return the fields of the record as a dictionary.
+
+    Returns:
+      |{str:obj}| = The fields keyed by name.
+
+    Raises:
+      |None|
+    """
+
+    return dict((name, getattr(self, name)) for name in self.__slots__)
+
+  def __repr__(self):
+
+    return 'VmRecord({!r}, template={!r}, running={!r}, lifetime={!r})'.format(self.hostname,
+                                                                              self.template,
+                                                                              self.running,
+                                                                              self.lifetime)
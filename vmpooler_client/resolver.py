@@ -0,0 +1,323 @@
+"""
+.. module:: vmpooler_client.resolver
+   :synopsis: Cache DNS lookups and connect to dual-stack hosts by racing their addresses.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import errno
+import os
+import select
+import socket
+from os.path import dirname
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+from jsoncodec import loads, dumps
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The default number of seconds a lookup is cached. The system resolver does not report the TTL
+# of the records, so a fixed one is used.
+DEFAULT_TTL = 300.0
+
+# The number of seconds to wait on a connection attempt before racing the next address, as
+# recommended by RFC 8305 ("Happy Eyeballs").
+ATTEMPT_DELAY = 0.25
+
+# The results of a non-blocking "connect_ex" which mean the connection is still being set up.
+_IN_PROGRESS = frozenset([errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY])
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _interleave(addrs, preferred):
+  """Order addresses so that consecutive attempts alternate between address families, starting
+  with the preferred family.
+
+  Args:
+    addrs |[(int, tuple)]| = The family and socket address of each address in resolver order.
+    preferred |int| = The family to try first or "None" to keep the resolver order.
+
+  Returns:
+    |[(int, tuple)]| = The ordered addresses.
+
+  Raises:
+    |None|
+  """
+
+  families = []
+  by_family = {}
+
+  for family, sockaddr in addrs:
+    if family not in by_family:
+      families.append(family)
+      by_family[family] = []
+
+    by_family[family].append((family, sockaddr))
+
+  if preferred in by_family:
+    families.remove(preferred)
+    families.insert(0, preferred)
+
+  ordered = []
+
+  while any(by_family.values()):
+    for family in families:
+      if by_family[family]:
+        ordered.append(by_family[family].pop(0))
+
+  return ordered
+
+
+def _race(addrs, timeout):
+  """Connect to the first address that accepts. A new attempt is started whenever the previous
+  one fails or has not succeeded within "ATTEMPT_DELAY", without abandoning the attempts already
+  in flight.
+
+  Args:
+    addrs |[(int, tuple)]| = The family and socket address of each address in the order to try.
+    timeout |float| = The seconds to wait for a connection or "None" to wait indefinitely.
+
+  Returns:
+    |(socket, int)| = The connected socket and its address family.
+
+  Raises:
+    |socket.error| = No address accepted the connection.
+    |socket.timeout| = No address accepted the connection in time.
+  """
+
+  deadline = None if timeout is None else time() + timeout
+  queue = list(addrs)
+  pending = {}
+  error = socket.error('No addresses to connect to!')
+  next_attempt = time()
+
+  try:
+    while queue or pending:
+      now = time()
+
+      if queue and (now >= next_attempt or not pending):
+        family, sockaddr = queue.pop(0)
+
+        try:
+          sock = socket.socket(family, socket.SOCK_STREAM)
+        except socket.error as e:
+          # The address family is not supported by this host.
+          error = e
+          continue
+
+        sock.setblocking(0)
+        code = sock.connect_ex(sockaddr)
+
+        if code and code not in _IN_PROGRESS:
+          sock.close()
+          error = socket.error(code, os.strerror(code))
+          continue
+
+        pending[sock] = family
+        next_attempt = time() + ATTEMPT_DELAY
+        continue
+
+      wait = max(next_attempt - now, 0) if queue else None
+
+      if deadline is not None:
+        if now >= deadline:
+          raise socket.timeout('timed out')
+
+        wait = deadline - now if wait is None else min(wait, deadline - now)
+
+      _, writable, failed = select.select([], list(pending), list(pending), wait)
+
+      for sock in set(writable + failed):
+        family = pending.pop(sock)
+        code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+        if code == 0:
+          return (sock, family)
+
+        sock.close()
+        error = socket.error(code, os.strerror(code))
+
+        # Start the next attempt at once rather than waiting out the delay.
+        next_attempt = time()
+
+    raise error
+  finally:
+    for sock in pending:
+      sock.close()
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class Resolver(object):
+  """Resolve hosts once per TTL and connect to them by racing their addresses. The family of
+  the address that won is remembered and tried first next time, so a host with a broken IPv6
+  route costs one "ATTEMPT_DELAY" at most once per TTL. Lookups and preferred families can be
+  shared with other processes through a state file, which is best-effort like the VM cache.
+
+  Args:
+    ttl |float| = The number of seconds a lookup is cached. Zero disables caching.
+    state_file |str| = A file used to share the cache between processes.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, ttl=DEFAULT_TTL, state_file=None):
+
+    self.ttl = ttl
+    self.state_file = state_file
+    self.lookups = 0
+    self._entries = {}
+    self._lock = Lock()
+
+    if state_file:
+      try:
+        with open(state_file, 'r') as f:
+          self._entries = loads(f.read())
+      except (IOError, ValueError):
+        pass
+
+      if not isinstance(self._entries, dict):
+        self._entries = {}
+
+  def _save(self):
+    """Write the cache to the state file if there is one. Failures are ignored.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    if not self.state_file:
+      return
+
+    with self._lock:
+      content = dumps(self._entries)
+
+    try:
+      fd, tmp_path = mkstemp(dir=dirname(self.state_file) or '.', prefix='.vmpooler_client_dns')
+
+      with os.fdopen(fd, 'w') as f:
+        f.write(content)
+
+      os.rename(tmp_path, self.state_file)
+    except (IOError, OSError):
+      pass
+
+  def _lookup(self, host, port, refresh=False):
+    """Return the cache entry of a host, resolving it if it is missing or expired.
+
+    Args:
+      host |str| = The hostname or address.
+      port |int| = The port.
+      refresh |bln| = Resolve the host even if it is cached.
+
+    Returns:
+      |({str:obj}, bln)| = The entry and whether it came from the cache.
+
+    Raises:
+      |socket.gaierror| = The host could not be resolved.
+    """
+
+    key = '{}:{}'.format(host, port)
+    now = time()
+
+    with self._lock:
+      entry = self._entries.get(key)
+
+    if entry is not None and not refresh and entry['expires'] > now:
+      return (entry, True)
+
+    addrs = []
+
+    for family, _, _, _, sockaddr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+      if [family, list(sockaddr)] not in addrs:
+        addrs.append([family, list(sockaddr)])
+
+    preferred = entry.get('preferred') if entry else None
+    entry = {'expires': now + self.ttl, 'addrs': addrs, 'preferred': preferred}
+
+    with self._lock:
+      self.lookups += 1
+      self._entries[key] = entry
+
+    if self.ttl > 0:
+      self._save()
+
+    return (entry, False)
+
+  def resolve(self, host, port):
+    """Resolve a host.
+
+    Args:
+      host |str| = The hostname or address.
+      port |int| = The port.
+
+    Returns:
+      |[(int, tuple)]| = The family and socket address of each address in the order they are
+        tried when connecting.
+
+    Raises:
+      |socket.gaierror| = The host could not be resolved.
+    """
+
+    entry, _ = self._lookup(host, port)
+
+    return _interleave([(family, tuple(sockaddr)) for family, sockaddr in entry['addrs']],
+                       entry['preferred'])
+
+  def connect(self, host, port, timeout=None):
+    """Connect to a host. If every cached address fails the host is resolved again, since its
+    addresses may have changed.
+
+    Args:
+      host |str| = The hostname or address.
+      port |int| = The port.
+      timeout |float| = The seconds to wait for the connection and the timeout of the socket,
+        or "None" to block.
+
+    Returns:
+      |socket| = The connected socket.
+
+    Raises:
+      |socket.gaierror| = The host could not be resolved.
+      |socket.error| = The host could not be connected to.
+    """
+
+    entry, cached = self._lookup(host, port)
+
+    while True:
+      addrs = _interleave([(family, tuple(sockaddr)) for family, sockaddr in entry['addrs']],
+                          entry['preferred'])
+
+      try:
+        sock, family = _race(addrs, timeout)
+        break
+      except socket.timeout:
+        raise
+      except socket.error:
+        if not cached:
+          raise
+
+        entry, cached = self._lookup(host, port, refresh=True)
+
+    sock.settimeout(timeout)
+
+    if entry['preferred'] != family:
+      with self._lock:
+        entry['preferred'] = family
+
+      self._save()
+
+    return sock
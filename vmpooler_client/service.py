@@ -1,6 +1,6 @@
 """
 .. module:: vmpooler_client.service
-   :synopsis: Functions for communicating with the vmpooler API.
+   :synopsis: A session and functions for communicating with the vmpooler API.
    :platform: Unix, Linux, Windows
    :license: BSD
 .. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
@@ -10,46 +10,334 @@
 #===================================================================================================
 # Imports
 #===================================================================================================
-from httplib import HTTPConnection
-from socket import gaierror
-from json import loads
+from httplib import HTTPException
+from socket import error as socket_error, gaierror, SHUT_RDWR
 from base64 import standard_b64encode
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+from connpool import ConnectionPool
+from hedging import CancelledError, HedgePolicy
+from jsoncodec import loads, dumps
+from parallel import run_parallel, DEFAULT_WORKERS
+from ratelimit import RateLimiter
+from records import VmRecord
+from resolver import Resolver
+from singleflight import SingleFlight
+import hooks
+import metrics
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# Idle keep-alive connections to the vmpooler, reused by idempotent requests. Lookups of the
+# vmpooler are cached for the life of the process unless "enable_dns_cache" says otherwise.
+_pool = ConnectionPool(resolver=Resolver())
+
+# Requests which may be retried on a new connection if a reused connection turns out to be
+# closed. A POST is never sent on a reused connection since it may not be safe to send twice.
+_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+# The hedging policy for idempotent reads. Hedging is disabled while this is "None".
+_hedge_policy = None
+
+# The client-side rate limiter. Requests are not limited while this is "None".
+_rate_limiter = None
+
+# Sends requests in place of "_send_request", e.g. to record or replay them. Requests go to the
+# vmpooler while this is "None".
+_transport = None
+
+# Identical concurrent reads of the module functions share a single request. The keys start with
+# the function name.
+_single_flight = SingleFlight(on_coalesced=lambda key: metrics.record_coalesced(key[0]))
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class PoolDrainedError(RuntimeError):
+  """The vmpooler has no VMs ready for a requested template. Retrying later may succeed."""
+
+  pass
+
+
+class VmNotFoundError(RuntimeError):
+  """The vmpooler does not know the VM. It may have been destroyed already."""
+
+  pass
+
+
+#===================================================================================================
+# Classes: Private
+#===================================================================================================
+class _Response(object):
+  """An HTTP response whose body has already been read, so that the connection is free as soon
+  as the request returns.
+
+  Args:
+    status |int| = The HTTP status code.
+    reason |str| = The HTTP reason phrase.
+    headers |[(str, str)]| = The response headers.
+    body |str| = The response body.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, status, reason, headers, body):
+
+    self.status = status
+    self.reason = reason
+    self._headers = dict((name.lower(), value) for name, value in headers)
+    self._body = body
+
+  def read(self):
+    """Return the response body."""
+
+    return self._body
+
+  def getheader(self, name, default=None):
+    """Return the value of a response header."""
+
+    return self._headers.get(name.lower(), default)
+
+  def close(self):
+    """Release the response. The body is already read so there is nothing to do."""
+
+    pass
+
 
 #===================================================================================================
 # Functions: Private
 #===================================================================================================
-def _make_request(method, host, path, body='', headers={}):
+def _coalesced(func):
   """
-  Makes an HTTP request.
+  Decorate an idempotent read of "VmpoolerClient" so that concurrent calls for the same vmpooler,
+  token and arguments share one request and one parsed result. Callers must not modify the
+  shared result.
+
+  Args:
+    func |func| = The method to decorate.
+
+  Returns:
+    |func| = The decorated method.
+
+  Raises:
+    |None|
+  """
+
+  @wraps(func)
+  def wrapper(self, *args, **kwargs):
+    key = (func.__name__,
+           self.vmpooler_hostname,
+           self.auth_token,
+           args,
+           tuple(sorted(kwargs.items())))
+
+    return self._single_flight.do(key, lambda: func(self, *args, **kwargs))
+
+  return wrapper
+
+
+def _abort(conn):
+  """
+  Stop the request in flight on a connection from another thread. The socket is shut down rather
+  than closed, since closing it would not wake a thread blocked on the response, and the thread
+  making the request closes the connection itself.
+
+  Args:
+    conn |HTTPConnection| = The connection.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  sock = conn.sock
+
+  if sock is not None:
+    try:
+      sock.shutdown(SHUT_RDWR)
+    except socket_error:
+      pass
+
+
+def _send_request(method, host, path, body, headers, timings, pool=None, cancellation=None):
+  """
+  Sends an HTTP request and reads the whole response. Idempotent requests reuse idle keep-alive
+  connections from the pool.
 
   Args:
     method |str| = Type of request. GET, POST, PUT or DELETE.
     host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
     path |str| = The path of the url. E.g. /vm/vm_name
     body |str| = The body data to send with the request.
-    headers |{str:str}| = Optional headers for the request.
+    headers |{str:str}| = Headers for the request.
+    timings |{str:float}| = Populated with the seconds elapsed at the end of each phase.
+    pool |ConnectionPool| = The connection pool to use. Defaults to the pool of the module.
+    cancellation |hedging.Cancellation| = Stops the request while it is in flight if it is
+      cancelled. The connection of a cancelled request is closed rather than pooled.
 
   Returns:
-    |HTTPResponse| = Response from the request.
+    |_Response| = Response from the request.
 
   Raises:
+    |hedging.CancelledError| = The request was cancelled.
     |RuntimeError| = If the vmpooler URL can't be reached
   """
 
+  if pool is None:
+    pool = _pool
+
+  def _cancelled():
+    return cancellation is not None and cancellation.cancelled
+
+  start = time()
+  pooled = method in _IDEMPOTENT_METHODS
+
   try:
-    conn = HTTPConnection(host)
-    conn.request(method, path, body, headers)
-    resp = conn.getresponse()
+    while True:
+      conn, connected = pool.acquire(host) if pooled else pool.open(host)
+
+      try:
+        if not connected:
+          conn.connect()
+
+        timings['connect'] = time() - start
+
+        if cancellation is not None and not cancellation.attach(lambda: _abort(conn)):
+          conn.close()
+          raise CancelledError('The request to {} was cancelled!'.format(host))
+
+        conn.request(method, path, body, headers)
+        resp = conn.getresponse()
+        break
+      except (HTTPException, socket_error):
+        conn.close()
+
+        # The server closed the idle connection. Retry on another one. Requests which are not
+        # idempotent are never retried since the server may have acted on them.
+        if not (connected and pooled) or _cancelled():
+          raise
+
+    timings['first_byte'] = time() - start
+    resp_body = resp.read()
+    timings['total'] = time() - start
+
+    # A response cut short by the cancellation must not be used, nor its connection reused.
+    if cancellation is not None and not cancellation.detach():
+      conn.close()
+      raise CancelledError('The request to {} was cancelled!'.format(host))
 
-    return resp
+    if pooled and not resp.will_close:
+      pool.release(host, conn)
+    else:
+      conn.close()
+
+    return _Response(resp.status, resp.reason, resp.getheaders(), resp_body)
   except gaierror:
     error = "Couldn't connect to address '{}'. Ensure this is the correct URL for " \
             "the vmpooler".format(host)
     raise RuntimeError(error)
-  except:
-    print("Unkown error occured while trying to connect to {}".format(host))
+  except (HTTPException, socket_error) as e:
+    if _cancelled():
+      raise CancelledError('The request to {} was cancelled!'.format(host))
+
+    raise RuntimeError('Unknown error occurred while trying to connect to {}! {}'.format(host, e))
+
+
+def _make_request(method, host, path, body='', headers=None, endpoint=None, pool=None,
+                  cancellation=None):
+  """
+  Makes an HTTP request.
+
+  Args:
+    method |str| = Type of request. GET, POST, PUT or DELETE.
+    host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+    path |str| = The path of the url. E.g. /vm/vm_name
+    body |str| = The body data to send with the request.
+    headers |{str:str}| = Optional headers for the request.
+    endpoint |str| = The request with names replaced by placeholders, used by the rate limiter
+      and handed to the registered hooks. E.g. "GET /vm/<hostname>". Defaults to the method and
+      path.
+    pool |ConnectionPool| = The connection pool to use. Defaults to the pool of the module.
+    cancellation |hedging.Cancellation| = Stops the request while it is in flight if it is
+      cancelled.
+
+  Returns:
+    |_Response| = Response from the request.
+
+  Raises:
+    |hedging.CancelledError| = The request was cancelled.
+    |RuntimeError| = If the vmpooler URL can't be reached
+  """
+
+  headers = headers or {}
+  endpoint = endpoint or '{} {}'.format(method, path)
+  limiter = _rate_limiter
+  send = _send_request if _transport is None else _transport.send
+
+  if limiter is not None:
+    limiter.acquire(endpoint)
+
+  if not hooks.active():
+    return send(method, host, path, body, headers, {}, pool, cancellation)
+
+  event = hooks.RequestEvent(method, host, path, endpoint, len(body))
+
+  hooks.fire_before_request(event)
+
+  try:
+    resp = send(method, host, path, body, headers, event.timings, pool, cancellation)
+  except Exception as e:
+    event.error = e
+    hooks.fire_on_error(event)
     raise
 
+  event.status = resp.status
+  event.bytes_received = len(resp.read())
+  hooks.fire_after_response(event)
+
+  return resp
+
+
+def _make_idempotent_request(host, path, endpoint, headers=None, pool=None):
+  """
+  Makes an idempotent GET request, hedging it if hedging has been enabled. The losing attempt of
+  a hedged request is stopped and its connection closed as soon as the other attempt wins.
+
+  Args:
+    host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+    path |str| = The path of the url. E.g. /vm/vm_name
+    endpoint |str| = The endpoint used to group latency samples. E.g. "GET /vm/<hostname>"
+    headers |{str:str}| = Optional headers for the request.
+    pool |ConnectionPool| = The connection pool to use. Defaults to the pool of the module.
+
+  Returns:
+    |_Response| = Response from the request.
+
+  Raises:
+    |RuntimeError| = If the vmpooler URL can't be reached
+  """
+
+  policy = _hedge_policy
+
+  def _attempt(cancellation=None):
+    return _make_request('GET',
+                         host,
+                         path,
+                         headers=headers,
+                         endpoint=endpoint,
+                         pool=pool,
+                         cancellation=cancellation)
+
+  if policy is None:
+    return _attempt()
+
+  return policy.call(endpoint, _attempt)
+
 
 def _create_basic_auth_header(username, password):
   """
@@ -89,9 +377,737 @@ def _create_auth_token_header(auth_token):
   return {'X-AUTH-TOKEN': '{}'.format(auth_token)}
 
 
+def _info_records(info_vm, vm_names, workers):
+  """Retrieve information for many VMs concurrently as compact records.
+
+  Args:
+    info_vm |func| = A function returning the information of a VM given its name.
+    vm_names |[str]| = The names of the VMs from which to retrieve information.
+    workers |int| or |AdaptiveLimit| = The maximum number of concurrent requests.
+
+  Returns:
+    |[VmRecord]| = A record for each VM in the order of "vm_names".
+
+  Raises:
+    |RuntimeError| = The connection failed or the information for a VM could not be retrieved.
+  """
+
+  results = run_parallel(lambda vm_name: VmRecord.from_info(vm_name, info_vm(vm_name)),
+                         vm_names,
+                         workers)
+
+  for _, _, error in results:
+    if error:
+      raise error
+
+  return [record for _, record, _ in results]
+
+
+def _client(vmpooler_hostname, auth_token=None):
+  """
+  Create the session used by the module functions. It shares the connection pool and the
+  coalesced reads of the module.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    auth_token |str| = The authentication token for the user
+
+  Returns:
+    |VmpoolerClient| = The session.
+
+  Raises:
+    |None|
+  """
+
+  client = VmpoolerClient(vmpooler_hostname, auth_token, pool=_pool)
+  client._single_flight = _single_flight
+
+  return client
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class VmpoolerClient(object):
+  """A session with a vmpooler. It owns the host, the auth token, a pool of keep-alive connections
+  and the reads in flight, and is safe to share between threads. The hedging policy and rate
+  limiter of the module apply to every session.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    auth_token |str| = The authentication token for the user. Only "create_auth_token" works
+      without one.
+    pool |ConnectionPool| = The connection pool to use. Defaults to a new pool.
+    workers |int| = The maximum number of concurrent requests of bulk operations.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, vmpooler_hostname, auth_token=None, pool=None, workers=DEFAULT_WORKERS):
+
+    self.vmpooler_hostname = vmpooler_hostname
+    self.auth_token = auth_token
+    self.pool = pool if pool is not None else ConnectionPool(resolver=Resolver())
+    self.workers = workers
+    self._single_flight = SingleFlight(on_coalesced=lambda key: metrics.record_coalesced(key[0]))
+
+  def _request(self, method, path, endpoint, body='', headers=None):
+    """Make a request to the vmpooler, authenticated with the token unless headers are given."""
+
+    if headers is None:
+      headers = _create_auth_token_header(self.auth_token)
+
+    return _make_request(method,
+                         self.vmpooler_hostname,
+                         path,
+                         body=body,
+                         headers=headers,
+                         endpoint=endpoint,
+                         pool=self.pool)
+
+  def _read(self, path, endpoint, headers=None):
+    """Make an idempotent GET request to the vmpooler, hedged if hedging is enabled."""
+
+    return _make_idempotent_request(self.vmpooler_hostname,
+                                    path,
+                                    endpoint,
+                                    headers=headers,
+                                    pool=self.pool)
+
+  def create_auth_token(self, username, password):
+    """
+    Generate an authorization token.
+
+    Args:
+      username |str| = The username for the authorization token request.
+      password |str| = The password for the authorization token request.
+
+    Returns:
+      |str| = An authorization token.
+
+    Raises:
+      |RuntimeError| = The request was bad or incorrect credentials provided.
+    """
+
+    resp = self._request('POST',
+                         '/token',
+                         'POST /token',
+                         headers=_create_basic_auth_header(username, password))
+
+    if resp.status == 401:
+      raise RuntimeError('Failed to create authorization token because the provided credentials '
+                         'are not authorized!')
+    elif resp.status != 200:
+      errmsg = ('Failed to create authorization token! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    return loads(resp.read())['token']
+
+  @_coalesced
+  def get_token_info(self, suppress_return=False):
+    """
+    Verify that the authorization token is still valid.
+
+    Args:
+      suppress_return |bln| = Suppress returning token information.
+
+    Returns:
+      |{str:str}| = A dictionary of token information.
+
+    Raises:
+      |RuntimeError| = The request was bad or incorrect credentials provided.
+    """
+
+    resp = self._read('/token/{0}'.format(self.auth_token), 'GET /token/<token>')
+
+    if resp.status == 404:
+      raise RuntimeError('Token already revoked or invalid token specified!')
+    elif resp.status != 200:
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    if not suppress_return:
+      return loads(resp.read())[self.auth_token]
+
+  @_coalesced
+  def get_running_vms(self):
+    """
+    Retrieve the running VMs of the authorization token.
+
+    Returns:
+      |[str]| = The hostnames of the running VMs.
+
+    Raises:
+      |RuntimeError| = The request was bad or incorrect credentials provided.
+    """
+
+    resp = self._read('/token/{0}'.format(self.auth_token), 'GET /token/<token>')
+
+    if resp.status == 404:
+      raise RuntimeError('Token already revoked or invalid token specified!')
+    elif resp.status != 200:
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    try:
+      return loads(resp.read())[self.auth_token].get('vms', {}).get('running', [])
+    except (ValueError, KeyError, AttributeError) as e:
+      raise RuntimeError('Invalid token information returned by the vmpooler! {}'.format(e))
+
+  def revoke_auth_token(self, username, password):
+    """
+    Revoke the authorization token.
+
+    Args:
+      username |str| = The username for the authorization token request.
+      password |str| = The password for the authorization token request.
+
+    Returns:
+      |None|
+
+    Raises:
+      |RuntimeError| = The request was bad or incorrect credentials provided.
+    """
+
+    resp = self._request('DELETE',
+                         '/token/{0}'.format(self.auth_token),
+                         'DELETE /token/<token>',
+                         headers=_create_basic_auth_header(username, password))
+
+    if resp.status != 200:
+      errmsg = 'Token already revoked, invalid credentials provided or invalid token specified!'
+      raise RuntimeError(errmsg)
+
+  @_coalesced
+  def list_vm(self):
+    """Retrieve a list of availabe VM templates from the pooler.
+
+    Returns:
+      |[str]| = An array of template names.
+
+    Raises:
+      |RuntimeError| = The connection failed or the list of templates could not be
+        retrieved for some reason.
+    """
+
+    resp = self._read('/vm', 'GET /vm', headers=_create_auth_token_header(self.auth_token))
+
+    if resp.status != 200:
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    vmpooler_status = loads(resp.read())
+
+    if len(vmpooler_status) == 0:
+      raise RuntimeError('Could not retrieve list of templates!')
+
+    return vmpooler_status
+
+  def checkout_vm(self, template_name):
+    """Retrieve a VM from the vmpooler and return the hostname and domain.
+
+    Args:
+      template_name |str| = The name of the template on the vmpooler.
+
+    Returns:
+      |(str, str)| = The hostname of the VM and the domain of the vmpooler. The domain is empty
+        if the vmpooler did not return one.
+
+    Raises:
+      |PoolDrainedError| = The pool is drained for the template.
+      |RuntimeError| = The connection failed or template could not be retrieved for some reason.
+    """
+
+    resp = self._request('POST', '/vm/{0}'.format(template_name), 'POST /vm/<template>')
+
+    if resp.status == 404:
+      metrics.record_checkout(template_name, 'not_found')
+      raise RuntimeError('Could not retrieve template! Invalid template name provided!')
+    elif resp.status != 200:
+      metrics.record_checkout(template_name, 'error')
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    vmpooler_status = loads(resp.read())
+
+    if not vmpooler_status["ok"]:
+      metrics.record_checkout(template_name, 'drained')
+      raise PoolDrainedError('Could not retrieve template! The pool is drained for template!')
+
+    metrics.record_checkout(template_name, 'ok')
+
+    return (vmpooler_status[template_name]['hostname'], vmpooler_status.get('domain', ''))
+
+  def checkout_vms(self, template_counts):
+    """Retrieve several VMs from the vmpooler in a single request. The vmpooler either fills the
+    whole request or returns the VMs it took back to their pools.
+
+    Args:
+      template_counts |{str:int}| = The number of VMs to retrieve for each template.
+
+    Returns:
+      |([(str, str)], str)| = The template and hostname of every VM and the domain of the
+        vmpooler. The domain is empty if the vmpooler did not return one.
+
+    Raises:
+      |PoolDrainedError| = A pool is drained.
+      |RuntimeError| = The connection failed or a template name is invalid.
+    """
+
+    resp = self._request('POST', '/vm', 'POST /vm', body=dumps(template_counts))
+
+    if resp.status == 404:
+      for template_name in template_counts:
+        metrics.record_checkout(template_name, 'not_found')
+      raise RuntimeError('Could not retrieve templates! Invalid template name provided!')
+    elif resp.status != 200:
+      for template_name in template_counts:
+        metrics.record_checkout(template_name, 'error')
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    vmpooler_status = loads(resp.read())
+
+    if not vmpooler_status["ok"]:
+      for template_name in template_counts:
+        metrics.record_checkout(template_name, 'drained')
+      raise PoolDrainedError('Could not retrieve templates! A pool is drained!')
+
+    vms = []
+
+    for template_name in template_counts:
+      metrics.record_checkout(template_name, 'ok')
+      hostnames = vmpooler_status[template_name]['hostname']
+
+      # A single VM is returned as a string rather than a list.
+      if not isinstance(hostnames, list):
+        hostnames = [hostnames]
+
+      vms.extend((template_name, hostname) for hostname in hostnames)
+
+    return (vms, vmpooler_status.get('domain', ''))
+
+  def get_vm(self, template_name):
+    """Retrieve a VM from the vmpooler and return the hostname.
+
+    Args:
+      template_name |str| = The name of the template on the vmpooler.
+
+    Returns:
+      |str| = The hostname of the VM.
+
+    Raises:
+      |RuntimeError| = The connection failed or template could not be retrieved for some reason.
+    """
+
+    return self.checkout_vm(template_name)[0]
+
+  @_coalesced
+  def info_vm(self, vm_name):
+    """Retrieve information for a VM in the vmpooler.
+
+    Args:
+      vm_name |str| = The name of the VM from which to retrieve information.
+
+    Returns:
+      |{str:str}| = A dictionary of VM information.
+
+    Raises:
+      |VmNotFoundError| = The VM does not exist.
+      |RuntimeError| = The connection failed or template could not be retrieved for some reason.
+    """
+
+    resp = self._read('/vm/{0}'.format(vm_name),
+                      'GET /vm/<hostname>',
+                      headers=_create_auth_token_header(self.auth_token))
+
+    if resp.status == 404:
+      raise VmNotFoundError('Could not find VM! Check the VM name and try again!')
+    elif resp.status != 200:
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    return loads(resp.read())[vm_name]
+
+  def info_vms(self, vm_names):
+    """Retrieve information for many VMs concurrently as compact records.
+
+    Args:
+      vm_names |[str]| = The names of the VMs from which to retrieve information.
+
+    Returns:
+      |[VmRecord]| = A record for each VM in the order of "vm_names".
+
+    Raises:
+      |RuntimeError| = The connection failed or the information for a VM could not be retrieved.
+    """
+
+    return _info_records(self.info_vm, vm_names, self.workers)
+
+  def destroy_vm(self, vm_name):
+    """Hand a VM back to the vmpooler to be destroyed.
+
+    Args:
+      vm_name |str| = The name of the VM (hostname) to destroy.
+
+    Returns:
+      |None|
+
+    Raises:
+      |VmNotFoundError| = The VM is already destroyed or does not exist.
+      |RuntimeError| = The connection failed or invalid 'vm_name' was specified.
+    """
+
+    resp = self._request('DELETE', '/vm/{0}'.format(vm_name), 'DELETE /vm/<hostname>')
+
+    if resp.status == 404:
+      raise VmNotFoundError('The VM is already destroyed or wrong VM name provided!')
+    elif resp.status != 200:
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+  def destroy_vms(self, vm_names):
+    """Hand many VMs back to the vmpooler concurrently. VMs which are already destroyed are not
+    an error.
+
+    Args:
+      vm_names |[str]| = The names of the VMs (hostnames) to destroy.
+
+    Returns:
+      |[(str, Exception)]| = The name and error of every VM that could not be destroyed.
+
+    Raises:
+      |None|
+    """
+
+    def _destroy(vm_name):
+      try:
+        self.destroy_vm(vm_name)
+      except VmNotFoundError:
+        pass
+
+    results = run_parallel(_destroy, vm_names, self.workers)
+
+    return [(vm_name, error) for vm_name, _, error in results if error is not None]
+
+  @contextmanager
+  def lease(self, template_name, count=1):
+    """Retrieve VMs concurrently for the duration of a "with" block. The VMs are handed back
+    concurrently when the block exits, even if it raises. If some VMs cannot be retrieved the
+    others are handed back before the error is raised.
+
+    Args:
+      template_name |str| = The name of the template on the vmpooler.
+      count |int| = The number of VMs to retrieve.
+
+    Returns:
+      |[str]| = The hostnames of the VMs.
+
+    Raises:
+      |RuntimeError| = Some VMs could not be retrieved, or could not be handed back after the
+        block exited normally.
+    """
+
+    results = run_parallel(self.get_vm, [template_name] * count, self.workers)
+    hostnames = [hostname for _, hostname, error in results if error is None]
+    errors = [error for _, _, error in results if error is not None]
+
+    try:
+      if errors:
+        raise RuntimeError('Could not retrieve {} of {} VMs! {}'.format(len(errors),
+                                                                       count,
+                                                                       errors[0]))
+
+      yield hostnames
+    except:
+      self.destroy_vms(hostnames)
+      raise
+
+    failures = self.destroy_vms(hostnames)
+
+    if failures:
+      raise RuntimeError('Could not destroy {} of {} VMs! {}: {}'.format(len(failures),
+                                                                        len(hostnames),
+                                                                        failures[0][0],
+                                                                        failures[0][1]))
+
+  def set_vm_lifetime(self, vm_name, lifetime):
+    """Set the time to live for a VM.
+
+    Args:
+      vm_name |str| = The name of the VM (hostname) to set time to live.
+      lifetime |int| = The number of hours to set the time to live for the VM.
+
+    Returns:
+      |None|
+
+    Raises:
+      |RuntimeError| = Invalid credentials specified or connection failure.
+    """
+
+    resp = self._request('PUT',
+                         '/vm/{}'.format(vm_name),
+                         'PUT /vm/<hostname>',
+                         body='{{"lifetime":"{}"}}'.format(lifetime))
+
+    if resp.status != 200:
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    vmpooler_status = loads(resp.read())
+
+    if not vmpooler_status['ok']:
+      raise RuntimeError('Invalid credentials provided!')
+
+  def snapshot_vm(self, vm_name):
+    """Take a snapshot of a VM. The vmpooler takes the snapshot in the background.
+
+    Args:
+      vm_name |str| = The name of the VM (hostname) to snapshot.
+
+    Returns:
+      |str| = The name of the snapshot.
+
+    Raises:
+      |VmNotFoundError| = The VM does not exist.
+      |RuntimeError| = The connection failed or invalid 'vm_name' was specified.
+    """
+
+    resp = self._request('POST',
+                         '/vm/{0}/snapshot'.format(vm_name),
+                         'POST /vm/<hostname>/snapshot')
+
+    if resp.status == 404:
+      raise VmNotFoundError('Could not find VM! Check the VM name and try again!')
+    elif resp.status not in (200, 202):
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    vmpooler_status = loads(resp.read())
+
+    if not vmpooler_status['ok']:
+      raise RuntimeError('Could not snapshot VM!')
+
+    return vmpooler_status[vm_name]['snapshot']
+
+  def revert_vm(self, vm_name, snapshot):
+    """Revert a VM to a snapshot. The vmpooler reverts the VM in the background.
+
+    Args:
+      vm_name |str| = The name of the VM (hostname) to revert.
+      snapshot |str| = The name of the snapshot to revert to.
+
+    Returns:
+      |None|
+
+    Raises:
+      |RuntimeError| = The connection failed or invalid 'vm_name' or 'snapshot' was specified.
+    """
+
+    resp = self._request('POST',
+                         '/vm/{0}/snapshot/{1}'.format(vm_name, snapshot),
+                         'POST /vm/<hostname>/snapshot/<snapshot>')
+
+    if resp.status == 404:
+      raise RuntimeError('Could not find the VM or snapshot! Check the names and try again!')
+    elif resp.status not in (200, 202):
+      errmsg = ('Could not connect to vmpooler! '
+                'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
+      raise RuntimeError(errmsg)
+
+    if not loads(resp.read())['ok']:
+      raise RuntimeError('Could not revert VM!')
+
+
 #===================================================================================================
 # Functions: Public
 #===================================================================================================
+def enable_hedging(percentile=95, max_ratio=0.05):
+  """
+  Hedge idempotent reads ("list_vm", "info_vm" and "get_token_info"). A read that has not been
+  answered within the given latency percentile is duplicated on a second connection and the
+  first response to arrive is used.
+
+  Args:
+    percentile |float| = The latency percentile after which a read is hedged.
+    max_ratio |float| = The maximum fraction of reads which may be hedged.
+
+  Returns:
+    |None|
+
+  Raises:
+    |ValueError| = Invalid percentile or ratio specified.
+  """
+
+  global _hedge_policy
+
+  _hedge_policy = HedgePolicy(percentile, max_ratio)
+
+
+def disable_hedging():
+  """
+  Stop hedging idempotent reads.
+
+  Args:
+    |None|
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _hedge_policy
+
+  _hedge_policy = None
+
+
+def enable_rate_limit(rate=None, endpoint_rates=None, burst=1.0, state_file=None):
+  """
+  Limit the rate of requests sent to the vmpooler with token buckets. The limits are shared by
+  every thread in the process and, if a state file is given, by every process on the host.
+
+  Args:
+    rate |float| = The global limit in requests per second or "None" for no global limit.
+    endpoint_rates |{str:float}| = Limits for individual endpoints keyed by endpoint.
+      E.g. {"DELETE /vm/<hostname>": 5}
+    burst |float| = The number of requests that may be sent back to back.
+    state_file |str| = A file used to share the limits between processes.
+
+  Returns:
+    |None|
+
+  Raises:
+    |ValueError| = A rate is not positive.
+  """
+
+  global _rate_limiter
+
+  _rate_limiter = RateLimiter(rate, endpoint_rates, burst, state_file)
+
+
+def disable_rate_limit():
+  """
+  Stop limiting the rate of requests.
+
+  Args:
+    |None|
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _rate_limiter
+
+  _rate_limiter = None
+
+
+def enable_dns_cache(ttl, state_file=None):
+  """
+  Set how long lookups of the vmpooler are cached and optionally share them, together with the
+  address family that connected, between processes through a state file.
+
+  Args:
+    ttl |float| = The number of seconds a lookup is cached. Zero disables caching.
+    state_file |str| = A file used to share the cache between processes.
+
+  Returns:
+    |None|
+
+  Raises:
+    |ValueError| = The TTL is negative.
+  """
+
+  if ttl < 0:
+    raise ValueError('The DNS cache TTL must not be negative!')
+
+  _pool.resolver = Resolver(ttl, state_file)
+
+
+def use_transport(transport):
+  """
+  Send requests through a transport instead of to the vmpooler. A transport has a "send" method
+  which takes the arguments of "_send_request" and returns a response like it.
+
+  Args:
+    transport |obj| = The transport, or "None" to send requests to the vmpooler.
+
+  Returns:
+    |obj| = The transport used until now.
+
+  Raises:
+    |None|
+  """
+
+  global _transport
+
+  previous, _transport = _transport, transport
+
+  return previous
+
+
+def prewarm(host):
+  """
+  Start connecting to the vmpooler in the background so that the DNS lookup and TCP handshake
+  overlap with the work done before the first request, which is handed the connection.
+
+  Args:
+    host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  _pool.prewarm(host)
+
+
+def forward_request(method, host, path, body='', headers=None, endpoint=None):
+  """
+  Send a request on behalf of another client, such as a client of the local proxy. GET requests
+  are hedged like the reads of this module.
+
+  Args:
+    method |str| = Type of request. GET, POST, PUT or DELETE.
+    host |str| = The host and port of the server. E.g. vmpooler.myhost.com:8080
+    path |str| = The path of the url. E.g. /vm/vm_name
+    body |str| = The body data to send with the request.
+    headers |{str:str}| = Headers for the request.
+    endpoint |str| = The request with names replaced by placeholders. E.g. "GET /vm/<hostname>"
+
+  Returns:
+    |_Response| = The response, whose body has been read.
+
+  Raises:
+    |RuntimeError| = If the vmpooler URL can't be reached
+  """
+
+  headers = headers or {}
+  endpoint = endpoint or '{} {}'.format(method, path)
+
+  if method == 'GET':
+    return _make_idempotent_request(host, path, endpoint, headers=headers)
+
+  return _make_request(method, host, path, body, headers, endpoint)
+
+
 def create_auth_token(vmpooler_hostname, username, password):
   """
   Generate an authorization token.
@@ -108,20 +1124,7 @@ def create_auth_token(vmpooler_hostname, username, password):
     |RuntimeError| = The request was bad or incorrect credentials provided.
   """
 
-  resp = _make_request('POST',
-                       vmpooler_hostname,
-                       '/token',
-                       headers=_create_basic_auth_header(username, password))
-
-  if resp.status == 401:
-    raise RuntimeError('Failed to create authorization token because the provided credentials are '
-                       'not authorized!')
-  elif resp.status != 200:
-    errmsg = ('Failed to create authorization token! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
-
-  return loads(resp.read())['token']
+  return _client(vmpooler_hostname).create_auth_token(username, password)
 
 
 def get_token_info(vmpooler_hostname, auth_token, suppress_return=False):
@@ -140,17 +1143,25 @@ def get_token_info(vmpooler_hostname, auth_token, suppress_return=False):
     |RuntimeError| = The request was bad or incorrect credentials provided.
   """
 
-  resp = _make_request('GET', vmpooler_hostname, '/token/{0}'.format(auth_token))
+  return _client(vmpooler_hostname, auth_token).get_token_info(suppress_return)
 
-  if resp.status == 404:
-    raise RuntimeError('Token already revoked or invalid token specified!')
-  elif resp.status != 200:
-    errmsg = ('Could not connect to vmpooler! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
 
-  if not suppress_return:
-    return loads(resp.read())[auth_token]
+def get_running_vms(vmpooler_hostname, auth_token):
+  """
+  Retrieve the running VMs of an authorization token.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    auth_token |str| = The authorization token.
+
+  Returns:
+    |[str]| = The hostnames of the running VMs.
+
+  Raises:
+    |RuntimeError| = The request was bad or incorrect credentials provided.
+  """
+
+  return _client(vmpooler_hostname, auth_token).get_running_vms()
 
 
 def revoke_auth_token(vmpooler_hostname, username, password, auth_token):
@@ -170,14 +1181,7 @@ def revoke_auth_token(vmpooler_hostname, username, password, auth_token):
     |RuntimeError| = The request was bad or incorrect credentials provided.
   """
 
-  resp = _make_request('DELETE',
-                       vmpooler_hostname,
-                       '/token/{0}'.format(auth_token),
-                       headers=_create_basic_auth_header(username, password))
-
-  if resp.status != 200:
-    errmsg = 'Token already revoked, invalid credentials provided or invalid token specified!'
-    raise RuntimeError(errmsg)
+  _client(vmpooler_hostname, auth_token).revoke_auth_token(username, password)
 
 
 def list_vm(vmpooler_hostname, auth_token):
@@ -195,22 +1199,48 @@ def list_vm(vmpooler_hostname, auth_token):
       retrieved for some reason.
   """
 
-  resp = _make_request('GET',
-                       vmpooler_hostname,
-                       '/vm',
-                       headers=_create_auth_token_header(auth_token))
+  return _client(vmpooler_hostname, auth_token).list_vm()
 
-  if resp.status != 200:
-    errmsg = ('Could not connect to vmpooler! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
 
-  vmpooler_status = loads(resp.read())
+def checkout_vm(vmpooler_hostname, template_name, auth_token):
+  """Retrieve a VM from the vmpooler and return the hostname and domain.
 
-  if len(vmpooler_status) == 0:
-    raise RuntimeError('Could not retrieve list of templates!')
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    template_name |str| = The name of the template on the vmpooler.
+    auth_token |str| = The authentication token for the user
+
+  Returns:
+    |(str, str)| = The hostname of the VM and the domain of the vmpooler. The domain is empty
+      if the vmpooler did not return one.
+
+  Raises:
+    |PoolDrainedError| = The pool is drained for the template.
+    |RuntimeError| = The connection failed or template could not be retrieved for some reason.
+  """
 
-  return vmpooler_status
+  return _client(vmpooler_hostname, auth_token).checkout_vm(template_name)
+
+
+def checkout_vms(vmpooler_hostname, template_counts, auth_token):
+  """Retrieve several VMs from the vmpooler in a single request. The vmpooler either fills the
+  whole request or returns the VMs it took back to their pools.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    template_counts |{str:int}| = The number of VMs to retrieve for each template.
+    auth_token |str| = The authentication token for the user
+
+  Returns:
+    |([(str, str)], str)| = The template and hostname of every VM and the domain of the
+      vmpooler. The domain is empty if the vmpooler did not return one.
+
+  Raises:
+    |PoolDrainedError| = A pool is drained.
+    |RuntimeError| = The connection failed or a template name is invalid.
+  """
+
+  return _client(vmpooler_hostname, auth_token).checkout_vms(template_counts)
 
 
 def get_vm(vmpooler_hostname, template_name, auth_token):
@@ -228,24 +1258,7 @@ def get_vm(vmpooler_hostname, template_name, auth_token):
     |RuntimeError| = The connection failed or template could not be retrieved for some reason.
   """
 
-  resp = _make_request('POST',
-                       vmpooler_hostname,
-                       '/vm/{0}'.format(template_name),
-                       headers=_create_auth_token_header(auth_token))
-
-  if resp.status == 404:
-    raise RuntimeError('Could not retrieve template! Invalid template name provided!')
-  elif resp.status != 200:
-    errmsg = ('Could not connect to vmpooler! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
-
-  vmpooler_status = loads(resp.read())
-
-  if not vmpooler_status["ok"]:
-    raise RuntimeError('Could not retrieve template! The pool is drained for template!')
-
-  return vmpooler_status[template_name]['hostname']
+  return _client(vmpooler_hostname, auth_token).get_vm(template_name)
 
 
 def info_vm(vmpooler_hostname, vm_name, auth_token):
@@ -260,22 +1273,32 @@ def info_vm(vmpooler_hostname, vm_name, auth_token):
     |{str:str}| = A dictionary of VM information.
 
   Raises:
+    |VmNotFoundError| = The VM does not exist.
     |RuntimeError| = The connection failed or template could not be retrieved for some reason.
   """
 
-  resp = _make_request('GET',
-                       vmpooler_hostname,
-                       '/vm/{0}'.format(vm_name),
-                       headers=_create_auth_token_header(auth_token))
+  return _client(vmpooler_hostname, auth_token).info_vm(vm_name)
+
+
+def info_vms(vmpooler_hostname, vm_names, auth_token, workers=DEFAULT_WORKERS):
+  """Retrieve information for many VMs concurrently as compact records.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    vm_names |[str]| = The names of the VMs from which to retrieve information.
+    auth_token |str| = The authentication token for the user
+    workers |int| or |AdaptiveLimit| = The maximum number of concurrent requests.
+
+  Returns:
+    |[VmRecord]| = A record for each VM in the order of "vm_names".
 
-  if resp.status == 404:
-    raise RuntimeError('Could not find VM! Check the VM name and try again!')
-  elif resp.status != 200:
-    errmsg = ('Could not connect to vmpooler! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
+  Raises:
+    |RuntimeError| = The connection failed or the information for a VM could not be retrieved.
+  """
 
-  return loads(resp.read())[vm_name]
+  return _info_records(lambda vm_name: info_vm(vmpooler_hostname, vm_name, auth_token),
+                       vm_names,
+                       workers)
 
 
 def destroy_vm(vmpooler_hostname, vm_name, auth_token):
@@ -290,20 +1313,11 @@ def destroy_vm(vmpooler_hostname, vm_name, auth_token):
     |None|
 
   Raises:
+    |VmNotFoundError| = The VM is already destroyed or does not exist.
     |RuntimeError| = The connection failed or invalid 'vm_name' was specified.
   """
 
-  resp = _make_request('DELETE',
-                       vmpooler_hostname,
-                       '/vm/{0}'.format(vm_name),
-                       headers=_create_auth_token_header(auth_token))
-
-  if resp.status == 404:
-    raise RuntimeError('The VM is already destroyed or wrong VM name provided!')
-  elif resp.status != 200:
-    errmsg = ('Could not connect to vmpooler! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
+  _client(vmpooler_hostname, auth_token).destroy_vm(vm_name)
 
 
 def set_vm_lifetime(vmpooler_hostname, vm_name, lifetime, auth_token):
@@ -322,18 +1336,42 @@ def set_vm_lifetime(vmpooler_hostname, vm_name, lifetime, auth_token):
     |RuntimeError| = Invalid credentials specified or connection failure.
   """
 
-  resp = _make_request('PUT',
-                       vmpooler_hostname,
-                       '/vm/{}'.format(vm_name),
-                       body='{{"lifetime":"{}"}}'.format(lifetime),
-                       headers=_create_auth_token_header(auth_token))
+  _client(vmpooler_hostname, auth_token).set_vm_lifetime(vm_name, lifetime)
 
-  if resp.status != 200:
-    errmsg = ('Could not connect to vmpooler! '
-              'Status Code: {0} Reason: {0}'.format(resp.status, resp.reason))
-    raise RuntimeError(errmsg)
 
-  vmpooler_status = loads(resp.read())
+def snapshot_vm(vmpooler_hostname, vm_name, auth_token):
+  """Take a snapshot of a VM. The vmpooler takes the snapshot in the background.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    vm_name |str| = The name of the VM (hostname) to snapshot.
+    auth_token |str| = The authentication token for the user
+
+  Returns:
+    |str| = The name of the snapshot.
+
+  Raises:
+    |VmNotFoundError| = The VM does not exist.
+    |RuntimeError| = The connection failed or invalid 'vm_name' was specified.
+  """
+
+  return _client(vmpooler_hostname, auth_token).snapshot_vm(vm_name)
+
+
+def revert_vm(vmpooler_hostname, vm_name, snapshot, auth_token):
+  """Revert a VM to a snapshot. The vmpooler reverts the VM in the background.
+
+  Args:
+    vmpooler_hostname |str| = The URL of the vmpooler
+    vm_name |str| = The name of the VM (hostname) to revert.
+    snapshot |str| = The name of the snapshot to revert to.
+    auth_token |str| = The authentication token for the user
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The connection failed or invalid 'vm_name' or 'snapshot' was specified.
+  """
 
-  if not vmpooler_status['ok']:
-    raise RuntimeError('Invalid credentials provided!')
+  _client(vmpooler_hostname, auth_token).revert_vm(vm_name, snapshot)
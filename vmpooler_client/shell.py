@@ -0,0 +1,287 @@
+"""
+.. module:: vmpooler_client.shell
+   :synopsis: Run commands interactively in one process so that state is kept between them.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from __future__ import print_function
+import shlex
+import sys
+from os.path import getmtime
+from threading import Thread
+from completion import refresh_cache, TEMPLATE_ARGS, HOSTNAME_ARGS
+from vmcache import VmCache, locate_cache
+
+try:
+  import readline
+except ImportError:
+  # Windows has no "readline". The shell works there without completion or history.
+  readline = None
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+PROMPT = 'vmpooler> '
+
+# Lines which leave the shell.
+EXIT_COMMANDS = ('exit', 'quit')
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class Completer(object):
+  """Complete command-lines from the commands of a parser and from the templates and VMs in the
+  VM cache. Completion never makes requests, so it never waits on the vmpooler. The cache is
+  read again whenever another command or process has changed it.
+
+  Args:
+    cmd_parser |vmpooler_client.command_parser.CommandParser| = The command parser.
+    cache_path |str| = The path of the VM cache.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, cmd_parser, cache_path):
+
+    self._cmd_parser = cmd_parser
+    self._commands = cmd_parser.commands()
+    self._cache_path = cache_path
+    self._cache = None
+    self._cache_mtime = None
+    self._matches = []
+
+  def _index(self):
+    """Return the VM cache, reading it again if the file has changed.
+
+    Returns:
+      |VmCache| = The cache.
+
+    Raises:
+      |None|
+    """
+
+    try:
+      mtime = getmtime(self._cache_path)
+    except OSError:
+      mtime = None
+
+    if self._cache is None or mtime != self._cache_mtime:
+      self._cache = VmCache(self._cache_path)
+      self._cache_mtime = mtime
+
+    return self._cache
+
+  def matches(self, words, text):
+    """Find the completions of a word.
+
+    Args:
+      words |[str]| = The complete words before the word being completed.
+      text |str| = The start of the word being completed.
+
+    Returns:
+      |[str]| = The sorted completions.
+
+    Raises:
+      |None|
+    """
+
+    if not words:
+      candidates = sorted(list(self._commands) + ['help'] + list(EXIT_COMMANDS))
+    elif words[0] not in self._commands:
+      candidates = []
+    elif text.startswith('-'):
+      sub_cmd_name = words[1] if self._commands[words[0]] and len(words) > 1 else None
+
+      try:
+        candidates = self._cmd_parser.options(words[0], sub_cmd_name)
+      except KeyError:
+        candidates = []
+    elif len(words) == 1:
+      candidates = self._commands[words[0]]
+    else:
+      key = tuple(words[:2])
+      first = not [word for word in words[2:] if not word.startswith('-')]
+
+      if key in TEMPLATE_ARGS and (first or TEMPLATE_ARGS[key]):
+        candidates = self._index().templates()
+      elif key in HOSTNAME_ARGS and (first or HOSTNAME_ARGS[key]):
+        candidates = self._index().hostnames()
+      else:
+        candidates = []
+
+    return [candidate for candidate in candidates if candidate.startswith(text)]
+
+  def complete(self, text, state):
+    """The completion function for "readline".
+
+    Args:
+      text |str| = The start of the word being completed.
+      state |int| = The index of the completion requested.
+
+    Returns:
+      |str| = The completion or "None" once there are no more.
+
+    Raises:
+      |None|
+    """
+
+    if state == 0:
+      line = readline.get_line_buffer()[:readline.get_begidx()]
+
+      try:
+        words = shlex.split(line)
+      except ValueError:
+        words = line.split()
+
+      self._matches = self.matches(words, text)
+
+    if state < len(self._matches):
+      # "readline" only accepts byte strings but the cache holds unicode.
+      return str(self._matches[state])
+
+    return None
+
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _refresh_index(config, cache_path):
+  """Refresh the VM cache in the background of the shell. Failures are ignored since the cache
+  is only used for completion.
+
+  Args:
+    config |{str:str}| = A dictionary of settings from the configuration file.
+    cache_path |str| = The path of the VM cache.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  try:
+    refresh_cache(config, cache_path)
+  except RuntimeError:
+    pass
+
+
+def _execute(cmd_parser, argv, config):
+  """Execute one command of the shell.
+
+  Args:
+    cmd_parser |vmpooler_client.command_parser.CommandParser| = The command parser.
+    argv |[str]| = The arguments of the command.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |bln| = The command succeeded.
+
+  Raises:
+    |None|
+  """
+
+  if argv[0] == 'shell':
+    print('Already in the shell!')
+    return False
+  elif argv[0] == 'help':
+    argv = ['--help']
+
+  try:
+    cmd_parser.execute(argv, config=config)
+  except SystemExit as e:
+    # The parser has already printed the usage or help.
+    return not e.code
+  except RuntimeError as e:
+    print(e)
+    print('\nFailed!')
+    return False
+  except KeyboardInterrupt:
+    print('\nInterrupted!')
+    return False
+
+  return True
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def run(cmd_parser, config, stdin=None):
+  """Read and execute commands until "exit" or the end of input. Every command shares the
+  configuration, pooled connections and caches of this process. When the input is not a
+  terminal the commands are executed as a script without prompts.
+
+  Args:
+    cmd_parser |vmpooler_client.command_parser.CommandParser| = The command parser.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+    stdin |file| = The input to read commands from. Defaults to "sys.stdin".
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = Some commands of a script failed.
+  """
+
+  stdin = stdin or sys.stdin
+  interactive = stdin.isatty()
+  cache_path = locate_cache()
+  executed = 0
+  failed = 0
+
+  if interactive and readline is not None:
+    readline.set_completer_delims(' \t\n')
+    readline.set_completer(Completer(cmd_parser, cache_path).complete)
+
+    if 'libedit' in (readline.__doc__ or ''):
+      # The "readline" module of macOS is built on "libedit", which binds keys differently.
+      readline.parse_and_bind('bind ^I rl_complete')
+    else:
+      readline.parse_and_bind('tab: complete')
+
+  if interactive:
+    refresh = Thread(target=_refresh_index, args=(config, cache_path))
+    refresh.daemon = True
+    refresh.start()
+
+  while True:
+    try:
+      if interactive:
+        line = raw_input(PROMPT)
+      else:
+        line = stdin.readline()
+
+        if not line:
+          break
+    except EOFError:
+      print()
+      break
+    except KeyboardInterrupt:
+      print()
+      continue
+
+    try:
+      argv = shlex.split(line)
+    except ValueError as e:
+      argv = None
+      print(e)
+
+    if argv == []:
+      continue
+    elif argv and argv[0] in EXIT_COMMANDS:
+      break
+
+    executed += 1
+
+    if not argv or not _execute(cmd_parser, argv, config):
+      failed += 1
+
+  if failed and not interactive:
+    raise RuntimeError('{} of {} commands failed!'.format(failed, executed))
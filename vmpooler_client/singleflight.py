@@ -0,0 +1,109 @@
+"""
+.. module:: vmpooler_client.singleflight
+   :synopsis: Coalesce identical concurrent calls into a single call.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import sys
+from threading import Event, Lock
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# How often (in seconds) blocking waits wake up so that Ctrl-C is still delivered.
+_POLL_INTERVAL = 0.5
+
+#===================================================================================================
+# Classes: Private
+#===================================================================================================
+class _Call(object):
+  """A call in flight and, once done, its outcome."""
+
+  __slots__ = ('done', 'result', 'error')
+
+  def __init__(self):
+
+    self.done = Event()
+    self.result = None
+    self.error = None
+
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class SingleFlight(object):
+  """Run at most one call per key at a time. Callers that arrive while a call for their key is in
+  flight wait for it and share its result or error instead of making their own call.
+
+  Args:
+    on_coalesced |func| = An optional function called with the key each time a call is
+      coalesced.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, on_coalesced=None):
+
+    self._calls = {}
+    self._lock = Lock()
+    self._on_coalesced = on_coalesced
+
+    self.executed = 0
+    self.coalesced = 0
+
+  def do(self, key, func):
+    """Call a function unless a call for the same key is already in flight.
+
+    Args:
+      key |obj| = A hashable key identifying the call.
+      func |func| = A function with no arguments to call.
+
+    Returns:
+      |obj| = The result of the call. Coalesced callers receive the same object.
+
+    Raises:
+      |Exception| = Anything raised by the call. Coalesced callers receive the same error.
+    """
+
+    with self._lock:
+      call = self._calls.get(key)
+
+      if call is None:
+        leader = True
+        call = self._calls[key] = _Call()
+        self.executed += 1
+      else:
+        leader = False
+        self.coalesced += 1
+
+    if not leader:
+      if self._on_coalesced:
+        self._on_coalesced(key)
+
+      while not call.done.wait(_POLL_INTERVAL):
+        pass
+
+      if call.error:
+        raise call.error[0], call.error[1], call.error[2]
+
+      return call.result
+
+    try:
+      call.result = func()
+    except Exception:
+      call.error = sys.exc_info()
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+
+      call.done.set()
+
+    return call.result
@@ -0,0 +1,172 @@
+"""
+.. module:: vmpooler_client.timings
+   :synopsis: Summarize the requests made by a command and the concurrency of its bulk operations.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+from threading import Lock
+from time import time
+import hooks
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+# The time recording started, or "None" while timings are disabled.
+_start = None
+
+# {endpoint: [requests, failures, total seconds, slowest seconds]}
+_endpoints = {}
+
+# The adaptive limits of the bulk operations run since timing was enabled, in order.
+_limits = []
+_lock = Lock()
+
+#===================================================================================================
+# Functions: Private
+#===================================================================================================
+def _record(endpoint, seconds, failed):
+  """Count a request to an endpoint.
+
+  Args:
+    endpoint |str| = The endpoint of the request. E.g. "GET /vm/<hostname>"
+    seconds |float| = The time taken for the vmpooler to answer.
+    failed |bln| = Whether the request failed or the vmpooler answered with a server error.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  with _lock:
+    stats = _endpoints.setdefault(endpoint, [0, 0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += 1 if failed else 0
+    stats[2] += seconds
+    stats[3] = max(stats[3], seconds)
+
+
+def _record_response(event):
+  """The "after_response" hook."""
+
+  _record(event.endpoint, event.timings.get('total', 0.0), event.status >= 500)
+
+
+def _record_error(event):
+  """The "on_error" hook."""
+
+  _record(event.endpoint, 0.0, True)
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def enable():
+  """Start timing every request made through the service layer.
+
+  Args:
+    |None|
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _start
+
+  if _start is None:
+    hooks.register(after_response=_record_response, on_error=_record_error)
+
+  with _lock:
+    _endpoints.clear()
+    del _limits[:]
+
+  _start = time()
+
+
+def disable():
+  """Stop timing requests and discard the recorded timings.
+
+  Args:
+    |None|
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  global _start
+
+  hooks.unregister(_record_response)
+  hooks.unregister(_record_error)
+  _start = None
+
+  with _lock:
+    _endpoints.clear()
+    del _limits[:]
+
+
+def record_limit(limit):
+  """Report the limit a bulk operation settles on, if timings are enabled. Limits are not kept
+  otherwise, so that long-running commands do not accumulate them.
+
+  Args:
+    limit |vmpooler_client.parallel.AdaptiveLimit| = The adaptive limit of the operation.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  if _start is None:
+    return
+
+  with _lock:
+    _limits.append(limit)
+
+
+def report():
+  """Summarize the requests made since timing was enabled, by endpoint, and the limit each
+  adaptive bulk operation settled on.
+
+  Args:
+    |None|
+
+  Returns:
+    |str| = The summary or "None" while timings are disabled.
+
+  Raises:
+    |None|
+  """
+
+  if _start is None:
+    return None
+
+  with _lock:
+    endpoints = sorted((endpoint, list(stats)) for endpoint, stats in _endpoints.items())
+    limits = list(_limits)
+
+  lines = ['Timings: {:.2f} seconds, {} requests'.format(
+    time() - _start, sum(stats[0] for _, stats in endpoints))]
+  width = max([len(endpoint) for endpoint, _ in endpoints] + [0])
+
+  for endpoint, (requests, failures, seconds, slowest) in endpoints:
+    lines.append('  {:<{}} | {} requests | {} failed | mean {:.3f}s | max {:.3f}s'.format(
+      endpoint, width, requests, failures, seconds / requests, slowest))
+
+  for limit in limits:
+    lines.append('  Concurrency of {}'.format(limit.describe()))
+
+  return '\n'.join(lines)
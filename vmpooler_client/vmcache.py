@@ -0,0 +1,281 @@
+"""
+.. module:: vmpooler_client.vmcache
+   :synopsis: Remember the facts about VMs which never change so that they need not be requested.
+   :platform: Unix, Linux, Windows
+   :license: BSD
+.. moduleauthor:: Ryan Gard <ryan.gard@puppetlabs.com>
+.. moduleauthor:: Joe Pinsonault <joe.pinsonault@puppetlabs.com>
+"""
+
+#===================================================================================================
+# Imports
+#===================================================================================================
+import os
+from os.path import dirname, join
+from tempfile import mkstemp
+from time import time
+from conf_file import locate_config
+from jsoncodec import loads, dumps
+
+#===================================================================================================
+# Globals
+#===================================================================================================
+CACHE_NAME = '.vmpooler.cache'
+
+#===================================================================================================
+# Classes: Public
+#===================================================================================================
+class VmCache(object):
+  """The template and start time of VMs seen by earlier commands, keyed by hostname. Neither
+  changes during the life of a VM, so a cached entry is never stale while the VM is running. The
+  cache also keeps the last list of templates seen, which is only used for completion. The cache
+  is best-effort: an unreadable cache is treated as empty and failures to save it are ignored.
+
+  Args:
+    path |str| = The path of the cache file.
+
+  Raises:
+    |None|
+  """
+
+  def __init__(self, path):
+
+    self.path = path
+    self._vms = {}
+    self._templates = []
+    self._dirty = False
+
+    try:
+      with open(path, 'r') as f:
+        data = loads(f.read())
+
+      self._vms = data.get('vms', {})
+      self._templates = data.get('templates', [])
+    except (IOError, ValueError, AttributeError):
+      pass
+
+  def get(self, hostname):
+    """Return the cached template and start time of a VM.
+
+    Args:
+      hostname |str| = The hostname of the VM.
+
+    Returns:
+      |(str, float)| = The template and the time the VM started in seconds since the epoch, or
+        "None" if the VM is not cached.
+
+    Raises:
+      |None|
+    """
+
+    entry = self._vms.get(hostname)
+
+    if entry is None:
+      return None
+
+    return (entry.get('template'), entry.get('started'))
+
+  def running_hours(self, hostname, now=None):
+    """Return how long a cached VM has been running.
+
+    Args:
+      hostname |str| = The hostname of the VM.
+      now |float| = The current time. Defaults to the time of the call.
+
+    Returns:
+      |float| = The number of hours the VM has been running or "None" if it is not known.
+
+    Raises:
+      |None|
+    """
+
+    entry = self._vms.get(hostname) or {}
+
+    if entry.get('started') is None:
+      return None
+
+    return ((time() if now is None else now) - entry['started']) / 3600.0
+
+  def remember(self, hostname, template, running=0.0, now=None):
+    """Cache a VM.
+
+    Args:
+      hostname |str| = The hostname of the VM.
+      template |str| = The template the VM was created from.
+      running |float| = The number of hours the VM has been running. Zero for a new VM.
+      now |float| = The time "running" was measured. Defaults to the time of the call.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    if template is None:
+      return
+
+    entry = {'template': template}
+
+    if running is not None:
+      entry['started'] = round((time() if now is None else now) - running * 3600.0, 1)
+
+    if self._vms.get(hostname) != entry:
+      self._vms[hostname] = entry
+      self._dirty = True
+
+  def remember_records(self, records, now=None):
+    """Cache the VMs of a list of records.
+
+    Args:
+      records |[VmRecord]| = The records.
+      now |float| = The time the records were retrieved. Defaults to the time of the call.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    now = time() if now is None else now
+
+    for vm in records:
+      self.remember(vm.hostname, vm.template, vm.running, now)
+
+  def forget(self, hostnames):
+    """Remove VMs from the cache.
+
+    Args:
+      hostnames |[str]| = The hostnames of the VMs.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    for hostname in hostnames:
+      if self._vms.pop(hostname, None) is not None:
+        self._dirty = True
+
+  def retain(self, hostnames):
+    """Remove every VM which is not in the given list, e.g. the running VMs of the token.
+
+    Args:
+      hostnames |[str]| = The hostnames of the VMs to keep.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    keep = set(hostnames)
+
+    self.forget([hostname for hostname in self._vms if hostname not in keep])
+
+  def hostnames(self):
+    """Return the hostnames of the cached VMs.
+
+    Returns:
+      |[str]| = The hostnames.
+
+    Raises:
+      |None|
+    """
+
+    return sorted(self._vms)
+
+  def remember_templates(self, templates):
+    """Cache the list of templates offered by the vmpooler.
+
+    Args:
+      templates |[str]| = The template names.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    templates = sorted(templates)
+
+    if self._templates != templates:
+      self._templates = templates
+      self._dirty = True
+
+  def templates(self):
+    """Return the templates last seen.
+
+    Returns:
+      |[str]| = The template names.
+
+    Raises:
+      |None|
+    """
+
+    return list(self._templates)
+
+  def save(self):
+    """Write the cache if it has changed. The file is replaced atomically so that concurrent
+    commands never read a partial cache.
+
+    Returns:
+      |None|
+
+    Raises:
+      |None|
+    """
+
+    if not self._dirty:
+      return
+
+    try:
+      fd, tmp_path = mkstemp(dir=dirname(self.path) or '.', prefix='.vmpooler_client_cache')
+
+      with os.fdopen(fd, 'w') as f:
+        f.write(dumps({'vms': self._vms, 'templates': self._templates}))
+
+      os.rename(tmp_path, self.path)
+      self._dirty = False
+    except (IOError, OSError):
+      pass
+
+
+#===================================================================================================
+# Functions: Public
+#===================================================================================================
+def locate_cache():
+  """Locate the cache file, which lives next to the configuration file.
+
+  Args:
+    |None|
+
+  Returns:
+    |str| = The path to the cache file.
+
+  Raises:
+    |RuntimeError| = Unsupported platform.
+  """
+
+  return join(dirname(locate_config()), CACHE_NAME)
+
+
+def load_cache():
+  """Load the VM cache.
+
+  Args:
+    |None|
+
+  Returns:
+    |VmCache| = The cache.
+
+  Raises:
+    |RuntimeError| = Unsupported platform.
+  """
+
+  return VmCache(locate_cache())
@@ -13,14 +13,71 @@
 #===================================================================================================
 from __future__ import print_function
 import sys
-from vmpooler_client.conf_file import load_config
+from functools import partial
+from socket import error as socket_error
+from vmpooler_client import (cassette, hooks, jsoncodec, metrics, profiling, service, shell,
+                             timings)
+from vmpooler_client.conf_file import load_config, get_flag, get_float
+from vmpooler_client.ratelimit import parse_rates
+from vmpooler_client.resolver import DEFAULT_TTL
+from vmpooler_client.proxy import DEFAULT_TTL as PROXY_TTL
 from vmpooler_client.command_parser import CommandParser, valid_lifetime
-from vmpooler_client.commands import config, lifetime, token, vm
+from vmpooler_client.commands import completion, config, lifetime, proxy, token, vm
 from vmpooler_client.version import version
 
+#===================================================================================================
+# Globals
+#===================================================================================================
+# Top-level commands which never contact the vmpooler.
+_LOCAL_COMMANDS = ('config', 'version')
+
+# Commands which keep running, and so are worth serving metrics for.
+_SERVING_COMMANDS = ('shell', 'proxy')
+
 #===================================================================================================
 # Functions: Private (Subcommands)
 #===================================================================================================
+def _configure_completion_subcommands(cmd_parser):
+  """Configure the subcommands for the "completion" top-level command.
+
+  Args:
+    cmd_parser |vmpooler_client.command_parser.CommandParser| = The command parser.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  parent = 'completion'
+
+  # Bash and Zsh Subcommands
+  for sub_cmd in completion.SHELLS:
+    cmd_parser.add_sub_command(parent,
+                               sub_cmd,
+                               desc='Write the {} completion script'.format(sub_cmd),
+                               func=partial(completion.script, cmd_parser, sub_cmd))
+    cmd_parser.add_sub_command_arg(parent,
+                                   sub_cmd,
+                                   name='file',
+                                   help='The file to write the script to')
+
+  # Refresh Subcommand
+  sub_cmd = 'refresh'
+
+  cmd_parser.add_sub_command(parent,
+                             sub_cmd,
+                             desc='Refresh the templates and hostnames offered by completion',
+                             func=completion.refresh)
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--local',
+                                 action='store_true',
+                                 help='Only rebuild the index from the VM cache without '
+                                      'querying the vmpooler')
+
+
 def _configure_config_subcommands(cmd_parser):
   """Configure the subcommands for the "config" top-level command.
 
@@ -105,18 +162,27 @@ def _configure_lifetime_subcommands(cmd_parser):
 
   cmd_parser.add_sub_command(parent,
                              sub_cmd,
-                             desc='Set the total lifetime (in hours) for a VM instance',
+                             desc='Set the total lifetime (in hours) for one or more VM instances',
                              func=lifetime.set)
   cmd_parser.add_sub_command_arg(parent,
                                  sub_cmd,
                                  name='hostname',
-                                 help='The hostname of the VM to set the lifetime expiry')
+                                 nargs='+',
+                                 help='The hostnames of the VMs to set the lifetime expiry')
   cmd_parser.add_sub_command_arg(parent,
                                  sub_cmd,
                                  name='hours',
                                  help='The number of hours to set for the lifetime expiry',
                                  type=valid_lifetime)
 
+  # Resume Subcommand
+  sub_cmd = 'resume'
+
+  cmd_parser.add_sub_command(parent,
+                             sub_cmd,
+                             desc='Resume an interrupted lifetime set, skipping the VMs it changed',
+                             func=lifetime.resume)
+
   # Get Subcommand
   sub_cmd = 'get'
 
@@ -227,7 +293,28 @@ The search string is matched fuzzily. For example:
   sub_cmd = 'get'
 
   cmd_parser.add_sub_command(parent, sub_cmd, desc='Get a vm from the pool', func=vm.get)
-  cmd_parser.add_sub_command_arg(parent, sub_cmd, name='platform', help='The type of vm to aquire')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='platform',
+                                 nargs='+',
+                                 help='The type of vm to aquire. Repeat to get several VMs.')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--ready',
+                                 action='store_true',
+                                 help='Wait until every VM resolves and accepts connections')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--ready-port',
+                                 type=int,
+                                 default=22,
+                                 help='The TCP port probed by --ready (default: 22)')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--ready-timeout',
+                                 type=float,
+                                 default=300,
+                                 help='Seconds to wait for --ready (default: 300)')
 
   # Info Subcommand
   sub_cmd = 'info'
@@ -239,22 +326,243 @@ The search string is matched fuzzily. For example:
   sub_cmd = 'destroy'
 
   cmd_parser.add_sub_command(parent, sub_cmd, desc='Destroy vm', func=vm.destroy)
-  cmd_parser.add_sub_command_arg(parent, sub_cmd, name='hostname', help='VM hostname to destory')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='hostname',
+                                 nargs='*',
+                                 help='VM hostnames to destroy, glob patterns matched against the '
+                                      'running VMs, or "-" to read hostnames from stdin')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--fuzzy',
+                                 action='store_true',
+                                 help='Fuzzily match the hostnames against the running VMs')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--resume',
+                                 action='store_true',
+                                 help='Resume an interrupted destroy, skipping the VMs it '
+                                      'destroyed')
 
   # Running Subcommand
   sub_cmd = 'running'
 
   cmd_parser.add_sub_command(parent, sub_cmd, desc='List running VMs', func=vm.running)
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--template',
+                                 help='Only list VMs whose template fuzzily matches this string')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--older-than',
+                                 type=float,
+                                 metavar='HOURS',
+                                 help='Only list VMs running for at least this many hours')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--younger-than',
+                                 type=float,
+                                 metavar='HOURS',
+                                 help='Only list VMs running for at most this many hours')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--sort',
+                                 choices=sorted(vm.SORT_FIELDS),
+                                 default='running',
+                                 help='The field to sort on (default: running)')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--limit',
+                                 type=int,
+                                 metavar='N',
+                                 help='Only list the first N VMs')
 
   # Destory All Subcommand
   sub_cmd = 'destroy_all'
 
   cmd_parser.add_sub_command(parent, sub_cmd, desc='Destroy all running VMs', func=vm.destroy_all)
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--resume',
+                                 action='store_true',
+                                 help='Resume an interrupted destroy_all without listing the VMs '
+                                      'again')
+
+  # Provision Subcommand
+  sub_cmd = 'provision'
+
+  cmd_parser.add_sub_command(parent,
+                             sub_cmd,
+                             desc='Release and change the VMs in a manifest, then get every VM '
+                                  'in it or none of them',
+                             func=vm.provision)
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='manifest',
+                                 help='A JSON or YAML file mapping templates to VM counts')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--inventory',
+                                 metavar='FILE',
+                                 help='Write the hostnames, templates and domains as JSON')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--deadline',
+                                 type=float,
+                                 help='Seconds to retry drained pools before releasing every VM '
+                                      '(default: the manifest "deadline" or 300)')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--retry-interval',
+                                 type=float,
+                                 default=5,
+                                 help='Seconds between attempts on a drained pool (default: 5)')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--dry-run',
+                                 action='store_true',
+                                 help='Print the order the manifest would be run in without '
+                                      'contacting the vmpooler')
+
+  # Snapshot Subcommand
+  sub_cmd = 'snapshot'
+
+  cmd_parser.add_sub_command(parent, sub_cmd, desc='Snapshot VMs', func=vm.snapshot)
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='hostname',
+                                 nargs='+',
+                                 help='VM hostnames to snapshot')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--save',
+                                 metavar='FILE',
+                                 help='Save the hostnames and snapshots for "vm recycle"')
+
+  # Revert Subcommand
+  sub_cmd = 'revert'
+
+  cmd_parser.add_sub_command(parent, sub_cmd, desc='Revert a VM to a snapshot', func=vm.revert)
+  cmd_parser.add_sub_command_arg(parent, sub_cmd, name='hostname', help='VM hostname to revert')
+  cmd_parser.add_sub_command_arg(parent, sub_cmd, name='snapshot', help='The snapshot to restore')
+
+  # Recycle Subcommand
+  sub_cmd = 'recycle'
+
+  cmd_parser.add_sub_command(parent,
+                             sub_cmd,
+                             desc='Revert every VM saved by "vm snapshot --save" in parallel',
+                             func=vm.recycle)
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='file',
+                                 nargs='?',
+                                 help='The file written by "vm snapshot --save" or "-" for stdin')
+  cmd_parser.add_sub_command_arg(parent,
+                                 sub_cmd,
+                                 name='--resume',
+                                 action='store_true',
+                                 help='Resume an interrupted recycle, skipping the VMs it reverted')
 
 
 #===================================================================================================
 # Functions: Public
 #===================================================================================================
+def prewarm_connection(args, config):
+  """Start connecting to the vmpooler while the command starts up, unless the command never
+  contacts it or pre-warming is disabled with the "prewarm_connection" setting.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |None|
+  """
+
+  # Replayed commands never contact the vmpooler.
+  if args.command in _LOCAL_COMMANDS or args.replay_cassette:
+    return
+
+  if config.get('vmpooler_hostname') and get_flag(config, 'prewarm_connection', True):
+    service.prewarm(config['vmpooler_hostname'])
+
+
+def configure_service(config):
+  """Apply the optional service layer settings from the configuration file.
+
+  Args:
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = A setting has an invalid value.
+  """
+
+  if config.get('json_codec'):
+    try:
+      jsoncodec.use(config['json_codec'])
+    except ValueError as e:
+      raise RuntimeError(e)
+
+  if get_flag(config, 'hedge_requests'):
+    try:
+      service.enable_hedging(percentile=get_float(config, 'hedge_percentile', 95),
+                             max_ratio=get_float(config, 'hedge_max_ratio', 0.05))
+    except ValueError as e:
+      raise RuntimeError(e)
+
+  if config.get('rate_limit') or config.get('rate_limit_endpoints'):
+    try:
+      service.enable_rate_limit(rate=get_float(config, 'rate_limit', 0) or None,
+                                endpoint_rates=parse_rates(config.get('rate_limit_endpoints', '')),
+                                burst=get_float(config, 'rate_limit_burst', 1),
+                                state_file=config.get('rate_limit_state_file'))
+    except ValueError as e:
+      raise RuntimeError(e)
+
+  if config.get('dns_ttl') is not None or config.get('dns_cache_file'):
+    try:
+      service.enable_dns_cache(ttl=get_float(config, 'dns_ttl', DEFAULT_TTL),
+                               state_file=config.get('dns_cache_file'))
+    except ValueError as e:
+      raise RuntimeError(e)
+
+  if config.get('metrics_textfile'):
+    metrics.enable()
+
+
+def serve_metrics(args, config):
+  """Serve metrics on the port of the "metrics_port" setting if the command keeps running.
+  Short-lived commands do not bind the port, so they never clash with a running shell or proxy.
+
+  Args:
+    args |argparse.Namespace| = A collection of arguments and flags.
+    config |{str:str}| = A dictionary of settings from the configuration file.
+
+  Returns:
+    |None|
+
+  Raises:
+    |RuntimeError| = The setting has an invalid value or the port could not be bound.
+  """
+
+  if not (args.command in _SERVING_COMMANDS and config.get('metrics_port')):
+    return
+
+  port = int(get_float(config, 'metrics_port', 0))
+
+  try:
+    metrics.serve(port)
+  except socket_error as e:
+    raise RuntimeError('Failed to serve metrics on port {}! {}'.format(port, e))
+
+
 def configure_command_parser(argv):
   """Configure the custom command parser.
 
@@ -271,18 +579,87 @@ def configure_command_parser(argv):
   # Custom parser for CLI commands and sub-commands
   cmd_parser = CommandParser(argv)
 
+  # Options for every command
+  cmd_parser.add_global_arg(name='--hook',
+                            action='append',
+                            default=[],
+                            metavar='MODULE:FUNC',
+                            help='Install request hooks by calling FUNC from MODULE with the '
+                                 '"vmpooler_client.hooks" module. May be repeated.')
+  cmd_parser.add_global_arg(name='--profile',
+                            choices=profiling.PROFILERS,
+                            help='Run the command under the CPU profiler or tracemalloc. '
+                                 '"mem" needs the "pytracemalloc" backport on Python 2.7, which '
+                                 'only works on an interpreter built with its patch')
+  cmd_parser.add_global_arg(name='--profile-output',
+                            metavar='PATH',
+                            help='Where to write the profile. Defaults to "{}" or "{}" in the '
+                                 'current directory.'.format(profiling.default_output('cpu'),
+                                                             profiling.default_output('mem')))
+  cmd_parser.add_global_arg(name='--profile-top',
+                            metavar='N',
+                            type=int,
+                            default=20,
+                            help='The number of entries to show in the profile summary')
+  cmd_parser.add_global_arg(name='--timings',
+                            action='store_true',
+                            help='Summarize the requests made by the command and the concurrency '
+                                 'chosen for its bulk operations')
+  cmd_parser.add_global_arg(name='--record-cassette',
+                            metavar='PATH',
+                            help='Record every exchange with the vmpooler to a cassette file')
+  cmd_parser.add_global_arg(name='--replay-cassette',
+                            metavar='PATH',
+                            help='Answer every request from a recorded cassette file instead of '
+                                 'the vmpooler')
+  cmd_parser.add_global_arg(name='--replay-speed',
+                            metavar='FACTOR',
+                            type=float,
+                            default=1.0,
+                            help='Multiply the recorded latency of replayed exchanges. "0" '
+                                 'replies at once.')
+
   # Top-level commands WITHOUT sub-commands
   cmd_parser.add_command('version',
                          desc='Print the vmpooler_client_app version',
                          func=lambda *args, **kwargs: print(version))
+  cmd_parser.add_command('shell',
+                         desc='Run commands interactively in one session, keeping connections '
+                              'and caches warm. Commands are read from stdin when it is not a '
+                              'terminal.',
+                         func=lambda args, config: shell.run(cmd_parser, config))
+  cmd_parser.add_command('proxy',
+                         desc='Serve the vmpooler API on this host, caching and coalescing reads '
+                              'of VMs and tokens for every client that points at it',
+                         func=proxy.serve)
+  cmd_parser.add_command_arg('proxy',
+                             name='--bind',
+                             default='127.0.0.1',
+                             help='The address to listen on')
+  cmd_parser.add_command_arg('proxy',
+                             name='--port',
+                             type=int,
+                             default=8080,
+                             help='The port to listen on')
+  cmd_parser.add_command_arg('proxy',
+                             name='--ttl',
+                             type=float,
+                             default=PROXY_TTL,
+                             help='The number of seconds reads are served from the cache')
+  cmd_parser.add_command_arg('proxy',
+                             name='--upstream',
+                             help='The vmpooler to forward to. Defaults to the "proxy_upstream" '
+                                  'or "vmpooler_hostname" setting.')
 
   # Top-level commands with sub-commands
+  cmd_parser.add_command('completion', desc='Complete commands, templates and VMs in bash or zsh')
   cmd_parser.add_command('config', desc='Read and modify the vmpooler configuration file')
   cmd_parser.add_command('lifetime', desc='Manage the lifetime of VM instances')
   cmd_parser.add_command('token', desc='Manage auth tokens')
   cmd_parser.add_command('vm', desc='Discover and reserve VM instances')
 
   # Configure subcommands
+  _configure_completion_subcommands(cmd_parser)
   _configure_config_subcommands(cmd_parser)
   _configure_lifetime_subcommands(cmd_parser)
   _configure_token_subcommands(cmd_parser)
@@ -317,17 +694,49 @@ def main(argv):
     config = load_config()
 
   try:
+    configure_service(config)
+
     # Parse the command-line and validate user input
     cmd_parser = configure_command_parser(argv)
 
+    args = cmd_parser.parse()
+
+    prewarm_connection(args, config)
+    serve_metrics(args, config)
+
+    for spec in args.hook:
+      hooks.load_hook(spec)
+
+    if args.timings:
+      timings.enable()
+
     # Execute the associated behavior with given sub-command and arguments
-    cmd_parser.parse_execute(config=config)
+    with cassette.use(args.record_cassette, args.replay_cassette, args.replay_speed):
+      if args.profile:
+        profiling.run_profiled(args.profile,
+                               lambda: cmd_parser.parse_execute(config=config),
+                               output=args.profile_output,
+                               top=args.profile_top)
+      else:
+        cmd_parser.parse_execute(config=config)
 
     print('\nSuccess!')
   except RuntimeError as e:
     exit_code = 1
     print(e)
     print('\nFailed!')
+  finally:
+    if config.get('metrics_textfile'):
+      try:
+        metrics.write_textfile(config['metrics_textfile'])
+      except IOError as e:
+        sys.stderr.write('Failed to write the "{}" metrics file! {}\n'.format(
+          config['metrics_textfile'], e))
+
+    summary = timings.report()
+
+    if summary:
+      sys.stderr.write(summary + '\n')
 
   return exit_code
 